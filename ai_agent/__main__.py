@@ -1,16 +1,66 @@
+import argparse
+import itertools
+import json
 import os
+from typing import Dict, Iterator, Tuple
+
 from dotenv import load_dotenv
 from .connectors.jira import JiraConnector
 from .connectors.github import GitHubConnector
-from .analysis import CodeAnalyzer
+from .analysis import CodeAnalyzer, format_bug_text
 from .memory import SimpleMemory
+from .result_cache import ResultCache
 from .agent import BugTriageAgent
+from .checkpoint import TriageCheckpoint, jql_since
+from .code_index import LocalCodeIndex
 from .connectors.jira_ws import JiraWebSocketClient
 
 
+def read_tickets(path: str) -> Iterator[Tuple[str, Dict[str, str]]]:
+    """Yield ``(text, solution)`` pairs from a JSON lines file of past tickets.
+
+    Each line holds either ``text``/``solution`` or the ``title``/
+    ``description``/``fix`` keys accepted by the analyzer service's
+    ``/remember`` endpoint.
+    """
+    with open(path) as fh:
+        for line in fh:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "text" in record:
+                yield record["text"], record.get("solution", {})
+            else:
+                text = format_bug_text(record.get("title", ""), record.get("description", "") or "")
+                yield text, record.get("fix", {})
+
+
+def import_memory(path: str, batch_size: int | None = None, chunk_size: int = 1000) -> None:
+    """Bulk-load past tickets from *path* into the memory file."""
+    memory = SimpleMemory(path=os.environ.get("MEMORY_FILE", "memory.json"))
+    tickets = read_tickets(path)
+    total = 0
+    while True:
+        chunk = list(itertools.islice(tickets, chunk_size))
+        if not chunk:
+            break
+        total += memory.add_many(chunk, batch_size=batch_size)
+        print(f"Imported {total} tickets")
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="python -m ai_agent", description="AI bug triage agent")
+    commands = parser.add_subparsers(dest="command")
+    importer = commands.add_parser("import-memory", help="bulk-load past tickets into the memory")
+    importer.add_argument("file", help="JSON lines file of past tickets")
+    importer.add_argument("--batch-size", type=int, help="texts per embedding batch")
+    args = parser.parse_args(argv)
 
-def main():
     load_dotenv()
+    if args.command == "import-memory":
+        import_memory(args.file, args.batch_size)
+        return
+
     jira_url = os.environ.get("JIRA_URL")
     jira_user = os.environ.get("JIRA_USER")
     jira_token = os.environ.get("JIRA_TOKEN")
@@ -25,19 +75,42 @@ def main():
 
     memory_file = os.environ.get("MEMORY_FILE", "memory.json")
     memory = SimpleMemory(path=memory_file)
-    analyzer = CodeAnalyzer(memory=memory)
 
     repo = os.environ.get("GITHUB_REPO")
     gh_token = os.environ.get("GITHUB_TOKEN")
     if not repo or not gh_token:
         raise SystemExit("GITHUB_REPO and GITHUB_TOKEN must be set")
 
+    code_index = LocalCodeIndex.from_env(repo, gh_token)
+    analyzer = CodeAnalyzer(
+        memory=memory,
+        source_root=code_index.root if code_index else None,
+        result_cache=ResultCache.from_env(),
+    )
     github = GitHubConnector(repo, gh_token)
-    agent = BugTriageAgent(jira, github, analyzer)
+    checkpoint = TriageCheckpoint(os.environ.get("TRIAGE_CHECKPOINT", "triage_checkpoint.json"))
+    agent = BugTriageAgent(
+        jira,
+        github,
+        analyzer,
+        max_workers=int(os.environ.get("TRIAGE_WORKERS", 1)),
+        code_index=code_index,
+        checkpoint=checkpoint,
+    )
     ws_url = os.environ.get("JIRA_WS_URL")
     if ws_url:
-        ws = JiraWebSocketClient(ws_url)
-        ws.listen(agent.process_bug)
+        ws = JiraWebSocketClient(
+            ws_url,
+            workers=int(os.environ.get("WS_WORKERS", 2)),
+            max_pending=int(os.environ.get("WS_QUEUE_SIZE", 100)),
+        )
+
+        def missed_bugs(lost_at: float):
+            # Bugs reported while the socket was down are picked up from Jira
+            bugs = jira.iter_open_bugs(project_key, updated_since=jql_since(lost_at))
+            return (bug for bug in bugs if not checkpoint.is_current(bug))
+
+        ws.listen(agent.process_bug, on_resume=missed_bugs)
     else:
         agent.triage(project_key)
 
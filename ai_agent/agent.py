@@ -1,24 +1,133 @@
-from typing import List
+import re
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterable, Iterator, List, Set
 
 from .connectors.jira import JiraConnector
 from .connectors.github import GitHubConnector
 from .analysis import CodeAnalyzer
+from .checkpoint import TriageCheckpoint
+from .code_index import LocalCodeIndex
+
+
+# Common English and bug-report words that make poor code search terms
+STOPWORDS = frozenset(
+    """
+    about above after again against also anything because been before being
+    below between both cannot could does doing down during each error every
+    expected from further have having here into issue itself just like more
+    most much never only other over problem same seems should some something
+    such than that their them then there these they this those through under
+    until very want were what when where which while will with would your
+    actual behavior behaviour broken description fails failing happens steps
+    reproduce title working
+    """.split()
+)
+_WORD = re.compile(r"[A-Za-z_][A-Za-z0-9_.]*[A-Za-z0-9_]")
 
 
 class BugTriageAgent:
-    """Handle bug triage using Jira and GitHub."""
+    """Handle bug triage using Jira and GitHub.
 
-    def __init__(self, jira: JiraConnector, github: GitHubConnector, analyzer: CodeAnalyzer):
+    With ``max_workers`` above one, :meth:`triage` runs bugs on a thread pool
+    with at most ``max_in_flight`` (default ``max_workers``) submitted at once.
+    When a :class:`LocalCodeIndex` is given, related files are looked up in it
+    instead of through the GitHub search API. With a :class:`TriageCheckpoint`,
+    :meth:`triage` only fetches issues updated since the previous run and
+    skips those already triaged at their current ``updated`` timestamp.
+    """
+
+    def __init__(
+        self,
+        jira: JiraConnector,
+        github: GitHubConnector,
+        analyzer: CodeAnalyzer,
+        max_workers: int = 1,
+        max_in_flight: int | None = None,
+        code_index: LocalCodeIndex | None = None,
+        checkpoint: TriageCheckpoint | None = None,
+    ):
         self.jira = jira
         self.github = github
         self.analyzer = analyzer
+        self.max_workers = max(1, max_workers)
+        self.max_in_flight = max(self.max_workers, max_in_flight or self.max_workers)
+        self.code_index = code_index
+        self.checkpoint = checkpoint
+
+    def triage(self, project_key: str) -> List[Dict[str, Any]]:
+        """Process every open bug and return a per-bug report.
 
-    def triage(self, project_key: str):
-        bugs = self.jira.get_open_bugs(project_key)
+        A failing bug is recorded with ``status`` ``"error"`` and does not
+        stop the others.
+        """
+        started = time.time()
+        retried: List[str] = []
+        returned: Set[str] = set()
+        if self.checkpoint is not None:
+            retried = list(self.checkpoint.failed)
+            # Pages are fetched lazily so the first bugs start before the last page arrives
+            bugs = self.jira.iter_open_bugs(
+                project_key,
+                updated_since=self.checkpoint.updated_since(),
+                include_keys=retried,
+            )
+            bugs = self._unprocessed(bugs, returned)
+        else:
+            bugs = self.jira.iter_open_bugs(project_key)
+        results: List[Dict[str, Any]] = []
+        if self.max_workers == 1:
+            results = [self._run(bug) for bug in bugs]
+        else:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                in_flight: Set[Future] = set()
+                for bug in bugs:
+                    if len(in_flight) >= self.max_in_flight:
+                        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        results.extend(f.result() for f in done)
+                    in_flight.add(pool.submit(self._run, bug))
+                results.extend(f.result() for f in wait(in_flight).done)
+        if self.checkpoint is not None:
+            self.checkpoint.finish_run(started, retried, returned)
+        self.print_summary(results)
+        return results
+
+    def _unprocessed(self, bugs: Iterable[dict], returned: Set[str]) -> Iterator[dict]:
+        """Yield the *bugs* not yet triaged at their current version, noting every key in *returned*."""
         for bug in bugs:
-            self.process_bug(bug)
+            returned.add(bug.get("key"))
+            if not self.checkpoint.is_current(bug):
+                yield bug
+
+    def _run(self, bug) -> Dict[str, Any]:
+        """Process *bug*, capturing its outcome and latency instead of raising."""
+        start = time.perf_counter()
+        result: Dict[str, Any] = {"key": bug.get("key")}
+        try:
+            result["review_url"] = self.process_bug(bug)
+            result["status"] = "ok"
+        except Exception as exc:  # one bad bug must not abort the run
+            result["status"] = "error"
+            result["error"] = f"{type(exc).__name__}: {exc}"
+            print(f"Failed to triage {result['key']}: {result['error']}")
+            # A bug whose review was already recorded is not retried
+            if self.checkpoint is not None and result["key"] and not self.checkpoint.is_current(bug):
+                self.checkpoint.record_failure(result["key"])
+        result["seconds"] = time.perf_counter() - start
+        return result
+
+    @staticmethod
+    def print_summary(results: List[Dict[str, Any]]) -> None:
+        """Print per-bug outcome and latency followed by totals."""
+        for r in results:
+            detail = r.get("review_url") if r["status"] == "ok" else r.get("error")
+            print(f"{r['key']}: {r['status']} in {r['seconds']:.1f}s ({detail})")
+        failed = sum(1 for r in results if r["status"] != "ok")
+        total = sum(r["seconds"] for r in results)
+        print(f"Triaged {len(results)} bugs: {len(results) - failed} ok, {failed} failed, {total:.1f}s of work")
 
-    def process_bug(self, bug) -> None:
+    def process_bug(self, bug) -> str | None:
         """Run analysis and create a review for a single bug."""
         key = bug["key"]
         fields = bug.get("fields", {})
@@ -27,26 +136,61 @@ class BugTriageAgent:
         files = self.find_related_files(summary, description)
         fix = self.analyzer.analyze_bug(summary, description, files)
         review_url = self.create_review(key, summary, fix)
-        self.analyzer.remember(summary, description, fix)
+        if self.checkpoint is not None:
+            # Recorded before anything else can fail, so a retry never opens a second PR
+            self.checkpoint.record(key, fields.get("updated"), self.branch_name(key), review_url)
         print(f"Created review for {key}: {review_url}")
+        self.analyzer.remember(summary, description, fix)
+        return review_url
 
     def find_related_files(self, title: str, description: str) -> List[str]:
         """Try to locate relevant files using bug text."""
 
-        words = {
-            w.strip(".,").lower()
-            for w in (title + " " + description).split()
-            if len(w) > 3
-        }
-        return self.github.search_code(list(words))
+        text = title + " " + description
+        if self.code_index is not None:
+            self.code_index.update()
+            return self.code_index.search(self.rank_keywords(text, limit=20), max_results=5)
+        return self.github.search_code(self.rank_keywords(text))
+
+    @staticmethod
+    def rank_keywords(text: str, limit: int = 6) -> List[str]:
+        """Pick the *limit* words of *text* most likely to name code.
+
+        Stopwords and short words are dropped. Identifier-looking words
+        (``snake_case``, ``camelCase`` or dotted names) rank first, then
+        words that repeat, then longer words.
+        """
+
+        counts: Counter = Counter()
+        shapes = {}
+        for raw in _WORD.findall(text):
+            word = raw.lower()
+            if len(word) <= 3 or word in STOPWORDS:
+                continue
+            counts[word] += 1
+            identifier = "_" in raw or "." in raw or (raw[1:] != raw[1:].lower())
+            shapes[word] = shapes.get(word, False) or identifier
+        ranked = sorted(counts, key=lambda w: (not shapes[w], -counts[w], -len(w)))
+        return ranked[:limit]
+
+    @staticmethod
+    def branch_name(bug_key: str) -> str:
+        return f"bugfix-{bug_key}".lower().replace(" ", "-")
 
     def create_review(self, bug_key: str, summary: str, fix: dict) -> str:
-        """Create a GitHub pull request with the suggested fix."""
+        """Create a GitHub pull request with the suggested fix.
+
+        If the checkpoint already holds a pull request for *bug_key*, the fix
+        is committed to its branch and the existing URL is returned.
+        """
 
-        branch = f"bugfix-{bug_key}".lower().replace(" ", "-")
+        branch = self.branch_name(bug_key)
+        existing = self.checkpoint.review_url(bug_key) if self.checkpoint is not None else None
         self.github.ensure_branch(branch, "main")
         if fix:
             self.github.commit_files(branch, fix, "Automated fix")
+        if existing:
+            return existing
         github_pr = self.github.create_pull_request(
             title=f"Fix: {summary}", head=branch, base="main", body="Automated fix"
         )
@@ -1,46 +1,340 @@
+import copy
 import os
+import re
 from pathlib import Path
-from typing import List, Dict
+from typing import Dict, List, Tuple
 
-from transformers import AutoModelForCausalLM, AutoTokenizer
-from .memory import SimpleMemory
+import torch
+from .context import build_context
+from .inference import inference_mode
+from .memory import SimpleMemory, lexical_similarity
+from .models import registry
+from .result_cache import ResultCache, result_key
+
+MAX_NEW_TOKENS = 120
+
+
+def available_memory() -> int:
+    """Return the bytes of memory currently available to new allocations."""
+    try:
+        with open("/proc/meminfo") as fh:
+            for line in fh:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return 1 << 30
+
+
+def _expand_cache(cache, batch: int):
+    """Return a copy of a single-sequence key/value cache repeated *batch* times."""
+    if hasattr(cache, "batch_repeat_interleave"):
+        cache = copy.deepcopy(cache)
+        cache.batch_repeat_interleave(batch)
+        return cache
+    return tuple(
+        tuple(t.expand(batch, *t.shape[1:]).contiguous() for t in layer) for layer in cache
+    )
+
+
+class SharedPrefixUnsupported(Exception):
+    """The model cannot continue generation from a precomputed key/value cache."""
+
+
+def format_bug_text(title: str, description: str) -> str:
+    """Return the text used to embed and prompt for a bug report."""
+    return f"Bug Title: {title}\nDescription: {description}\n".strip()
+
+
+_LABELS = re.compile(r"^(?:Bug Title|Description):", re.MULTILINE)
+
+
+def bug_content(text: str) -> str:
+    """Return *text* from :func:`format_bug_text` without its field labels."""
+    return _LABELS.sub("", text)
 
 
 class CodeAnalyzer:
-    """Analyze bug reports with an open source language model and optional memory."""
+    """Analyze bug reports with an open source language model and optional memory.
+
+    File paths are read relative to *source_root* when one is given (e.g. a
+    local checkout of the repository) and to the working directory otherwise.
+    """
+
+    source_root: Path | None = None
+    model_name = "gpt2"
+    _tokenizer = None
+    _model = None
+    # Fixed generation batch size; ``None`` sizes batches from free memory
+    gen_batch_size: int | None = None
+    max_batch_size = 8
+    # Prompt size limit in tokens; ``None`` uses the model context minus the generated tokens
+    prompt_budget: int | None = None
+    # Share of the prompt budget the bug text may take before it is shortened
+    bug_text_share = 0.5
+    # Prompt stats of the latest analyze_bug call, replaced whole by each call
+    last_prompt_stats: Tuple[dict, ...] = ()
+    result_cache: ResultCache | None = None
+    # A remembered fix is reused only when its reranked score reaches this value
+    reuse_threshold = 0.85
+    reuse_candidates = 5
+    lexical_weight = 0.3
 
-    def __init__(self, model_name: str | None = None, memory: SimpleMemory | None = None) -> None:
-        self.model_name = model_name or os.environ.get("HF_MODEL", "gpt2")
-        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
-        self.model = AutoModelForCausalLM.from_pretrained(self.model_name)
+    def __init__(
+        self,
+        model_name: str | None = None,
+        memory: SimpleMemory | None = None,
+        source_root: str | Path | None = None,
+        result_cache: ResultCache | None = None,
+    ) -> None:
+        self.model_name = model_name or os.environ.get("HF_MODEL", self.model_name)
         self.memory = memory
+        self.source_root = Path(source_root) if source_root else None
+        self.result_cache = result_cache
+        self.reuse_threshold = float(os.environ.get("MEMORY_REUSE_THRESHOLD", self.reuse_threshold))
+        if os.environ.get("GEN_BATCH_SIZE"):
+            self.gen_batch_size = int(os.environ["GEN_BATCH_SIZE"])
+        self.max_batch_size = int(os.environ.get("GEN_MAX_BATCH", self.max_batch_size))
+        if os.environ.get("PROMPT_TOKEN_BUDGET"):
+            self.prompt_budget = int(os.environ["PROMPT_TOKEN_BUDGET"])
+        self.bug_text_share = float(os.environ.get("PROMPT_BUG_SHARE", self.bug_text_share))
+
+    @property
+    def tokenizer(self):
+        """Tokenizer of :attr:`model_name`, loaded through the shared registry on first use."""
+        if self._tokenizer is None:
+            self._tokenizer = registry.tokenizer(self.model_name)
+        return self._tokenizer
+
+    @tokenizer.setter
+    def tokenizer(self, value) -> None:
+        self._tokenizer = value
+
+    @property
+    def model(self):
+        """Causal language model of :attr:`model_name`, loaded on first use."""
+        if self._model is None:
+            self._model = registry.model(self.model_name, "causal")
+        return self._model
+
+    @model.setter
+    def model(self, value) -> None:
+        self._model = value
+
+    def warm_up(self) -> None:
+        """Load the model now instead of on the first analysis."""
+        registry.warm_up(self.model_name, "causal")
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+    def token_budget(self) -> int:
+        """Total prompt tokens allowed, leaving room for the generated patch."""
+        if self.prompt_budget:
+            return self.prompt_budget
+        context = getattr(self.tokenizer, "model_max_length", None)
+        # Tokenizers without a known limit report a huge sentinel value
+        if not isinstance(context, int) or context > 100_000:
+            context = 2048
+        return max(context - MAX_NEW_TOKENS, 1)
+
+    def fit_bug_text(self, bug_text: str) -> str:
+        """Shorten *bug_text* to ``bug_text_share`` of :meth:`token_budget`.
+
+        The beginning and end of an oversized report are kept, joined by a
+        ``...`` line, since titles and stack traces tend to sit at either end.
+        """
+        limit = int(self.token_budget() * self.bug_text_share)
+        ids = self.tokenizer.encode(bug_text, add_special_tokens=False)
+        if len(ids) <= limit:
+            return bug_text
+        marker = "\n...\n"
+        keep = max(limit - self.count_tokens(marker), 0)
+        half = keep // 2
+        head = self.tokenizer.decode(ids[: keep - half], skip_special_tokens=True)
+        tail = self.tokenizer.decode(ids[len(ids) - half :], skip_special_tokens=True) if half else ""
+        return head + marker + tail
+
+    def reusable_solution(self, bug_text: str) -> Dict[str, str] | None:
+        """Return a remembered fix similar enough to *bug_text* to reuse, if any.
+
+        The top ``reuse_candidates`` memories by embedding similarity are
+        reranked by mixing in the identifier overlap with the bug text, and
+        the best one is reused if its score reaches ``reuse_threshold``.
+        """
+        if not self.memory:
+            return None
+        best, best_score = None, -1.0
+        for entry, similarity in self.memory.search_scored(bug_text, top_k=self.reuse_candidates):
+            # The labels every report shares must not count as overlap
+            lexical = lexical_similarity(bug_content(bug_text), bug_content(entry.get("text", "")))
+            score = (1 - self.lexical_weight) * similarity + self.lexical_weight * lexical
+            if score > best_score:
+                best, best_score = entry, score
+        if best is None or best_score < self.reuse_threshold:
+            return None
+        print(f"Reusing remembered fix (score {best_score:.3f})")
+        return best["solution"]
+
+    def read_source(self, file: str) -> str:
+        try:
+            return (self.source_root / file if self.source_root else Path(file)).read_text()
+        except OSError:
+            return ""
+
+    def generation_params(self) -> dict:
+        """Settings that change the generated patch, part of the result cache key."""
+        return {
+            "max_new_tokens": MAX_NEW_TOKENS,
+            "top_p": 0.95,
+            "prompt_budget": self.token_budget(),
+            "backend": registry.backend,
+        }
+
+    def build_prompt(self, bug_text: str, file: str, code: str | None = None) -> Tuple[str, dict]:
+        """Return the prompt suffix for *file*, trimmed to the token budget, and its stats.
+
+        The file's most relevant chunks are kept so that the bug text, the
+        surrounding template and the code together fit :meth:`token_budget`;
+        *bug_text* should already be shortened by :meth:`fit_bug_text`.
+        Token counts are printed and returned along with the prompt.
+        """
+        if code is None:
+            code = self.read_source(file)
+        template = f"\nFile: {file}\nCode:\n{{}}\n# Suggested patch:\n"
+        overhead = self.count_tokens(bug_text + template.format(""))
+        code, stats = build_context(
+            file, code, bug_text, max(self.token_budget() - overhead, 0), self.count_tokens
+        )
+        stats["prompt_tokens"] = overhead + stats["code_tokens"]
+        stats["file"] = file
+        print(
+            f"Prompt for {file}: {stats['prompt_tokens']} tokens "
+            f"({stats['chunks_used']}/{stats['chunks']} chunks, "
+            f"{stats['code_tokens']}/{stats['file_tokens']} code tokens)"
+        )
+        return template.format(code), stats
+
+    def batch_size(self, seq_len: int) -> int:
+        """Pick how many sequences of *seq_len* tokens to generate at once.
+
+        Unless ``gen_batch_size`` is set, the batch is limited so the key/value
+        cache of the whole batch fits in half of the available memory.
+        """
+        if self.gen_batch_size:
+            return self.gen_batch_size
+        config = getattr(self.model, "config", None)
+        layers = getattr(config, "num_hidden_layers", None) or getattr(config, "n_layer", 12)
+        hidden = getattr(config, "hidden_size", None) or getattr(config, "n_embd", 768)
+        itemsize = getattr(getattr(self.model, "dtype", None), "itemsize", 4)
+        per_seq = 2 * layers * hidden * (seq_len + MAX_NEW_TOKENS) * itemsize
+        return max(1, min(self.max_batch_size, int(available_memory() * 0.5 // per_seq)))
+
+    def _generate(self, prompt: str) -> str:
+        input_ids = self.tokenizer.encode(prompt, return_tensors="pt")
+        output_ids = self.model.generate(
+            input_ids, max_new_tokens=MAX_NEW_TOKENS, do_sample=True, top_p=0.95
+        )
+        return self.tokenizer.decode(output_ids[0], skip_special_tokens=True)
+
+    def _generate_shared_prefix(self, prefix: str, suffixes: List[str]) -> List[str]:
+        """Generate ``prefix + suffix`` for every suffix in padded batches.
+
+        The prefix is run through the model once and its key/value cache is
+        reused by every sequence. Shorter suffixes are padded between the
+        prefix and the suffix with the padding masked out, so the cached
+        prefix positions stay identical across the batch.
+
+        Raises :class:`SharedPrefixUnsupported` if the model returns no cache
+        or its ``generate`` does not accept one.
+        """
+        tok = self.tokenizer
+        pad_id = tok.pad_token_id if tok.pad_token_id is not None else tok.eos_token_id
+        prefix_ids = tok(prefix, return_tensors="pt").input_ids
+        prefix_cache = getattr(self.model(prefix_ids, use_cache=True), "past_key_values", None)
+        if prefix_cache is None:
+            raise SharedPrefixUnsupported(f"{type(self.model).__name__} returns no key/value cache")
+        prefix_list = prefix_ids[0].tolist()
+        encoded = [tok(s, add_special_tokens=False).input_ids for s in suffixes]
+        # Similar lengths share a batch to keep padding small
+        order = sorted(range(len(encoded)), key=lambda i: len(encoded[i]))
+        size = self.batch_size(len(prefix_list) + len(encoded[order[-1]]))
+        texts: List[str] = [""] * len(suffixes)
+        for start in range(0, len(order), size):
+            chunk = order[start : start + size]
+            width = max(len(encoded[i]) for i in chunk)
+            rows, masks = [], []
+            for i in chunk:
+                pad = width - len(encoded[i])
+                rows.append(prefix_list + [pad_id] * pad + encoded[i])
+                masks.append([1] * len(prefix_list) + [0] * pad + [1] * len(encoded[i]))
+            input_ids, attention_mask = torch.tensor(rows), torch.tensor(masks)
+            cache = _expand_cache(prefix_cache, len(chunk))
+            try:
+                output_ids = self.model.generate(
+                    input_ids,
+                    attention_mask=attention_mask,
+                    past_key_values=cache,
+                    max_new_tokens=MAX_NEW_TOKENS,
+                    do_sample=True,
+                    top_p=0.95,
+                    pad_token_id=pad_id,
+                )
+            except (TypeError, ValueError) as exc:
+                # Rejected arguments or cache format; other errors (OOM included) propagate
+                raise SharedPrefixUnsupported(str(exc)) from exc
+            for i, ids in zip(chunk, output_ids):
+                texts[i] = tok.decode(ids, skip_special_tokens=True)
+        return texts
 
     def analyze_bug(self, title: str, description: str, files: List[str]) -> Dict[str, str]:
         """Use an LLM to suggest code fixes for the given files."""
 
-        bug_text = f"Bug Title: {title}\nDescription: {description}\n".strip()
+        bug_text = format_bug_text(title, description)
         fixes: Dict[str, str] = {}
-        if self.memory:
-            # Attempt to reuse existing solutions
-            past = self.memory.search(bug_text, top_k=1)
-            if past:
-                return past[0]["solution"]
+        # Attempt to reuse existing solutions
+        past = self.reusable_solution(bug_text)
+        if past is not None:
+            return past
+        self.last_prompt_stats = ()
+        # Patches already generated for this bug text and file content are reused
+        pending = []
         for file in files:
-            try:
-                code = Path(file).read_text()
-            except OSError:
-                code = ""
-            prompt = (
-                bug_text
-                + f"\nFile: {file}\nCode:\n{code}\n# Suggested patch:\n"
-            )
-            input_ids = self.tokenizer.encode(prompt, return_tensors="pt")
-            output_ids = self.model.generate(
-                input_ids, max_new_tokens=120, do_sample=True, top_p=0.95
-            )
-            text = self.tokenizer.decode(output_ids[0], skip_special_tokens=True)
-            patch = text.split("# Suggested patch:")[-1].strip()
-            fixes[file] = patch
+            code = self.read_source(file)
+            key = None
+            if self.result_cache is not None:
+                key = result_key(self.model_name, bug_text, file, code, self.generation_params())
+                patch = self.result_cache.get(key)
+                if patch is not None:
+                    fixes[file] = patch
+                    continue
+            pending.append((file, code, key))
+        if not pending:
+            return fixes
+
+        # The bug text is the shared prefix of every prompt, so it is shortened once
+        prompt_text = self.fit_bug_text(bug_text)
+        prompts = [self.build_prompt(prompt_text, file, code) for file, code, _ in pending]
+        suffixes = [suffix for suffix, _ in prompts]
+        # Concurrent calls each publish their own complete list
+        self.last_prompt_stats = tuple(stats for _, stats in prompts)
+        texts = None
+        with inference_mode():
+            if len(suffixes) > 1:
+                try:
+                    texts = self._generate_shared_prefix(prompt_text, suffixes)
+                except SharedPrefixUnsupported as exc:
+                    print(f"Shared-prefix generation unsupported, generating per file: {exc}")
+            if texts is None:
+                texts = [self._generate(prompt_text + suffix) for suffix in suffixes]
+        for (file, _, key), text in zip(pending, texts):
+            fixes[file] = text.split("# Suggested patch:")[-1].strip()
+            if key is not None:
+                self.result_cache.put(key, fixes[file])
+        fixes = {file: fixes[file] for file in files}
         if self.memory:
             self.memory.add(bug_text, fixes)
         return fixes
@@ -48,6 +342,5 @@ class CodeAnalyzer:
     def remember(self, title: str, description: str, fix: Dict[str, str]) -> None:
         """Persist the bug description and resulting fix."""
         if self.memory:
-            bug_text = f"Bug Title: {title}\nDescription: {description}\n".strip()
-            self.memory.add(bug_text, fix)
+            self.memory.add(format_bug_text(title, description), fix)
 
@@ -0,0 +1,131 @@
+"""Approximate nearest-neighbour index for :class:`~ai_agent.memory.SimpleMemory`."""
+
+import os
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+try:  # faiss is optional; exact search is used without it
+    import faiss
+except ModuleNotFoundError:  # pragma: no cover - optional dependency
+    faiss = None  # type: ignore
+
+
+KINDS = ("hnsw", "ivf")
+
+
+class AnnIndex:
+    """FAISS index over normalized embeddings using inner-product similarity.
+
+    ``hnsw`` indexes are usable immediately. ``ivf`` indexes need training, so
+    they only become :attr:`ready` once ``train_size`` vectors have been seen;
+    until then callers should fall back to exact search.
+    """
+
+    def __init__(
+        self,
+        kind: str,
+        path: str | Path,
+        hnsw_m: int = 32,
+        ef_search: int = 64,
+        nlist: int = 256,
+        nprobe: int = 16,
+        save_every: int = 256,
+    ) -> None:
+        if kind not in KINDS:
+            raise ValueError(f"unknown memory index {kind!r}, expected one of {KINDS}")
+        if faiss is None or not hasattr(faiss, "IndexHNSWFlat"):
+            raise RuntimeError(f"MEMORY_INDEX={kind} requires the faiss-cpu package")
+        self.kind = kind
+        self.path = Path(path)
+        self.hnsw_m = hnsw_m
+        self.ef_search = ef_search
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.save_every = save_every
+        self.train_size = nlist * 39 if kind == "ivf" else 0
+        self.index = None
+        self._unsaved = 0
+
+    @classmethod
+    def from_env(cls, path: str | Path, kind: str | None = None) -> Optional["AnnIndex"]:
+        """Create the index selected by ``MEMORY_INDEX`` (``None`` for exact search)."""
+        kind = (kind or os.environ.get("MEMORY_INDEX", "exact")).strip().lower()
+        if kind in ("", "exact"):
+            return None
+        return cls(
+            kind,
+            path,
+            hnsw_m=int(os.environ.get("MEMORY_HNSW_M", 32)),
+            ef_search=int(os.environ.get("MEMORY_HNSW_EF_SEARCH", 64)),
+            nlist=int(os.environ.get("MEMORY_IVF_NLIST", 256)),
+            nprobe=int(os.environ.get("MEMORY_IVF_NPROBE", 16)),
+        )
+
+    @property
+    def ready(self) -> bool:
+        return self.index is not None and self.index.is_trained
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal if self.index is not None else 0
+
+    def _create(self, dim: int, training: np.ndarray) -> None:
+        if self.kind == "hnsw":
+            index = faiss.IndexHNSWFlat(dim, self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efSearch = self.ef_search
+        else:
+            quantizer = faiss.IndexFlatIP(dim)
+            index = faiss.IndexIVFFlat(quantizer, dim, self.nlist, faiss.METRIC_INNER_PRODUCT)
+            index.train(training)
+            index.nprobe = self.nprobe
+        self.index = index
+
+    def sync(self, vectors: np.ndarray) -> None:
+        """Load the persisted index and add any rows of *vectors* it is missing.
+
+        The embedding file is the source of truth, so an index that is stale
+        (saved before the last few ``add`` calls) is caught up here and one
+        that does not match at all is rebuilt.
+        """
+        self.index = None
+        if self.path.is_file():
+            index = faiss.read_index(str(self.path))
+            if index.ntotal <= len(vectors) and (not len(vectors) or index.d == vectors.shape[1]):
+                self.index = index
+                if self.kind == "hnsw":
+                    index.hnsw.efSearch = self.ef_search
+                else:
+                    index.nprobe = self.nprobe
+        missing = len(vectors) - self.ntotal
+        if missing:
+            self.add(vectors[-missing:], vectors)
+
+    def add(self, rows: np.ndarray, vectors: np.ndarray) -> None:
+        """Insert *rows*, the newest tail of *vectors* (all stored embeddings)."""
+        if self.index is None:
+            if len(vectors) < max(self.train_size, 1):
+                return
+            self._create(vectors.shape[1], np.ascontiguousarray(vectors, dtype=np.float32))
+            # A freshly trained IVF index has to take every stored vector.
+            rows = vectors
+        self.index.add(np.ascontiguousarray(rows, dtype=np.float32))
+        self._unsaved += len(rows)
+        if self._unsaved >= self.save_every:
+            self.save()
+
+    def search(self, query: np.ndarray, top_k: int) -> np.ndarray:
+        """Return the row ids of the approximate *top_k* neighbours of *query*."""
+        _, ids = self.index.search(
+            np.ascontiguousarray(query.reshape(1, -1), dtype=np.float32), top_k
+        )
+        return ids[0][ids[0] >= 0]
+
+    def save(self) -> None:
+        if self.index is None:
+            return
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        faiss.write_index(self.index, str(tmp))
+        os.replace(tmp, self.path)
+        self._unsaved = 0
@@ -0,0 +1,118 @@
+"""Record of triaged issues so repeated runs only handle new work."""
+
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+try:  # POSIX only; elsewhere writes are serialized within the process alone
+    import fcntl
+except ModuleNotFoundError:  # pragma: no cover - platform dependent
+    fcntl = None  # type: ignore
+
+
+def jql_since(timestamp: float, margin: float = 60.0) -> str:
+    """Return a relative JQL date (e.g. ``"-15m"``) reaching back to *timestamp* plus *margin* seconds."""
+    minutes = math.ceil((time.time() - timestamp + margin) / 60)
+    return f"-{minutes}m"
+
+
+class TriageCheckpoint:
+    """Persist, per issue key, the ``updated`` timestamp that was triaged.
+
+    Along with the branch and review URL created for it, the file keeps the
+    start time of the last completed run (used to narrow the next Jira query)
+    and the keys of issues that failed, which are retried on the next run
+    even if Jira reports no change.
+
+    Several processes (the CLI and the webhook server, say) may share one
+    file: every change re-reads it under a lock file, applies the change and
+    writes it back, so no process overwrites another's records.
+    """
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self.last_run: Optional[float] = None
+        self.issues: Dict[str, Dict[str, Any]] = {}
+        self.failed: List[str] = []
+        self._lock = threading.Lock()
+        self._lock_path = self.path.with_name(self.path.name + ".lock")
+        self._read()
+
+    def _read(self) -> None:
+        if not self.path.is_file():
+            return
+        try:
+            data = json.loads(self.path.read_text())
+        except json.JSONDecodeError:
+            return
+        self.last_run = data.get("last_run")
+        self.issues = data.get("issues", {})
+        self.failed = data.get("failed", [])
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """Hold the file lock with the latest contents loaded."""
+        with self._lock, self._lock_path.open("a") as fh:
+            if fcntl is not None:
+                fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                self._read()
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _save(self) -> None:
+        tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        tmp.write_text(
+            json.dumps({"last_run": self.last_run, "issues": self.issues, "failed": self.failed})
+        )
+        os.replace(tmp, self.path)
+
+    def updated_since(self, margin: float = 60.0) -> Optional[str]:
+        """Return a relative JQL date (e.g. ``"-15m"``) covering the time since the last run."""
+        if self.last_run is None:
+            return None
+        return jql_since(self.last_run, margin)
+
+    def is_current(self, issue: dict) -> bool:
+        """Whether *issue* was already triaged at its current ``updated`` value."""
+        record = self.issues.get(issue.get("key"))
+        updated = issue.get("fields", {}).get("updated")
+        return bool(record and updated and record.get("updated") == updated)
+
+    def review_url(self, key: str) -> Optional[str]:
+        """Return the review already opened for *key*, if any, by any process."""
+        with self._locked():
+            return self.issues.get(key, {}).get("review_url")
+
+    def record(self, key: str, updated: str | None, branch: str, review_url: str | None) -> None:
+        with self._locked():
+            self.issues[key] = {"updated": updated, "branch": branch, "review_url": review_url}
+            if key in self.failed:
+                self.failed.remove(key)
+            self._save()
+
+    def record_failure(self, key: str) -> None:
+        with self._locked():
+            if key not in self.failed:
+                self.failed.append(key)
+                self._save()
+
+    def finish_run(self, started: float, retried: Iterable[str] = (), returned: Iterable[str] = ()) -> None:
+        """Mark the run that began at *started* (a ``time.time()`` value) as complete.
+
+        Failed keys the run asked Jira for (*retried*) but did not get back
+        (*returned*), because the issue was closed, moved or deleted, are
+        forgotten.
+        """
+        gone = set(retried) - set(returned)
+        with self._locked():
+            self.last_run = started
+            self.failed = [key for key in self.failed if key not in gone]
+            self._save()
@@ -0,0 +1,239 @@
+"""Offline related-file lookup over a local checkout of the repository."""
+
+import base64
+import json
+import math
+import os
+import re
+import subprocess
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Optional
+
+_IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_CAMEL = re.compile(r"[A-Z]?[a-z0-9]+|[A-Z]+(?![a-z])")
+
+
+def tokenize(text: str) -> List[str]:
+    """Split *text* into lowercase identifiers plus their snake/camel parts."""
+    tokens = []
+    for ident in _IDENTIFIER.findall(text):
+        tokens.append(ident.lower())
+        parts = [p.lower() for chunk in ident.split("_") for p in _CAMEL.findall(chunk)]
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+class LocalCodeIndex:
+    """Inverted token index over the files of a local checkout.
+
+    :meth:`refresh` re-reads only files whose size or modification time
+    changed since the last run, so keeping the index current after a
+    ``git fetch`` costs one ``stat`` per file plus the changed files.
+    Lookups are scored with BM25 (``scoring="bm25"``) or by the number of
+    keywords a file contains (``scoring="hits"``).
+    """
+
+    def __init__(
+        self,
+        root: str | Path,
+        index_path: str | Path | None = None,
+        scoring: str = "bm25",
+        max_file_bytes: int = 1_000_000,
+        refresh_interval: float = 300.0,
+    ) -> None:
+        self.root = Path(root)
+        self.index_path = Path(index_path) if index_path else None
+        self.scoring = scoring
+        self.max_file_bytes = max_file_bytes
+        self.refresh_interval = refresh_interval
+        self.repo: Optional[str] = None
+        self.token: Optional[str] = None
+        self.branch = "main"
+        self.last_sync = 0.0
+        # path -> {"mtime": ns, "size": bytes, "length": tokens, "tf": {token: count}}
+        self.files: Dict[str, dict] = {}
+        # token -> {path: count}
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+        # Held while one caller syncs; others search the current index meanwhile
+        self._sync_lock = threading.Lock()
+        self._load()
+
+    @classmethod
+    def from_env(cls, repo: str, token: str | None = None) -> Optional["LocalCodeIndex"]:
+        """Check out *repo* into ``CODE_INDEX_DIR`` and index it, if that is set."""
+        root = os.environ.get("CODE_INDEX_DIR")
+        if not root:
+            return None
+        index = cls(
+            root,
+            index_path=os.environ.get("CODE_INDEX_FILE", "code_index.json"),
+            scoring=os.environ.get("CODE_INDEX_SCORING", "bm25"),
+            refresh_interval=float(os.environ.get("CODE_INDEX_REFRESH", 300)),
+        )
+        index.sync_checkout(repo, token, os.environ.get("CODE_INDEX_BRANCH", "main"))
+        index.refresh()
+        return index
+
+    def _load(self) -> None:
+        if self.index_path is None or not self.index_path.is_file():
+            return
+        try:
+            self.files = json.loads(self.index_path.read_text())
+        except json.JSONDecodeError:
+            return
+        for path, info in self.files.items():
+            for token, count in info["tf"].items():
+                self.postings.setdefault(token, {})[path] = count
+
+    def save(self) -> None:
+        if self.index_path is None:
+            return
+        tmp = self.index_path.with_name(self.index_path.name + ".tmp")
+        tmp.write_text(json.dumps(self.files))
+        os.replace(tmp, self.index_path)
+
+    def _git(self, *args: str) -> None:
+        env = None
+        if self.token:
+            auth = base64.b64encode(f"x-access-token:{self.token}".encode()).decode()
+            # Passed through the environment, which unlike the command line is
+            # not readable by other users, and never written to .git/config
+            env = dict(os.environ)
+            n = int(env.get("GIT_CONFIG_COUNT", 0) or 0)
+            env["GIT_CONFIG_COUNT"] = str(n + 1)
+            env[f"GIT_CONFIG_KEY_{n}"] = "http.extraHeader"
+            env[f"GIT_CONFIG_VALUE_{n}"] = f"Authorization: Basic {auth}"
+        subprocess.run(["git", *args], check=True, capture_output=True, env=env)
+
+    def sync_checkout(self, repo: str, token: str | None = None, branch: str = "main") -> None:
+        """Clone *repo* into :attr:`root`, or fast-forward an existing checkout."""
+        self.repo, self.token, self.branch = repo, token, branch
+        url = f"https://github.com/{repo}.git"
+        if (self.root / ".git").is_dir():
+            self._git("-C", str(self.root), "fetch", "--depth", "1", "origin", branch)
+            self._git("-C", str(self.root), "reset", "--hard", "FETCH_HEAD")
+        else:
+            self._git("clone", "--depth", "1", "--branch", branch, url, str(self.root))
+        self.last_sync = time.time()
+
+    def update(self) -> None:
+        """Sync the checkout and refresh the index once ``refresh_interval`` has passed.
+
+        Returns at once if another thread is already syncing.
+        """
+        if time.time() - self.last_sync < self.refresh_interval:
+            return
+        if not self._sync_lock.acquire(blocking=False):
+            return
+        try:
+            if time.time() - self.last_sync < self.refresh_interval:
+                return
+            if self.repo:
+                try:
+                    self.sync_checkout(self.repo, self.token, self.branch)
+                except (OSError, subprocess.CalledProcessError) as exc:
+                    print(f"Failed to update local checkout: {exc}")
+            self.last_sync = time.time()
+            self.refresh()
+        finally:
+            self._sync_lock.release()
+
+    def _list_files(self) -> List[str]:
+        if (self.root / ".git").exists():
+            out = subprocess.run(
+                ["git", "-C", str(self.root), "ls-files", "-z"],
+                check=True,
+                capture_output=True,
+            ).stdout.decode()
+            return [p for p in out.split("\0") if p]
+        paths = []
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+            for name in filenames:
+                full = Path(dirpath) / name
+                paths.append(full.relative_to(self.root).as_posix())
+        return paths
+
+    def _read_tokens(self, path: str) -> Optional[Counter]:
+        try:
+            data = (self.root / path).read_bytes()
+        except OSError:
+            return None
+        if b"\0" in data[:8192]:
+            return None
+        return Counter(tokenize(data.decode("utf-8", errors="ignore")))
+
+    def _remove(self, path: str) -> None:
+        info = self.files.pop(path, None)
+        if not info:
+            return
+        for token in info["tf"]:
+            posting = self.postings.get(token)
+            if posting is not None:
+                posting.pop(path, None)
+                if not posting:
+                    del self.postings[token]
+
+    def refresh(self) -> int:
+        """Re-index changed files and drop deleted ones; return files changed."""
+        with self._lock:
+            seen = set()
+            changed = 0
+            for path in self._list_files():
+                try:
+                    st = (self.root / path).stat()
+                except OSError:
+                    continue
+                if st.st_size > self.max_file_bytes:
+                    continue
+                seen.add(path)
+                info = self.files.get(path)
+                if info and info["mtime"] == st.st_mtime_ns and info["size"] == st.st_size:
+                    continue
+                self._remove(path)
+                changed += 1
+                # Unreadable and binary files are kept with no tokens so they
+                # are not re-read on every refresh
+                tf = self._read_tokens(path) or Counter()
+                self.files[path] = {
+                    "mtime": st.st_mtime_ns,
+                    "size": st.st_size,
+                    "length": sum(tf.values()),
+                    "tf": dict(tf),
+                }
+                for token, count in tf.items():
+                    self.postings.setdefault(token, {})[path] = count
+            for path in set(self.files) - seen:
+                self._remove(path)
+                changed += 1
+            if changed:
+                self.save()
+            return changed
+
+    def search(self, keywords: List[str], max_results: int = 10) -> List[str]:
+        """Return up to *max_results* repository paths ranked for *keywords*."""
+        with self._lock:
+            terms = {t for word in keywords for t in tokenize(word)}
+            if not terms or not self.files:
+                return []
+            total = len(self.files)
+            avg_len = sum(f["length"] for f in self.files.values()) / total or 1.0
+            scores: Dict[str, float] = {}
+            for term in terms:
+                posting = self.postings.get(term, {})
+                if not posting:
+                    continue
+                idf = math.log(1 + (total - len(posting) + 0.5) / (len(posting) + 0.5))
+                for path, tf in posting.items():
+                    if self.scoring == "hits":
+                        scores[path] = scores.get(path, 0.0) + 1.0
+                        continue
+                    norm = tf + 1.2 * (0.25 + 0.75 * self.files[path]["length"] / avg_len)
+                    scores[path] = scores.get(path, 0.0) + idf * tf * 2.2 / norm
+            ranked = sorted(scores, key=lambda p: (-scores[p], p))
+            return ranked[:max_results]
@@ -1,36 +1,65 @@
 import base64
-import requests
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .http import ApiSession
 
 
 class GitHubConnector:
-    def __init__(self, repo: str, token: str):
+    def __init__(
+        self,
+        repo: str,
+        token: str,
+        search_workers: int = 4,
+        search_ttl: float = 900.0,
+        search_cache_size: int = 1024,
+        commit_mode: str | None = None,
+        session: ApiSession | None = None,
+    ):
         self.repo = repo
         self.base_url = f"https://api.github.com/repos/{repo}"
         self.headers = {
             "Authorization": f"token {token}",
             "Accept": "application/vnd.github+json",
         }
+        # "contents" commits file by file, "tree" makes one commit via the Git Data API
+        self.commit_mode = commit_mode or os.environ.get("GITHUB_COMMIT_MODE", "contents")
+        self.search_workers = max(1, search_workers)
+        self.search_ttl = search_ttl
+        self.search_cache_size = search_cache_size
+        # keyword -> (expiry, paths), shared by every bug this connector
+        # handles; least recently used first
+        self._search_cache: "OrderedDict[str, tuple[float, list[str]]]" = OrderedDict()
+        self._search_lock = threading.Lock()
+        self.session = session or ApiSession.from_env(pool_size=self.search_workers)
+        self.session.headers.update(self.headers)
 
     def ensure_branch(self, branch: str, base: str = "main") -> None:
         """Create the branch if it does not exist."""
         ref_url = f"{self.base_url}/git/ref/heads/{branch}"
-        resp = requests.get(ref_url, headers=self.headers)
+        resp = self.session.get(ref_url)
         if resp.status_code == 404:
             base_ref_url = f"{self.base_url}/git/ref/heads/{base}"
-            base_resp = requests.get(base_ref_url, headers=self.headers)
+            base_resp = self.session.get(base_ref_url)
             base_resp.raise_for_status()
             sha = base_resp.json().get("object", {}).get("sha")
             create_url = f"{self.base_url}/git/refs"
             payload = {"ref": f"refs/heads/{branch}", "sha": sha}
-            create_resp = requests.post(create_url, json=payload, headers=self.headers)
+            create_resp = self.session.post(create_url, json=payload)
             create_resp.raise_for_status()
 
     def commit_files(self, branch: str, files: dict[str, str], message: str) -> None:
         """Create or update files on the given branch."""
 
+        if self.commit_mode == "tree":
+            self.commit_tree(branch, files, message)
+            return
         for path, content in files.items():
             url = f"{self.base_url}/contents/{path}"
-            get_resp = requests.get(url, params={"ref": branch}, headers=self.headers)
+            get_resp = self.session.get(url, params={"ref": branch})
             data = {
                 "message": message,
                 "content": base64.b64encode(content.encode()).decode(),
@@ -40,29 +69,98 @@ class GitHubConnector:
                 sha = get_resp.json().get("sha")
                 if sha:
                     data["sha"] = sha
-            put_resp = requests.put(url, json=data, headers=self.headers)
+            put_resp = self.session.put(url, json=data)
             put_resp.raise_for_status()
 
+    def commit_tree(self, branch: str, files: dict[str, str], message: str) -> str:
+        """Write all *files* to *branch* as a single commit and return its SHA.
+
+        File contents are sent inline with the new tree, so GitHub creates the
+        blobs itself and the whole fix costs six requests regardless of the
+        number of files. Existing files keep their mode (an executable script
+        stays executable); new files are written as regular files.
+        """
+
+        ref_url = f"{self.base_url}/git/ref/heads/{branch}"
+        ref_resp = self.session.get(ref_url)
+        ref_resp.raise_for_status()
+        parent = ref_resp.json()["object"]["sha"]
+        commit_resp = self.session.get(f"{self.base_url}/git/commits/{parent}")
+        commit_resp.raise_for_status()
+        base_tree = commit_resp.json()["tree"]["sha"]
+        listing = self.session.get(
+            f"{self.base_url}/git/trees/{base_tree}", params={"recursive": "1"}
+        )
+        listing.raise_for_status()
+        modes = {
+            entry["path"]: entry["mode"]
+            for entry in listing.json().get("tree", [])
+            if entry.get("mode") in ("100644", "100755")
+        }
+        tree = [
+            {"path": path, "mode": modes.get(path, "100644"), "type": "blob", "content": content}
+            for path, content in files.items()
+        ]
+        tree_resp = self.session.post(
+            f"{self.base_url}/git/trees",
+            json={"base_tree": base_tree, "tree": tree},
+        )
+        tree_resp.raise_for_status()
+        new_commit = self.session.post(
+            f"{self.base_url}/git/commits",
+            json={"message": message, "tree": tree_resp.json()["sha"], "parents": [parent]},
+        )
+        new_commit.raise_for_status()
+        sha = new_commit.json()["sha"]
+        update = self.session.patch(
+            f"{self.base_url}/git/refs/heads/{branch}", json={"sha": sha}
+        )
+        update.raise_for_status()
+        return sha
+
     def create_pull_request(self, title: str, head: str, base: str, body: str):
         url = f"{self.base_url}/pulls"
         payload = {"title": title, "head": head, "base": base, "body": body}
-        response = requests.post(url, json=payload, headers=self.headers)
+        response = self.session.post(url, json=payload)
         response.raise_for_status()
         return response.json()
 
+    def _search_keyword(self, word: str, max_results: int) -> list[str]:
+        """Return paths matching *word*, using the TTL cache when possible."""
+        key = f"{word}\0{max_results}"
+        now = time.monotonic()
+        with self._search_lock:
+            cached = self._search_cache.get(key)
+            if cached and cached[0] > now:
+                self._search_cache.move_to_end(key)
+                return cached[1]
+        query = f"{word} repo:{self.repo}"
+        url = "https://api.github.com/search/code"
+        resp = self.session.get(url, params={"q": query})
+        if resp.status_code != 200:
+            return []
+        paths = [item["path"] for item in resp.json().get("items", [])[:max_results] if item.get("path")]
+        with self._search_lock:
+            for stale in [k for k, (expiry, _) in self._search_cache.items() if expiry <= now]:
+                del self._search_cache[stale]
+            self._search_cache[key] = (now + self.search_ttl, paths)
+            self._search_cache.move_to_end(key)
+            while len(self._search_cache) > self.search_cache_size:
+                self._search_cache.popitem(last=False)
+        return paths
+
     def search_code(self, keywords: list[str], max_results: int = 5) -> list[str]:
-        """Search the repository for files containing the given keywords."""
+        """Search the repository for files containing the given keywords.
+
+        Keywords are searched concurrently and results are cached for
+        ``search_ttl`` seconds. Files are ordered by how many keywords matched
+        them, ties keeping the order in which they were first found.
+        """
 
-        results: list[str] = []
-        for word in keywords:
-            query = f"{word} repo:{self.repo}"
-            url = "https://api.github.com/search/code"
-            resp = requests.get(url, params={"q": query}, headers=self.headers)
-            if resp.status_code != 200:
-                continue
-            data = resp.json()
-            for item in data.get("items", [])[:max_results]:
-                path = item.get("path")
-                if path and path not in results:
-                    results.append(path)
-        return results
+        with ThreadPoolExecutor(max_workers=self.search_workers) as pool:
+            matches = list(pool.map(lambda w: self._search_keyword(w, max_results), keywords))
+        hits: dict[str, int] = {}
+        for paths in matches:
+            for path in dict.fromkeys(paths):
+                hits[path] = hits.get(path, 0) + 1
+        return sorted(hits, key=lambda p: -hits[p])
@@ -0,0 +1,165 @@
+"""Shared HTTP session with connection pooling, retries and rate-limit pacing."""
+
+import os
+import random
+import threading
+import time
+from typing import Dict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Transient server errors, retried only for methods that are safe to repeat
+RETRY_STATUSES = frozenset({500, 502, 503, 504})
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+
+class TokenBucket:
+    """Thread-safe token bucket that can also be paused until a deadline."""
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.base_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.paused_until = 0.0
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Block until a token is available and take it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self._stamp) * self.rate)
+                self._stamp = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate if self.rate else 1.0)
+            time.sleep(min(wait, 60.0))
+
+    def pause(self, seconds: float) -> None:
+        """Hold back every caller for *seconds*."""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def pace(self, remaining: int, window: float, limit: int | None = None) -> None:
+        """Adapt to a server quota with *remaining* calls left for *window* seconds.
+
+        Once less than a fifth of *limit* is left the remaining calls are
+        spread evenly over the window; an exhausted quota pauses the bucket.
+        """
+        with self._lock:
+            if remaining <= 0:
+                self.paused_until = max(self.paused_until, time.monotonic() + window)
+            elif limit and remaining > limit * 0.2:
+                self.rate = self.base_rate
+            elif window > 0:
+                self.rate = min(self.base_rate, max(remaining / window, 0.01))
+                self.tokens = min(self.tokens, remaining)
+
+
+class ApiSession(requests.Session):
+    """Keep-alive session that retries transient failures and respects rate limits.
+
+    Failed requests are retried up to ``max_retries`` times with jittered
+    exponential backoff, honouring ``Retry-After``. Responses carrying
+    ``X-RateLimit-Remaining``/``X-RateLimit-Reset`` headers (GitHub) adjust a
+    per-resource token bucket so calls are spread over the remaining quota
+    instead of failing once it runs out.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 10,
+        timeout: float = 30.0,
+        max_retries: int = 3,
+        backoff: float = 0.5,
+        max_backoff: float = 60.0,
+        rate: float = 10.0,
+    ) -> None:
+        super().__init__()
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.rate = rate
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._buckets_lock = threading.Lock()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+
+    @classmethod
+    def from_env(cls, pool_size: int | None = None) -> "ApiSession":
+        """Create a session configured by the ``HTTP_*`` environment variables."""
+        return cls(
+            pool_size=pool_size or int(os.environ.get("HTTP_POOL_SIZE", 10)),
+            timeout=float(os.environ.get("HTTP_TIMEOUT", 30)),
+            max_retries=int(os.environ.get("HTTP_MAX_RETRIES", 3)),
+            backoff=float(os.environ.get("HTTP_BACKOFF", 0.5)),
+            rate=float(os.environ.get("HTTP_RATE", 10)),
+        )
+
+    def bucket(self, resource: str) -> TokenBucket:
+        with self._buckets_lock:
+            if resource not in self._buckets:
+                self._buckets[resource] = TokenBucket(self.rate, max(self.rate, 1.0))
+            return self._buckets[resource]
+
+    @staticmethod
+    def resource(url: str) -> str:
+        """Name the rate-limit pool a URL counts against (GitHub search is separate)."""
+        return "search" if "/search/" in url else "core"
+
+    def _delay(self, attempt: int, response: requests.Response | None) -> float:
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                return min(float(retry_after), self.max_backoff)
+            reset = response.headers.get("X-RateLimit-Reset")
+            if response.headers.get("X-RateLimit-Remaining") == "0" and reset and reset.isdigit():
+                return min(max(float(reset) - time.time(), 0.0) + 1.0, self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+    def _observe(self, bucket: TokenBucket, response: requests.Response) -> None:
+        remaining = response.headers.get("X-RateLimit-Remaining")
+        reset = response.headers.get("X-RateLimit-Reset")
+        limit = response.headers.get("X-RateLimit-Limit")
+        if remaining and remaining.isdigit() and reset and reset.isdigit():
+            bucket.pace(
+                int(remaining),
+                float(reset) - time.time(),
+                int(limit) if limit and limit.isdigit() else None,
+            )
+
+    def _should_retry(self, method: str, response: requests.Response) -> bool:
+        if response.status_code == 429:
+            return True
+        if response.status_code in RETRY_STATUSES:
+            return method in IDEMPOTENT_METHODS
+        # GitHub reports an exhausted quota as 403 with a zero remaining count
+        return response.status_code == 403 and response.headers.get("X-RateLimit-Remaining") == "0"
+
+    def request(self, method, url, *args, **kwargs):  # type: ignore[override]
+        kwargs.setdefault("timeout", self.timeout)
+        method = method.upper()
+        bucket = self.bucket(self.resource(url))
+        for attempt in range(self.max_retries + 1):
+            bucket.acquire()
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries or method not in IDEMPOTENT_METHODS:
+                    raise
+                time.sleep(self._delay(attempt, None))
+                continue
+            self._observe(bucket, response)
+            if attempt == self.max_retries or not self._should_retry(method, response):
+                return response
+            delay = self._delay(attempt, response)
+            if response.status_code in (403, 429):
+                bucket.pause(delay)
+            time.sleep(delay)
+        return response
@@ -1,8 +1,22 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
+
 import requests
 
+from .http import ApiSession
+
+# Issue fields the agent reads; everything else is left out of search results
+ISSUE_FIELDS = "summary,description,issuetype,status,updated"
+
 
 class JiraConnector:
-    def __init__(self, base_url: str | None, username: str | None, token: str | None):
+    def __init__(
+        self,
+        base_url: str | None,
+        username: str | None,
+        token: str | None,
+        session: ApiSession | None = None,
+    ):
         """Simple wrapper around the Jira REST API."""
         if not base_url:
             raise ValueError("JIRA_URL environment variable is required")
@@ -12,6 +26,8 @@ class JiraConnector:
 
         self.base_url = base_url.rstrip("/")
         self.auth = (username, token)
+        self.session = session or ApiSession.from_env()
+        self.session.auth = self.auth
 
     def get_open_bugs(self, project_key: str):
         """Fetch open bug issues from Jira.
@@ -24,10 +40,58 @@ class JiraConnector:
             be converted to uppercase automatically.
         """
 
+        return list(self.iter_open_bugs(project_key))
+
+    def iter_open_bugs(
+        self,
+        project_key: str,
+        page_size: int = 100,
+        prefetch: bool = True,
+        updated_since: str | None = None,
+        include_keys: list[str] | None = None,
+    ) -> Iterator[dict]:
+        """Yield open bug issues page by page.
+
+        With *prefetch* the next page is requested in the background while
+        the issues of the current one are being consumed. *updated_since* (a
+        JQL date such as ``"-30m"`` or ``"2024/01/31 12:00"``) limits the
+        search to recently updated issues, plus any issue in *include_keys*.
+        """
+
         project_key = project_key.strip().upper()
         jql = f"project={project_key} AND issuetype=Bug AND status!=Done"
+        extra = {}
+        if updated_since:
+            recent = f'updated >= "{updated_since}"'
+            if include_keys:
+                recent = f"({recent} OR key in ({', '.join(include_keys)}))"
+                # Deleted or moved keys must not make the whole query fail
+                extra["validateQuery"] = "warn"
+            jql += f" AND {recent}"
+        if not prefetch:
+            start = 0
+            while start is not None:
+                issues, start = self._search_page(jql, start, page_size, extra)
+                yield from issues
+            return
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            future = pool.submit(self._search_page, jql, 0, page_size, extra)
+            while future is not None:
+                issues, start = future.result()
+                future = None
+                if start is not None:
+                    future = pool.submit(self._search_page, jql, start, page_size, extra)
+                yield from issues
+
+    def _search_page(
+        self, jql: str, start: int, page_size: int, extra: dict | None = None
+    ) -> tuple[list, int | None]:
+        """Return one page of search results and the offset of the next (if any)."""
+
         url = f"{self.base_url}/rest/api/2/search"
-        response = requests.get(url, params={"jql": jql}, auth=self.auth)
+        params = {"jql": jql, "startAt": start, "maxResults": page_size, "fields": ISSUE_FIELDS}
+        params.update(extra or {})
+        response = self.session.get(url, params=params)
         try:
             response.raise_for_status()
         except requests.HTTPError as exc:
@@ -37,4 +101,11 @@ class JiraConnector:
                 response=response,
             ) from exc
         data = response.json()
-        return data.get("issues", [])
+        issues = data.get("issues", [])
+        following = data.get("startAt", start) + len(issues)
+        total = data.get("total")
+        if not issues or (total is not None and following >= total):
+            return issues, None
+        if total is None and len(issues) < page_size:
+            return issues, None
+        return issues, following
@@ -1,30 +1,232 @@
 import json
-from typing import Callable
+import queue
+import random
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
 
 from websocket import WebSocketApp
 
 
 class JiraWebSocketClient:
-    """Listen for Jira bug events over a WebSocket connection."""
+    """Listen for Jira bug events over a WebSocket connection.
 
-    def __init__(self, ws_url: str):
+    Messages are only parsed on the socket's read loop; bugs are handed to a
+    pool of *workers* through a queue of at most *max_pending* events, so a
+    slow triage never delays pings. When the queue stays full for
+    *enqueue_timeout* seconds the event is dropped and counted. Events for an
+    issue key that is already queued, being processed, or was processed in
+    the last *dedupe_ttl* seconds are ignored. Lost connections are reopened
+    with jittered exponential backoff; issues fetched to cover the outage go
+    through the same dedupe and queue as socket events.
+    """
+
+    def __init__(
+        self,
+        ws_url: str,
+        workers: int = 2,
+        max_pending: int = 100,
+        enqueue_timeout: float = 1.0,
+        dedupe_ttl: float = 3600.0,
+        reconnect_delay: float = 1.0,
+        max_reconnect_delay: float = 60.0,
+    ):
         if not ws_url:
             raise ValueError("JIRA_WS_URL must be provided")
         self.ws_url = ws_url
+        self.workers = max(1, workers)
+        self.enqueue_timeout = enqueue_timeout
+        self.dedupe_ttl = dedupe_ttl
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.counters = {
+            "received": 0,
+            "processing": 0,
+            "processed": 0,
+            "failed": 0,
+            "dropped": 0,
+            "duplicates": 0,
+            "reconnects": 0,
+            "resumed": 0,
+        }
+        self._queue: "queue.Queue[Optional[dict]]" = queue.Queue(maxsize=max_pending)
+        # issue key -> None while queued or processing, finish time afterwards
+        self._seen: Dict[str, Optional[float]] = {}
+        self._lock = threading.Lock()
+        # At most one resume fetch runs; later requests wait in _resume_pending
+        self._resuming = False
+        self._resume_pending: Optional[float] = None
+        self._threads: List[threading.Thread] = []
+        self._stopping = threading.Event()
+        self._ws = None
+        self._on_bug: Callable[[dict], None] = lambda issue: None
+
+    def stats(self) -> Dict[str, int]:
+        """Return event counters, including the number of currently queued events."""
+        with self._lock:
+            return dict(self.counters, queued=self._queue.qsize())
+
+    def _count(self, name: str, delta: int = 1) -> None:
+        with self._lock:
+            self.counters[name] += delta
+
+    def _claim(self, key: str | None) -> bool:
+        """Mark *key* as in flight unless it is already or was recently handled."""
+        if not key:
+            return True
+        with self._lock:
+            now = time.time()
+            for old in [k for k, t in self._seen.items() if t is not None and now - t > self.dedupe_ttl]:
+                del self._seen[old]
+            if key in self._seen:
+                self.counters["duplicates"] += 1
+                return False
+            self._seen[key] = None
+            return True
+
+    def _release(self, key: str | None, done: bool) -> None:
+        if not key:
+            return
+        with self._lock:
+            if done:
+                self._seen[key] = time.time()
+            else:
+                # Failed or dropped events may be delivered again
+                self._seen.pop(key, None)
 
-    def listen(self, on_bug: Callable[[dict], None]) -> None:
-        """Start listening and invoke *on_bug* for each received bug."""
+    def _on_message(self, ws, message: str) -> None:
+        try:
+            data = json.loads(message)
+        except json.JSONDecodeError:
+            return
+        issue = data.get("issue") or data
+        if not issue:
+            return
+        # Debug output so we can verify incoming tickets during development
+        print(f"Received issue via WebSocket: {json.dumps(issue)}")
+        self._count("received")
+        self.submit(issue)
+
+    def submit(self, issue: dict) -> bool:
+        """Queue *issue* for the workers; return ``False`` if it was a duplicate or dropped."""
+        key = issue.get("key")
+        if not self._claim(key):
+            return False
+        try:
+            self._queue.put(issue, timeout=self.enqueue_timeout)
+        except queue.Full:
+            self._release(key, done=False)
+            self._count("dropped")
+            print(f"Dropped issue {key}: {self._queue.maxsize} events already queued")
+            return False
+        return True
+
+    def resume(self, fetch: Callable[[float], Iterable[dict]], lost_at: float) -> None:
+        """Submit the issues ``fetch(lost_at)`` returns, in the background.
+
+        Only one fetch runs at a time. Resumes requested meanwhile are
+        coalesced into a single follow-up fetch from the earliest *lost_at*.
+        """
+        with self._lock:
+            if self._resuming:
+                if self._resume_pending is None or lost_at < self._resume_pending:
+                    self._resume_pending = lost_at
+                return
+            self._resuming = True
+        threading.Thread(target=self._run_resume, args=(fetch, lost_at), daemon=True).start()
 
-        def _on_message(ws, message: str):
+    def _run_resume(self, fetch: Callable[[float], Iterable[dict]], lost_at: Optional[float]) -> None:
+        while lost_at is not None:
             try:
-                data = json.loads(message)
-            except json.JSONDecodeError:
+                for issue in fetch(lost_at):
+                    if self._stopping.is_set():
+                        break
+                    self._count("resumed")
+                    self.submit(issue)
+            except Exception as exc:  # the next reconnect tries again
+                print(f"Failed to fetch issues missed since {lost_at}: {exc}")
+            with self._lock:
+                lost_at, self._resume_pending = self._resume_pending, None
+                if lost_at is None:
+                    self._resuming = False
+
+    def _work(self) -> None:
+        while True:
+            issue = self._queue.get()
+            if issue is None:
                 return
-            issue = data.get("issue") or data
-            if issue:
-                # Debug output so we can verify incoming tickets during development
-                print(f"Received issue via WebSocket: {json.dumps(issue)}")
-                on_bug(issue)
-
-        ws = WebSocketApp(self.ws_url, on_message=_on_message)
-        ws.run_forever()
+            key = issue.get("key")
+            self._count("processing")
+            try:
+                self._on_bug(issue)
+            except Exception as exc:  # keep the worker alive for the next event
+                print(f"Failed to process {key}: {exc}")
+                self._count("failed")
+                self._release(key, done=False)
+            else:
+                self._count("processed")
+                self._release(key, done=True)
+            finally:
+                self._count("processing", -1)
+
+    def start_workers(self, on_bug: Callable[[dict], None]) -> None:
+        self._on_bug = on_bug
+        self._stopping.clear()
+        for _ in range(self.workers - len(self._threads)):
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float | None = None) -> None:
+        """Close the connection and let the workers finish the queued events."""
+        self._stopping.set()
+        if self._ws is not None:
+            self._ws.close()
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def listen(
+        self,
+        on_bug: Callable[[dict], None],
+        on_resume: Callable[[float], Iterable[dict]] | None = None,
+    ) -> None:
+        """Start listening and invoke *on_bug* for each received bug.
+
+        Runs until :meth:`stop` is called, reconnecting whenever the
+        connection drops. After a reconnect *on_resume* is called with the
+        time the connection was lost and the issues it returns are queued
+        like socket events (see :meth:`resume`).
+        """
+        self.start_workers(on_bug)
+        attempt = 0
+        lost_at: Optional[float] = None
+
+        def _on_open(ws) -> None:
+            nonlocal attempt, lost_at
+            attempt = 0
+            if lost_at is not None:
+                self._count("reconnects")
+                print(f"WebSocket reconnected: {self.stats()}")
+                if on_resume is not None:
+                    self.resume(on_resume, lost_at)
+                lost_at = None
+
+        def _on_error(ws, error) -> None:
+            print(f"WebSocket error: {error}")
+
+        while not self._stopping.is_set():
+            self._ws = WebSocketApp(
+                self.ws_url, on_message=self._on_message, on_open=_on_open, on_error=_on_error
+            )
+            self._ws.run_forever(ping_interval=30, ping_timeout=10)
+            if self._stopping.is_set():
+                break
+            if lost_at is None:
+                lost_at = time.time()
+            delay = random.uniform(0, min(self.max_reconnect_delay, self.reconnect_delay * 2**attempt))
+            attempt += 1
+            print(f"WebSocket closed, reconnecting in {delay:.1f}s")
+            self._stopping.wait(delay)
@@ -0,0 +1,187 @@
+"""Select the parts of a source file most relevant to a bug within a token budget."""
+
+import ast
+import math
+import re
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .code_index import tokenize
+
+# Top-level definitions in common non-Python languages
+_DEFINITION = re.compile(
+    r"^(?:export\s+|public\s+|private\s+|protected\s+|static\s+|async\s+)*"
+    r"(?:def|class|function|func|fn|interface|struct|impl|enum|type)\b"
+)
+OMITTED = "..."
+
+
+class Chunk:
+    """A contiguous range of lines (``start`` inclusive, ``end`` exclusive)."""
+
+    def __init__(self, name: str, start: int, end: int, text: str) -> None:
+        self.name = name
+        self.start = start
+        self.end = end
+        self.text = text
+
+    def __repr__(self) -> str:
+        return f"Chunk({self.name!r}, {self.start}, {self.end})"
+
+
+def _windows(name: str, lines: List[str], start: int, end: int, max_lines: int) -> List[Chunk]:
+    chunks = []
+    for lo in range(start, end, max_lines):
+        hi = min(lo + max_lines, end)
+        text = "".join(lines[lo:hi])
+        if text.strip():
+            chunks.append(Chunk(name, lo, hi, text))
+    return chunks
+
+
+def _python_spans(tree: ast.Module, max_lines: int) -> List[Tuple[str, int, int]]:
+    spans = []
+    for node in tree.body:
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            continue
+        start = min([node.lineno] + [d.lineno for d in node.decorator_list]) - 1
+        end = node.end_lineno or node.lineno
+        methods = [
+            n for n in node.body if isinstance(n, (ast.FunctionDef, ast.AsyncFunctionDef))
+        ] if isinstance(node, ast.ClassDef) else []
+        if end - start <= max_lines or not methods:
+            spans.append((node.name, start, end))
+            continue
+        # Large classes are split per method, the header goes with the class body before them
+        cursor = start
+        for method in methods:
+            m_start = min([method.lineno] + [d.lineno for d in method.decorator_list]) - 1
+            if m_start > cursor:
+                spans.append((node.name, cursor, m_start))
+            m_end = method.end_lineno or method.lineno
+            spans.append((f"{node.name}.{method.name}", m_start, m_end))
+            cursor = m_end
+        if end > cursor:
+            spans.append((node.name, cursor, end))
+    return spans
+
+
+def _generic_spans(lines: List[str]) -> List[Tuple[str, int, int]]:
+    starts = [i for i, line in enumerate(lines) if _DEFINITION.match(line)]
+    spans = []
+    for i, start in enumerate(starts):
+        end = starts[i + 1] if i + 1 < len(starts) else len(lines)
+        spans.append((lines[start].strip()[:60], start, end))
+    return spans
+
+
+def split_chunks(path: str, code: str, max_lines: int = 80) -> List[Chunk]:
+    """Split *code* into function/class-level chunks covering every line.
+
+    Python files are split with :mod:`ast`; other files at lines that look
+    like top-level definitions. Code between definitions becomes its own
+    chunk and anything longer than *max_lines* is cut into windows.
+    """
+    lines = code.splitlines(keepends=True)
+    spans: List[Tuple[str, int, int]] = []
+    if path.endswith(".py"):
+        try:
+            spans = _python_spans(ast.parse(code), max_lines)
+        except (SyntaxError, ValueError):
+            spans = []
+    if not spans:
+        spans = _generic_spans(lines)
+    chunks: List[Chunk] = []
+    cursor = 0
+    for name, start, end in sorted(spans, key=lambda s: s[1]):
+        if start > cursor:
+            chunks.extend(_windows("<module>", lines, cursor, start, max_lines))
+        chunks.extend(_windows(name, lines, max(start, cursor), end, max_lines))
+        cursor = max(cursor, end)
+    chunks.extend(_windows("<module>", lines, cursor, len(lines), max_lines))
+    return chunks
+
+
+def rank_chunks(chunks: List[Chunk], query: str) -> List[float]:
+    """Score each chunk against *query* with BM25, boosting matching names."""
+    terms = set(tokenize(query))
+    counts = [Counter(tokenize(c.text)) for c in chunks]
+    if not terms or not chunks:
+        return [0.0] * len(chunks)
+    avg_len = sum(sum(c.values()) for c in counts) / len(chunks) or 1.0
+    scores = []
+    for chunk, tf in zip(chunks, counts):
+        length = sum(tf.values())
+        score = 0.0
+        for term in terms:
+            if not tf[term]:
+                continue
+            df = sum(1 for c in counts if c[term])
+            idf = math.log(1 + (len(chunks) - df + 0.5) / (df + 0.5))
+            norm = tf[term] + 1.2 * (0.25 + 0.75 * length / avg_len)
+            score += idf * tf[term] * 2.2 / norm
+        if terms & set(tokenize(chunk.name)):
+            score *= 2
+        scores.append(score)
+    return scores
+
+
+def approx_tokens(text: str) -> int:
+    """Rough token count used when no tokenizer is available."""
+    return math.ceil(len(text) / 4)
+
+
+def build_context(
+    path: str,
+    code: str,
+    query: str,
+    budget: int,
+    count_tokens: Optional[Callable[[str], int]] = None,
+) -> Tuple[str, Dict[str, int]]:
+    """Return the part of *code* to show for *query* within *budget* tokens.
+
+    Files that fit are returned unchanged. Otherwise the highest ranked
+    chunks are kept in file order, with ``...`` marking the gaps. The
+    returned stats give the chunk and token counts of the file and of the
+    selection.
+    """
+    count = count_tokens or approx_tokens
+    chunks = split_chunks(path, code)
+    sizes = [count(c.text) for c in chunks]
+    total = sum(sizes)
+    stats = {"chunks": len(chunks), "chunks_used": len(chunks), "file_tokens": total}
+    if total <= budget:
+        stats["code_tokens"] = total
+        return code, stats
+
+    scores = rank_chunks(chunks, query)
+    order = sorted(range(len(chunks)), key=lambda i: (-scores[i], i))
+    gap = count(OMITTED + "\n")
+    selected: Dict[int, str] = {}
+    used = 0
+    for i in order:
+        if used + sizes[i] + gap <= budget:
+            selected[i] = chunks[i].text
+            used += sizes[i] + gap
+        elif not selected:
+            # Nothing fits yet: keep as many leading lines of the best chunk as possible
+            text = ""
+            for line in chunks[i].text.splitlines(keepends=True):
+                if count(text + line) + gap > budget:
+                    break
+                text += line
+            if text:
+                selected[i] = text
+                used += count(text) + gap
+    parts = []
+    previous = -1
+    for i in sorted(selected):
+        if i != previous + 1:
+            parts.append(OMITTED + "\n")
+        parts.append(selected[i])
+        previous = i
+    if previous != len(chunks) - 1:
+        parts.append(OMITTED + "\n")
+    stats["chunks_used"] = len(selected)
+    stats["code_tokens"] = used
+    return "".join(parts), stats
@@ -0,0 +1,113 @@
+"""Bounded LRU cache of text embeddings keyed by content hash."""
+
+import atexit
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """Map ``sha256(model, text)`` to an embedding, evicting least recently used.
+
+    When *path* is given the cache is loaded from that ``.npz`` file on start,
+    written back every ``save_every`` new embeddings and again at interpreter
+    exit.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        maxsize: int = 1024,
+        path: str | Path | None = None,
+        save_every: int = 64,
+    ) -> None:
+        self.model_name = model_name
+        self.maxsize = maxsize
+        self.path = Path(path) if path else None
+        self.save_every = save_every
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._unsaved = 0
+        if self.path is not None:
+            self._load()
+            atexit.register(self.save)
+
+    @classmethod
+    def from_env(cls, model_name: str) -> "EmbeddingCache":
+        """Create a cache sized by ``EMBED_CACHE_SIZE`` and stored at ``EMBED_CACHE_FILE``."""
+        return cls(
+            model_name,
+            maxsize=int(os.environ.get("EMBED_CACHE_SIZE", 1024)),
+            path=os.environ.get("EMBED_CACHE_FILE") or None,
+        )
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode()).hexdigest()
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        key = self.key(text)
+        with self._lock:
+            vec = self._data.get(key)
+            if vec is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return vec
+
+    def put(self, text: str, vec: np.ndarray) -> None:
+        if self.maxsize <= 0:
+            return
+        key = self.key(text)
+        with self._lock:
+            self._data[key] = vec
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            self._unsaved += 1
+            flush = self.path is not None and self._unsaved >= self.save_every
+        if flush:
+            self.save()
+
+    def info(self) -> Dict[str, int]:
+        """Return hit/miss counters and current occupancy."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+            }
+
+    def _load(self) -> None:
+        if not self.path.is_file():
+            return
+        try:
+            with np.load(self.path) as data:
+                model, keys, vectors = str(data["model"]), data["keys"], data["vectors"]
+        except (OSError, ValueError, KeyError):
+            return
+        if model != self.model_name:
+            return
+        for key, vec in list(zip(keys.tolist(), vectors))[-self.maxsize:]:
+            self._data[key] = vec
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+        with self._lock:
+            if not self._data:
+                return
+            keys = np.array(list(self._data))
+            vectors = np.stack(list(self._data.values()))
+            self._unsaved = 0
+        tmp = self.path.with_name(self.path.name + ".tmp.npz")
+        np.savez(tmp, model=np.array(self.model_name), keys=keys, vectors=vectors)
+        os.replace(tmp, self.path)
@@ -0,0 +1,156 @@
+"""Durable background queue for bugs received by the webhook server."""
+
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class QueueFull(Exception):
+    """Raised when the queue already holds ``max_pending`` waiting jobs."""
+
+
+class JobQueue:
+    """SQLite-backed job queue drained by a pool of worker threads.
+
+    Jobs survive restarts: anything still ``running`` when the process died is
+    put back to ``queued`` on start. Deliveries for an issue key that already
+    has a queued, running or finished job are not enqueued again; only failed
+    jobs can be retried by a new delivery.
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        handler: Callable[[dict], Any],
+        workers: int = 2,
+        max_pending: int = 100,
+    ) -> None:
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._stopping = False
+        self._threads: List[threading.Thread] = []
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    issue_key TEXT,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    created REAL NOT NULL,
+                    updated REAL NOT NULL
+                )"""
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS jobs_issue ON jobs (issue_key)")
+            self._db.execute(
+                "UPDATE jobs SET status = 'queued', updated = ? WHERE status = 'running'",
+                (time.time(),),
+            )
+
+    def enqueue(self, issue: dict) -> Tuple[str, bool]:
+        """Queue *issue* and return ``(job_id, created)``.
+
+        ``created`` is ``False`` when an existing job for the same issue key
+        was returned instead. Raises :class:`QueueFull` when the backlog is at
+        capacity.
+        """
+        key = issue.get("key")
+        now = time.time()
+        with self._lock:
+            if key:
+                row = self._db.execute(
+                    "SELECT id FROM jobs WHERE issue_key = ? AND status != 'failed' "
+                    "ORDER BY created DESC LIMIT 1",
+                    (key,),
+                ).fetchone()
+                if row:
+                    return row["id"], False
+            pending = self._db.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued'"
+            ).fetchone()[0]
+            if pending >= self.max_pending:
+                raise QueueFull(f"{pending} jobs already queued")
+            job_id = uuid.uuid4().hex
+            with self._db:
+                self._db.execute(
+                    "INSERT INTO jobs (id, issue_key, payload, status, created, updated) "
+                    "VALUES (?, ?, ?, 'queued', ?, ?)",
+                    (job_id, key, json.dumps(issue), now, now),
+                )
+            self._ready.notify()
+        return job_id, True
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return the public status of a job, or ``None`` if it is unknown."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, issue_key, status, result, error, created, updated FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        return dict(row) if row else None
+
+    def start(self) -> None:
+        """Start the worker threads."""
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float | None = None) -> None:
+        """Ask the workers to exit once their current job finishes."""
+        with self._lock:
+            self._stopping = True
+            self._ready.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _claim(self) -> Optional[sqlite3.Row]:
+        """Mark the oldest queued job as running and return it (lock held)."""
+        row = self._db.execute(
+            "SELECT id, payload FROM jobs WHERE status = 'queued' ORDER BY created LIMIT 1"
+        ).fetchone()
+        if row:
+            with self._db:
+                self._db.execute(
+                    "UPDATE jobs SET status = 'running', updated = ? WHERE id = ?",
+                    (time.time(), row["id"]),
+                )
+        return row
+
+    def _finish(self, job_id: str, status: str, result: Any = None, error: str | None = None) -> None:
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, updated = ? WHERE id = ?",
+                (status, None if result is None else str(result), error, time.time(), job_id),
+            )
+
+    def _work(self) -> None:
+        while True:
+            with self._lock:
+                while not self._stopping:
+                    row = self._claim()
+                    if row is not None:
+                        break
+                    self._ready.wait(timeout=1.0)
+                else:
+                    return
+            try:
+                result = self.handler(json.loads(row["payload"]))
+            except Exception as exc:  # keep the worker alive for the next job
+                print(f"Job {row['id']} failed: {type(exc).__name__}: {exc}")
+                self._finish(row["id"], "failed", error=f"{type(exc).__name__}: {exc}")
+            else:
+                self._finish(row["id"], "done", result=result)
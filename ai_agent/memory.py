@@ -1,54 +1,320 @@
+import io
 import json
 import os
+import threading
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import Any, Dict, Iterable, List, Tuple
 
-import torch
-from transformers import AutoTokenizer, AutoModel
 import numpy as np
+import torch
+
+from .ann_index import AnnIndex
+from .code_index import tokenize
+from .embedding_cache import EmbeddingCache
+from .inference import inference_mode
+from .models import registry
+
+
+def _normalize(vec: np.ndarray) -> np.ndarray:
+    """Return *vec* scaled to unit length (zero vectors are left as zeros)."""
+    norm = float(np.linalg.norm(vec))
+    if norm == 0:
+        return vec
+    return vec / norm
+
+
+def lexical_similarity(a: str, b: str) -> float:
+    """Jaccard overlap of the identifier tokens of *a* and *b* (0 to 1)."""
+    left, right = set(tokenize(a)), set(tokenize(b))
+    if not left or not right:
+        return 0.0
+    return len(left & right) / len(left | right)
+
+
+def _npy_header(rows: int, dim: int) -> bytes:
+    """Serialize a ``.npy`` header for a C-ordered ``float32`` matrix."""
+    buf = io.BytesIO()
+    np.lib.format.write_array_header_1_0(
+        buf, {"descr": "<f4", "fortran_order": False, "shape": (rows, dim)}
+    )
+    return buf.getvalue()
 
 
 class SimpleMemory:
-    """Store bug reports and solutions as vector embeddings."""
+    """Store bug reports and solutions as vector embeddings.
+
+    Entries are persisted append-only: ticket text and solution go to a JSON
+    lines log (``<path>.jsonl``) and normalized embeddings to a ``.npy`` file
+    (``<path>.npy``) that is memory-mapped on startup. A legacy ``memory.json``
+    at *path* is migrated to this layout the first time it is opened.
+
+    Searches scan every embedding exactly unless *index* (or ``MEMORY_INDEX``)
+    selects an approximate ``hnsw`` or ``ivf`` index, persisted to
+    ``<path>.faiss``.
 
-    def __init__(self, model_name: str | None = None, path: str | Path = "memory.json") -> None:
+    Embeddings are memoized by :class:`EmbeddingCache`, so searching for a
+    ticket and then remembering it runs the model once.
+    """
+
+    def __init__(
+        self,
+        model_name: str | None = None,
+        path: str | Path = "memory.json",
+        index: str | None = None,
+    ) -> None:
         self.model_name = model_name or os.environ.get("MEMORY_MODEL", "distilbert-base-uncased")
-        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
-        self.model = AutoModel.from_pretrained(self.model_name)
+        self._tokenizer = None
+        self._model = None
         self.path = Path(path)
+        self.log_path = self.path.with_suffix(".jsonl")
+        self.vectors_path = self.path.with_suffix(".npy")
         self.entries: List[Dict[str, Any]] = []
-        if self.path.is_file():
-            try:
-                self.entries = json.loads(self.path.read_text())
-            except json.JSONDecodeError:
-                self.entries = []
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._offset = 0
+        # Serializes file appends and searches when bugs are triaged concurrently
+        self._lock = threading.RLock()
+        self.embedding_cache = EmbeddingCache.from_env(self.model_name)
+        self.ann = AnnIndex.from_env(self.path.with_suffix(".faiss"), index)
+        if not self.log_path.exists() and self.path.is_file():
+            self._migrate()
+        self._load()
+        if self.ann is not None:
+            self.ann.sync(self.vectors)
+
+    @property
+    def tokenizer(self):
+        """Embedding tokenizer, loaded through the shared model registry on first use."""
+        if self._tokenizer is None:
+            self._tokenizer = registry.tokenizer(self.model_name)
+        return self._tokenizer
+
+    @property
+    def model(self):
+        """Embedding model, loaded on first use."""
+        if self._model is None:
+            self._model = registry.model(self.model_name, "base")
+        return self._model
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """Normalized ``float32`` embeddings, one row per entry."""
+        return self._vectors
+
+    def _migrate(self) -> None:
+        """Convert a legacy JSON memory file into the append-only layout."""
+        try:
+            legacy = json.loads(self.path.read_text())
+        except json.JSONDecodeError:
+            return
+        vectors = [
+            _normalize(np.asarray(e["embedding"], dtype=np.float32).reshape(-1))
+            for e in legacy
+        ]
+        self.entries = [{"text": e["text"], "solution": e["solution"]} for e in legacy]
+        self._vectors = np.stack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+        self.save()
+        self.path.rename(self.path.with_name(self.path.name + ".bak"))
+
+    def _load(self) -> None:
+        """Read the metadata log and memory-map the embedding file."""
+        self.entries = []
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        if self.log_path.is_file():
+            raw = self.log_path.read_bytes()
+            complete = raw[: raw.rfind(b"\n") + 1]
+            if len(complete) != len(raw):
+                # Drop a record torn by an interrupted write
+                with self.log_path.open("r+b") as fh:
+                    fh.truncate(len(complete))
+            self.entries = [json.loads(line) for line in complete.splitlines() if line]
+        if not self.vectors_path.is_file():
+            if self.entries:
+                # The embeddings were lost but the records were not; rebuild them.
+                print(f"Re-embedding {len(self.entries)} memories: {self.vectors_path} is missing")
+                self._vectors = np.stack([self._vector(e["text"]) for e in self.entries])
+                self.save()
+            return
+        with self.vectors_path.open("rb") as fh:
+            version = np.lib.format.read_magic(fh)
+            if version == (1, 0):
+                shape, _, _ = np.lib.format.read_array_header_1_0(fh)
+            else:
+                shape, _, _ = np.lib.format.read_array_header_2_0(fh)
+            offset = fh.tell()
+        self._offset = offset
+        dim = shape[1]
+        rows = (self.vectors_path.stat().st_size - offset) // (dim * 4) if dim else 0
+        count = min(rows, len(self.entries))
+        if count != rows or count != len(self.entries) or count != shape[0]:
+            # An interrupted add left the two files out of step; keep the
+            # records present in both.
+            self.entries = self.entries[:count]
+            with self.vectors_path.open("r+b") as fh:
+                fh.truncate(offset + count * dim * 4)
+            self._write_log(self.entries)
+            self._write_header(count, dim, offset)
+        if count:
+            self._vectors = np.memmap(
+                self.vectors_path, dtype=np.float32, mode="r", offset=offset, shape=(count, dim)
+            )
+
+    def _write_log(self, entries: List[Dict[str, Any]]) -> None:
+        tmp = self.log_path.with_name(self.log_path.name + ".tmp")
+        tmp.write_text("".join(json.dumps(e) + "\n" for e in entries))
+        os.replace(tmp, self.log_path)
+
+    def _write_header(self, rows: int, dim: int, offset: int) -> bool:
+        """Rewrite the ``.npy`` header in place; return ``False`` if it no longer fits."""
+        header = _npy_header(rows, dim)
+        if len(header) != offset:
+            return False
+        with self.vectors_path.open("r+b") as fh:
+            fh.write(header)
+        return True
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        """Embed *texts* in one padded forward pass using masked mean pooling."""
+        # Padded here rather than by the tokenizer, whose settings are shared
+        # with every other user of the registry
+        tok = self.tokenizer
+        pad_id = next((i for i in (tok.pad_token_id, tok.eos_token_id) if i is not None), 0)
+        encoded = tok(texts, truncation=True)["input_ids"]
+        width = max(len(ids) for ids in encoded)
+        inputs = {
+            "input_ids": torch.tensor([ids + [pad_id] * (width - len(ids)) for ids in encoded]),
+            "attention_mask": torch.tensor(
+                [[1] * len(ids) + [0] * (width - len(ids)) for ids in encoded]
+            ),
+        }
+        with inference_mode():
+            hidden = self.model(**inputs).last_hidden_state
+        # Padding positions must not dilute the mean of shorter texts
+        mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+        pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+        return pooled.cpu().numpy()
 
     def _embed(self, text: str) -> List[float]:
-        inputs = self.tokenizer(text, return_tensors="pt", truncation=True)
-        with torch.no_grad():
-            outputs = self.model(**inputs).last_hidden_state.mean(dim=1)
-        return outputs.squeeze().tolist()
+        return self._embed_batch([text])[0].tolist()
+
+    def _vector(self, text: str) -> np.ndarray:
+        """Return the normalized ``float32`` embedding of *text*, using the cache."""
+        vec = self.embedding_cache.get(text)
+        if vec is None:
+            vec = _normalize(np.asarray(self._embed(text), dtype=np.float32).reshape(-1))
+            self.embedding_cache.put(text, vec)
+        return vec
+
+    def cache_info(self) -> Dict[str, int]:
+        """Return embedding cache hit/miss counters."""
+        return self.embedding_cache.info()
 
     def save(self) -> None:
-        self.path.write_text(json.dumps(self.entries))
+        """Rewrite both files from the in-memory state (used for compaction)."""
+        with self._lock:
+            vectors = np.ascontiguousarray(self._vectors, dtype=np.float32)
+            tmp = self.vectors_path.with_name(self.vectors_path.name + ".tmp")
+            with tmp.open("wb") as fh:
+                fh.write(_npy_header(*vectors.shape))
+                fh.write(vectors.tobytes())
+            self._vectors = np.zeros((0, 0), dtype=np.float32)
+            os.replace(tmp, self.vectors_path)
+            self._write_log(self.entries)
+            self._load()
+            if self.ann is not None:
+                if self.ann.ntotal != len(self.vectors):
+                    self.ann.sync(self.vectors)
+                self.ann.save()
 
     def add(self, text: str, solution: Dict[str, str]) -> None:
-        vec = self._embed(text)
-        self.entries.append({"text": text, "solution": solution, "embedding": vec})
-        self.save()
+        self._append([{"text": text, "solution": solution}], self._vector(text)[None, :])
+
+    def add_many(
+        self, items: Iterable[Tuple[str, Dict[str, str]]], batch_size: int | None = None
+    ) -> int:
+        """Embed and store many ``(text, solution)`` pairs, persisting once.
+
+        Texts missing from the embedding cache are sorted by length and
+        embedded *batch_size* at a time (``MEMORY_BATCH_SIZE``, default 32) so
+        each padded batch holds texts of similar length.
+        """
+        batch_size = batch_size or int(os.environ.get("MEMORY_BATCH_SIZE", 32))
+        entries = [{"text": text, "solution": solution} for text, solution in items]
+        if not entries:
+            return 0
+        vectors: Dict[str, np.ndarray] = {}
+        missing = set()
+        for entry in entries:
+            text = entry["text"]
+            if text in vectors or text in missing:
+                continue
+            cached = self.embedding_cache.get(text)
+            if cached is None:
+                missing.add(text)
+            else:
+                vectors[text] = cached
+        pending = sorted(missing, key=len)
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start : start + batch_size]
+            for text, vec in zip(batch, self._embed_batch(batch)):
+                vectors[text] = _normalize(np.asarray(vec, dtype=np.float32).reshape(-1))
+                self.embedding_cache.put(text, vectors[text])
+        self._append(entries, np.stack([vectors[e["text"]] for e in entries]))
+        return len(entries)
+
+    def _append(self, entries: List[Dict[str, Any]], rows: np.ndarray) -> None:
+        """Append *entries* and their normalized embedding *rows* to disk."""
+        with self._lock:
+            count, dim = len(self.entries), rows.shape[1]
+            if count and dim != self._vectors.shape[1]:
+                raise ValueError(
+                    f"embedding has {dim} dimensions, memory stores {self._vectors.shape[1]}"
+                )
+            if not self.vectors_path.is_file() or not count:
+                with self.vectors_path.open("wb") as fh:
+                    fh.write(_npy_header(0, dim))
+                self._offset = len(_npy_header(0, dim))
+            offset = self._offset
+            total = count + len(entries)
+            # Vectors first, then metadata: a crash in between is repaired on load.
+            with self.vectors_path.open("r+b") as fh:
+                fh.seek(offset + count * dim * 4)
+                fh.write(np.ascontiguousarray(rows, dtype=np.float32).tobytes())
+            with self.log_path.open("a") as fh:
+                fh.write("".join(json.dumps(e) + "\n" for e in entries))
+            self.entries.extend(entries)
+            if not self._write_header(total, dim, offset):
+                # Header outgrew its padding (older NumPy); fall back to a rewrite.
+                self._vectors = np.concatenate([self._vectors.reshape(-1, dim), rows])
+                self.save()
+                return
+            self._vectors = np.memmap(
+                self.vectors_path, dtype=np.float32, mode="r", offset=offset, shape=(total, dim)
+            )
+            if self.ann is not None:
+                self.ann.add(rows, self._vectors)
 
     def search(self, text: str, top_k: int = 3) -> List[Dict[str, Any]]:
-        if not self.entries:
+        return [entry for entry, _ in self.search_scored(text, top_k)]
+
+    def search_scored(self, text: str, top_k: int = 3) -> List[Tuple[Dict[str, Any], float]]:
+        """Return up to *top_k* ``(entry, cosine similarity)`` pairs, most similar first."""
+        if not self.entries or top_k <= 0:
             return []
-        query = np.array(self._embed(text))
-
-        def similarity(v: List[float]) -> float:
-            v = np.array(v)
-            denom = np.linalg.norm(query) * np.linalg.norm(v)
-            if denom == 0:
-                return 0.0
-            return float(np.dot(query, v) / denom)
-
-        scored = [(similarity(e["embedding"]), e) for e in self.entries]
-        scored.sort(key=lambda x: x[0], reverse=True)
-        return [e for _, e in scored[:top_k]]
+        query = self._vector(text)
+        with self._lock:
+            if self.ann is not None and self.ann.ready:
+                candidates = self.ann.search(query, top_k)
+                scores = np.zeros(len(self.entries), dtype=np.float32)
+                scores[candidates] = self.vectors[candidates] @ query
+                order = candidates[np.lexsort((candidates, -scores[candidates]))]
+            else:
+                scores = self.vectors @ query
+                if top_k < len(scores):
+                    # Keep every candidate tied with the k-th score so the final
+                    # ordering matches a full stable sort.
+                    kth = scores[np.argpartition(-scores, top_k - 1)[top_k - 1]]
+                    candidates = np.flatnonzero(scores >= kth)
+                else:
+                    candidates = np.arange(len(scores))
+                order = candidates[np.lexsort((candidates, -scores[candidates]))][:top_k]
+            return [(self.entries[i], float(scores[i])) for i in order]
@@ -0,0 +1,114 @@
+"""Process-wide registry that loads Hugging Face models on first use and shares them."""
+
+import os
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+
+from transformers import AutoModel, AutoModelForCausalLM, AutoTokenizer
+
+from .inference import BACKENDS, configure_threads, inference_mode, load_onnx, quantize
+
+# Model classes by the kind of head a component needs
+MODEL_KINDS = {"causal": AutoModelForCausalLM, "base": AutoModel}
+
+
+def resident_memory() -> int:
+    """Return the resident set size of this process in bytes (0 if unknown)."""
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+
+        # ru_maxrss is the peak, in kilobytes on Linux; close enough as a fallback
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except (ImportError, OSError):
+        return 0
+
+
+class ModelRegistry:
+    """Load each tokenizer and model once per process, on first request.
+
+    Models are keyed by name and kind (``"causal"`` or ``"base"``) and
+    tokenizers by name, so components asking for the same checkpoint share
+    one instance. Concurrent first requests for the same model wait for a
+    single load. :meth:`stats` reports how long every load took and how much
+    the process grew while loading it.
+
+    *backend* (default ``INFERENCE_BACKEND``) picks how models run:
+    ``"torch"`` as loaded, ``"int8"`` with dynamically quantized linear layers
+    or ``"onnx"`` through ONNX Runtime.
+    """
+
+    def __init__(self, backend: str | None = None) -> None:
+        self.backend = backend or os.environ.get("INFERENCE_BACKEND", "torch")
+        if self.backend not in BACKENDS:
+            raise ValueError(f"unknown inference backend {self.backend!r}, expected one of {BACKENDS}")
+        self._tokenizers: Dict[str, Any] = {}
+        self._models: Dict[Tuple[str, str], Any] = {}
+        self._stats: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _key_lock(self, key: Tuple[str, str]) -> threading.Lock:
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def tokenizer(self, name: str) -> Any:
+        key = (name, "tokenizer")
+        with self._key_lock(key):
+            if name not in self._tokenizers:
+                self._tokenizers[name] = AutoTokenizer.from_pretrained(name)
+            return self._tokenizers[name]
+
+    def model(self, name: str, kind: str = "causal") -> Any:
+        if kind not in MODEL_KINDS:
+            raise ValueError(f"unknown model kind {kind!r}, expected one of {sorted(MODEL_KINDS)}")
+        key = (name, kind)
+        with self._key_lock(key):
+            if key not in self._models:
+                configure_threads()
+                rss = resident_memory()
+                started = time.perf_counter()
+                if self.backend == "onnx":
+                    model = load_onnx(name, kind)
+                else:
+                    model = MODEL_KINDS[kind].from_pretrained(name)
+                    if hasattr(model, "eval"):
+                        model.eval()
+                    if self.backend == "int8":
+                        model = quantize(model)
+                self._models[key] = model
+                self._stats[key] = {
+                    "name": name,
+                    "kind": kind,
+                    "backend": self.backend,
+                    "load_seconds": round(time.perf_counter() - started, 3),
+                    "rss_bytes": max(resident_memory() - rss, 0),
+                }
+                print(
+                    f"Loaded {kind} model {name} in {self._stats[key]['load_seconds']:.1f}s "
+                    f"(+{self._stats[key]['rss_bytes'] / 2**20:.0f} MiB resident)"
+                )
+            return self._models[key]
+
+    def loaded(self, name: str, kind: str = "causal") -> bool:
+        return (name, kind) in self._models
+
+    def warm_up(self, name: str, kind: str = "causal") -> None:
+        """Load *name* and run one short forward pass so the first real call is fast."""
+        tokenizer = self.tokenizer(name)
+        model = self.model(name, kind)
+        inputs = tokenizer("warm up", return_tensors="pt")
+        with inference_mode():
+            model(**inputs)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Load time and resident memory growth for every model loaded so far."""
+        return [dict(s) for s in self._stats.values()]
+
+
+registry = ModelRegistry()
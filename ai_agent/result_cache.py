@@ -0,0 +1,80 @@
+"""Persistent cache of generated patches so repeated deliveries of a bug are free."""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+
+def result_key(model_name: str, bug_text: str, file: str, code: str, params: Any) -> str:
+    """Return the cache key of one generated patch.
+
+    The file content enters through its own hash, so editing a file
+    invalidates only the entries for that file.
+    """
+    content_hash = hashlib.sha256(code.encode("utf-8")).hexdigest()
+    material = json.dumps([model_name, bug_text, file, content_hash, params], sort_keys=True)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """SQLite table of patches keyed by :func:`result_key`.
+
+    Holds at most ``max_entries`` rows; inserting beyond that evicts the
+    least recently used ones.
+    """
+
+    def __init__(self, path: str | Path, max_entries: int = 1000) -> None:
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                """CREATE TABLE IF NOT EXISTS results (
+                    key TEXT PRIMARY KEY,
+                    patch TEXT NOT NULL,
+                    used REAL NOT NULL
+                )"""
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS results_used ON results (used)")
+
+    @classmethod
+    def from_env(cls) -> Optional["ResultCache"]:
+        """Open ``RESULT_CACHE_FILE`` bounded by ``RESULT_CACHE_SIZE`` (``0`` disables it)."""
+        size = int(os.environ.get("RESULT_CACHE_SIZE", 1000))
+        if size <= 0:
+            return None
+        return cls(os.environ.get("RESULT_CACHE_FILE", "analysis_cache.db"), size)
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock, self._db:
+            row = self._db.execute("SELECT patch FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._db.execute("UPDATE results SET used = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    def put(self, key: str, patch: str) -> None:
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO results (key, patch, used) VALUES (?, ?, ?)",
+                (key, patch, time.time()),
+            )
+            self._db.execute(
+                "DELETE FROM results WHERE key IN ("
+                "SELECT key FROM results ORDER BY used DESC, rowid DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
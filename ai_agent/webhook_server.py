@@ -16,11 +16,17 @@ from .connectors.jira import JiraConnector
 from .connectors.github import GitHubConnector
 from .analysis import CodeAnalyzer
 from .memory import SimpleMemory
+from .result_cache import ResultCache
 from .agent import BugTriageAgent
+from .checkpoint import TriageCheckpoint
+from .code_index import LocalCodeIndex
+from .job_queue import JobQueue, QueueFull
 
 
 app = Flask(__name__)
 agent: Optional[BugTriageAgent] = None
+# When set, bugs are processed in the background instead of inside the request
+jobs: Optional[JobQueue] = None
 
 
 def init_agent() -> BugTriageAgent:
@@ -36,16 +42,22 @@ def init_agent() -> BugTriageAgent:
 
     memory_file = os.environ.get("MEMORY_FILE", "memory.json")
     memory = SimpleMemory(path=memory_file)
-    analyzer = CodeAnalyzer(memory=memory)
 
     repo = os.environ.get("GITHUB_REPO")
     gh_token = os.environ.get("GITHUB_TOKEN")
     if not repo or not gh_token:
         raise SystemExit("GITHUB_REPO and GITHUB_TOKEN must be set")
 
+    code_index = LocalCodeIndex.from_env(repo, gh_token)
+    analyzer = CodeAnalyzer(
+        memory=memory,
+        source_root=code_index.root if code_index else None,
+        result_cache=ResultCache.from_env(),
+    )
     github = GitHubConnector(repo, gh_token)
 
-    return BugTriageAgent(jira, github, analyzer)
+    checkpoint = TriageCheckpoint(os.environ.get("TRIAGE_CHECKPOINT", "triage_checkpoint.json"))
+    return BugTriageAgent(jira, github, analyzer, code_index=code_index, checkpoint=checkpoint)
 
 
 @app.route("/webhook", methods=["POST", "GET"])
@@ -79,15 +91,38 @@ def webhook() -> tuple:
         if issuetype == "bug":
             # Show the raw issue for debugging purposes when a ticket is created
             print(f"Received new issue via webhook: {json.dumps(issue)}")
-            agent.process_bug(issue)
-            return jsonify({"status": "processed"}), 200
+            if jobs is None:
+                agent.process_bug(issue)
+                return jsonify({"status": "processed"}), 200
+            try:
+                job_id, created = jobs.enqueue(issue)
+            except QueueFull as exc:
+                return jsonify({"error": "queue full", "reason": str(exc)}), 503
+            status = "queued" if created else "duplicate"
+            return jsonify({"status": status, "job_id": job_id}), 202
         return jsonify({"status": "ignored", "reason": "not a bug"}), 200
     return jsonify({"status": "ignored", "reason": "not a creation event"}), 200
 
 
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id: str) -> tuple:
+    """Report the state of a queued webhook job."""
+    job = jobs.get(job_id) if jobs is not None else None
+    if job is None:
+        return jsonify({"error": "unknown job"}), 404
+    return jsonify(job), 200
+
+
 def main() -> None:
-    global agent
+    global agent, jobs
     agent = init_agent()
+    jobs = JobQueue(
+        os.environ.get("JOB_QUEUE_FILE", "jobs.db"),
+        agent.process_bug,
+        workers=int(os.environ.get("WEBHOOK_WORKERS", 2)),
+        max_pending=int(os.environ.get("JOB_QUEUE_SIZE", 100)),
+    )
+    jobs.start()
 
     port = int(os.environ.get("PORT", 8000))
     host = os.environ.get("HOST", "0.0.0.0")
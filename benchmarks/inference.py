@@ -0,0 +1,130 @@
+"""Latency, memory and output-quality benchmark of the CPU inference backends.
+
+Run from the repository root::
+
+    python -m benchmarks.inference --backends torch int8 onnx --threads 4
+
+Every backend loads the analysis model (``HF_MODEL``) and the memory
+embedding model (``MEMORY_MODEL``) into its own registry. It reports the
+load time and resident memory added, the mean latency of greedy generation
+and of embedding a batch, and the agreement with the first backend:
+the fraction of generated tokens that match and the mean cosine similarity
+of the embeddings. Backends run one after another in the same process, so
+for exact memory figures run one backend per invocation.
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+from ai_agent.inference import configure_threads, inference_mode
+from ai_agent.models import ModelRegistry
+
+PROMPTS = [
+    "Bug Title: Crash on empty config\nDescription: load_config raises KeyError\n"
+    "File: config.py\nCode:\ndef load_config(path):\n    return json.load(open(path))['app']\n"
+    "# Suggested patch:\n",
+    "Bug Title: Wrong total\nDescription: invoice total ignores discounts\n"
+    "File: billing.py\nCode:\ndef total(items):\n    return sum(i.price for i in items)\n"
+    "# Suggested patch:\n",
+]
+TEXTS = [
+    "Login fails with a 500 error when the password contains unicode",
+    "Export to CSV drops the last row",
+    "Dashboard is slow to load for accounts with many projects",
+    "Null pointer exception when saving an empty form",
+]
+
+
+def run_backend(backend: str, causal: str, embedder: str, new_tokens: int, repeat: int) -> dict:
+    registry = ModelRegistry(backend)
+    tokenizer = registry.tokenizer(causal)
+    model = registry.model(causal, "causal")
+    embed_tokenizer = registry.tokenizer(embedder)
+    embed_model = registry.model(embedder, "base")
+    if getattr(embed_tokenizer, "pad_token", None) is None:
+        embed_tokenizer.pad_token = embed_tokenizer.eos_token
+
+    outputs = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        outputs = []
+        for prompt in PROMPTS:
+            inputs = tokenizer(prompt, return_tensors="pt")
+            with inference_mode():
+                ids = model.generate(**inputs, max_new_tokens=new_tokens, do_sample=False)
+            outputs.append(ids[0][inputs["input_ids"].shape[1] :].tolist())
+    generate_ms = (time.perf_counter() - start) / (repeat * len(PROMPTS)) * 1000
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        inputs = embed_tokenizer(TEXTS, return_tensors="pt", truncation=True, padding=True)
+        with inference_mode():
+            hidden = embed_model(**inputs).last_hidden_state
+        mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+        vectors = ((hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)).numpy()
+    embed_ms = (time.perf_counter() - start) / repeat * 1000
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    loads = registry.stats()
+    return {
+        "backend": backend,
+        "load_seconds": sum(s["load_seconds"] for s in loads),
+        "rss_mib": sum(s["rss_bytes"] for s in loads) / 2**20,
+        "generate_ms": generate_ms,
+        "embed_ms": embed_ms,
+        "tokens": outputs,
+        "vectors": vectors,
+    }
+
+
+def agreement(result: dict, baseline: dict) -> tuple[float, float]:
+    matched = total = 0
+    for ours, theirs in zip(result["tokens"], baseline["tokens"]):
+        total += max(len(ours), len(theirs))
+        matched += sum(a == b for a, b in zip(ours, theirs))
+    cosine = float(np.mean(np.sum(result["vectors"] * baseline["vectors"], axis=1)))
+    return matched / max(total, 1), cosine
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backends", nargs="+", default=["torch", "int8"])
+    parser.add_argument("--causal-model", default=os.environ.get("HF_MODEL", "gpt2"))
+    parser.add_argument(
+        "--embed-model", default=os.environ.get("MEMORY_MODEL", "distilbert-base-uncased")
+    )
+    parser.add_argument("--new-tokens", type=int, default=32)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--interop-threads", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    configure_threads(args.threads, args.interop_threads)
+    results = []
+    for backend in args.backends:
+        try:
+            results.append(
+                run_backend(backend, args.causal_model, args.embed_model, args.new_tokens, args.repeat)
+            )
+        except RuntimeError as exc:
+            print(f"{backend}: skipped ({exc})")
+    if not results:
+        return
+
+    print(
+        f"{'backend':>8} {'load s':>7} {'RSS MiB':>8} {'gen ms':>8} {'embed ms':>9} "
+        f"{'tokens':>7} {'cosine':>7}"
+    )
+    for result in results:
+        tokens, cosine = agreement(result, results[0])
+        print(
+            f"{result['backend']:>8} {result['load_seconds']:7.1f} {result['rss_mib']:8.0f} "
+            f"{result['generate_ms']:8.1f} {result['embed_ms']:9.1f} {tokens:7.1%} {cosine:7.4f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
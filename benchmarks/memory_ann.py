@@ -0,0 +1,91 @@
+"""Recall-vs-latency benchmark of approximate memory search against exact search.
+
+Run from the repository root::
+
+    python -m benchmarks.memory_ann --size 100000 --dim 768
+
+Synthetic embeddings are drawn around random cluster centres (real ticket
+embeddings are strongly clustered) and normalized like ``SimpleMemory`` does.
+Each approximate configuration reports build time, mean query latency and
+recall@k relative to the exact top-k.
+"""
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from ai_agent.ann_index import AnnIndex
+
+
+def make_vectors(size: int, dim: int, clusters: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=size)
+    vectors = centres[labels] + 0.5 * rng.normal(size=(size, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def exact_top_k(vectors: np.ndarray, queries: np.ndarray, top_k: int) -> tuple[list[set], float]:
+    results = []
+    start = time.perf_counter()
+    for query in queries:
+        scores = vectors @ query
+        results.append(set(np.argpartition(-scores, top_k - 1)[:top_k].tolist()))
+    return results, (time.perf_counter() - start) / len(queries)
+
+
+def run(index: AnnIndex, vectors: np.ndarray, queries: np.ndarray, truth: list[set], top_k: int):
+    start = time.perf_counter()
+    index.add(vectors, vectors)
+    build = time.perf_counter() - start
+    hits = 0
+    start = time.perf_counter()
+    for query, expected in zip(queries, truth):
+        hits += len(expected & set(index.search(query, top_k).tolist()))
+    latency = (time.perf_counter() - start) / len(queries)
+    return build, latency, hits / (len(queries) * top_k)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--clusters", type=int, default=500)
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[16, 32, 64, 128])
+    parser.add_argument("--hnsw-m", type=int, default=32)
+    parser.add_argument("--nlist", type=int, nargs="+", default=[256, 1024])
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 16, 64])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    vectors = make_vectors(args.size, args.dim, args.clusters, args.seed)
+    queries = make_vectors(args.queries, args.dim, args.clusters, args.seed)
+    truth, exact_latency = exact_top_k(vectors, queries, args.top_k)
+    print(f"{'mode':<6} {'params':<22} {'build s':>9} {'ms/query':>9} {'recall@' + str(args.top_k):>9}")
+    print(f"{'exact':<6} {'':<22} {0:>9.2f} {exact_latency * 1000:>9.3f} {1:>9.3f}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "bench.faiss"
+        configs = [
+            ("hnsw", f"M={args.hnsw_m} ef={ef}", {"hnsw_m": args.hnsw_m, "ef_search": ef})
+            for ef in args.ef_search
+        ] + [
+            ("ivf", f"nlist={nlist} nprobe={nprobe}", {"nlist": nlist, "nprobe": nprobe})
+            for nlist in args.nlist
+            for nprobe in args.nprobe
+            if nprobe <= nlist and nlist * 39 <= args.size
+        ]
+        for kind, label, params in configs:
+            index = AnnIndex(kind, path, save_every=args.size + 1, **params)
+            build, latency, recall = run(index, vectors, queries, truth, args.top_k)
+            print(f"{kind:<6} {label:<22} {build:>9.2f} {latency * 1000:>9.3f} {recall:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,8 +5,11 @@ from flask import Flask, request, jsonify
 
 from ai_agent.analysis import CodeAnalyzer
 from ai_agent.memory import SimpleMemory
+from ai_agent.models import registry
+from ai_agent.result_cache import ResultCache
 
 app = Flask(__name__)
+# Models are loaded on first use (or by the warm-up below), not at import
 memory = SimpleMemory(path="memory.json")
 analyzer = CodeAnalyzer(memory=memory)
 
@@ -33,6 +36,15 @@ def remember_fix():
     return jsonify({"status": "stored"})
 
 
+@app.route("/models", methods=["GET"])
+def loaded_models():
+    """Report load time and memory of the models loaded by this process."""
+    return jsonify(registry.stats())
+
+
 if __name__ == "__main__":
+    analyzer.result_cache = ResultCache.from_env()
+    if os.getenv("MODEL_WARMUP", "1") != "0":
+        analyzer.warm_up()
     port = int(os.getenv("PORT", 5002))
     app.run(host="0.0.0.0", port=port)
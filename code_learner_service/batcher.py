@@ -0,0 +1,96 @@
+"""Dynamic batching of concurrent generation requests."""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Deque, List, Optional, Tuple
+
+
+class Overloaded(Exception):
+    """Raised when ``max_queue`` requests are already waiting."""
+
+
+class GenerationBatcher:
+    """Gather concurrent prompts into padded batches for one ``generate`` call.
+
+    A worker thread takes the oldest waiting request, waits up to *window*
+    seconds for more, and passes up to *max_batch* prompts that share the
+    same ``max_new_tokens`` to *generate_batch*, which returns one completion
+    per prompt. If it raises, or returns the wrong number of completions,
+    every request of the batch fails with that error.
+    """
+
+    def __init__(
+        self,
+        generate_batch: Callable[[List[str], int], List[str]],
+        max_batch: int = 8,
+        window: float = 0.01,
+        max_queue: int = 64,
+    ) -> None:
+        self.generate_batch = generate_batch
+        self.max_batch = max(1, max_batch)
+        self.window = window
+        self.max_queue = max_queue
+        self.batches = 0
+        self.requests = 0
+        self._queue: Deque[Tuple[str, int, Future]] = deque()
+        self._ready = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, prompt: str, max_new_tokens: int = 64) -> Future:
+        """Queue *prompt* and return a future for its completion.
+
+        Raises :class:`Overloaded` when the queue is at capacity.
+        """
+        future: Future = Future()
+        with self._ready:
+            if len(self._queue) >= self.max_queue:
+                raise Overloaded(f"{len(self._queue)} requests already queued")
+            self._queue.append((prompt, max_new_tokens, future))
+            self._ready.notify()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work, daemon=True)
+                self._thread.start()
+        return future
+
+    def _next_batch(self) -> List[Tuple[str, int, Future]]:
+        with self._ready:
+            while not self._queue:
+                self._ready.wait()
+            deadline = time.monotonic() + self.window
+            while len(self._queue) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._ready.wait(remaining)
+            tokens = self._queue[0][1]
+            batch = [r for r in self._queue if r[1] == tokens][: self.max_batch]
+            for request in batch:
+                self._queue.remove(request)
+            return batch
+
+    def _work(self) -> None:
+        while True:
+            batch = self._next_batch()
+            prompts = [prompt for prompt, _, _ in batch]
+            try:
+                completions = self.generate_batch(prompts, batch[0][1])
+            except Exception as exc:  # report the failure to every caller in the batch
+                for _, _, future in batch:
+                    future.set_exception(exc)
+                continue
+            completions = list(completions)
+            if len(completions) != len(batch):
+                exc = RuntimeError(
+                    f"generate_batch returned {len(completions)} completions for {len(batch)} prompts"
+                )
+                for _, _, future in batch:
+                    future.set_exception(exc)
+                continue
+            self.batches += 1
+            self.requests += len(batch)
+            for (_, _, future), completion in zip(batch, completions):
+                future.set_result(completion)
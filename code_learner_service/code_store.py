@@ -0,0 +1,136 @@
+"""Disk-backed store of learned files, deduplicated by content hash."""
+
+from __future__ import annotations
+
+import hashlib
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+class CodeStore:
+    """Dict-like SQLite store mapping file names to their latest content.
+
+    Contents are kept once per SHA-256 hash (zlib compressed), so identical
+    files share storage, and a blob is removed when no file refers to it any
+    more. Nothing is held in memory beyond the current query; the database is
+    opened on first use.
+    """
+
+    def __init__(self, path: str | Path = "code_store.db") -> None:
+        self.path = str(path)
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            with self._db:
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, data BLOB NOT NULL)"
+                )
+                self._db.execute(
+                    """CREATE TABLE IF NOT EXISTS files (
+                        name TEXT PRIMARY KEY,
+                        hash TEXT NOT NULL,
+                        size INTEGER NOT NULL,
+                        updated REAL NOT NULL
+                    )"""
+                )
+                self._db.execute("CREATE INDEX IF NOT EXISTS files_hash ON files (hash)")
+        return self._db
+
+    def update(self, items: Iterable[Tuple[str, str]]) -> None:
+        """Store every ``(name, content)`` pair in one transaction."""
+        with self._lock:
+            db = self._conn()
+            with db:
+                for name, content in items:
+                    data = content.encode("utf-8")
+                    digest = hashlib.sha256(data).hexdigest()
+                    row = db.execute("SELECT hash FROM files WHERE name = ?", (name,)).fetchone()
+                    if row and row[0] == digest:
+                        continue
+                    db.execute(
+                        "INSERT OR IGNORE INTO blobs (hash, data) VALUES (?, ?)",
+                        (digest, zlib.compress(data)),
+                    )
+                    db.execute(
+                        "INSERT OR REPLACE INTO files (name, hash, size, updated) VALUES (?, ?, ?, ?)",
+                        (name, digest, len(data), time.time()),
+                    )
+                    if row:
+                        self._drop_blob(db, row[0])
+
+    @staticmethod
+    def _drop_blob(db: sqlite3.Connection, digest: str) -> None:
+        db.execute(
+            "DELETE FROM blobs WHERE hash = ? AND NOT EXISTS (SELECT 1 FROM files WHERE hash = ?)",
+            (digest, digest),
+        )
+
+    def __setitem__(self, name: str, content: str) -> None:
+        self.update([(name, content)])
+
+    def __getitem__(self, name: str) -> str:
+        with self._lock:
+            row = self._conn().execute(
+                "SELECT blobs.data FROM files JOIN blobs ON blobs.hash = files.hash WHERE files.name = ?",
+                (name,),
+            ).fetchone()
+        if row is None:
+            raise KeyError(name)
+        return zlib.decompress(row[0]).decode("utf-8")
+
+    def get(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def __delitem__(self, name: str) -> None:
+        with self._lock:
+            db = self._conn()
+            with db:
+                row = db.execute("SELECT hash FROM files WHERE name = ?", (name,)).fetchone()
+                if row is None:
+                    raise KeyError(name)
+                db.execute("DELETE FROM files WHERE name = ?", (name,))
+                self._drop_blob(db, row[0])
+
+    def __contains__(self, name: object) -> bool:
+        with self._lock:
+            return (
+                self._conn().execute("SELECT 1 FROM files WHERE name = ?", (name,)).fetchone()
+                is not None
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn().execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def records(self, after: str = "", limit: int = 100) -> List[Dict[str, Any]]:
+        """Return up to *limit* file records (no content) named after *after*, by name."""
+        with self._lock:
+            rows = self._conn().execute(
+                "SELECT name, hash, size, updated FROM files WHERE name > ? ORDER BY name LIMIT ?",
+                (after, limit),
+            ).fetchall()
+        return [{"file": n, "hash": h, "size": s, "updated": u} for n, h, s, u in rows]
+
+    def iter_items(self, page_size: int = 100) -> Iterator[Tuple[str, str]]:
+        """Yield every ``(name, content)`` pair, reading *page_size* files at a time."""
+        after = ""
+        while True:
+            page = self.records(after, page_size)
+            for record in page:
+                content = self.get(record["file"])
+                if content is not None:
+                    yield record["file"], content
+            if len(page) < page_size:
+                return
+            after = page[-1]["file"]
@@ -1,37 +1,131 @@
 """Microservice for learning and querying code snippets."""
 
+import json
 import os
-from typing import Any
+import threading
+from concurrent.futures import TimeoutError as FutureTimeout
+from typing import Any, Iterator, List
 
-from flask import Flask, request, jsonify
-from transformers import AutoModelForCausalLM, AutoTokenizer
+import torch
+from flask import Flask, Response, request, jsonify, stream_with_context
 
+from ai_agent.inference import inference_mode
+from ai_agent.models import registry
+
+from .batcher import GenerationBatcher, Overloaded
+from .code_store import CodeStore
 from .vector_index import CodeVectorIndex
 
 
 app = Flask(__name__)
-code_memory: dict[str, str] = {}
-vector_index = CodeVectorIndex()
+code_memory = CodeStore(os.getenv("CODE_STORE_FILE", "code_store.db"))
+vector_index = CodeVectorIndex(
+    batch_size=int(os.getenv("LEARN_BATCH_SIZE", 64)),
+    flush_interval=float(os.getenv("LEARN_FLUSH_SECONDS", 5)),
+    persist_every=int(os.getenv("LEARN_PERSIST_EVERY", 1000)),
+    persist_interval=float(os.getenv("LEARN_PERSIST_SECONDS", 60)),
+    query_cache_size=int(os.getenv("QUERY_CACHE_SIZE", 256)),
+    compact_ratio=float(os.getenv("LEARN_COMPACT_RATIO", 0.25)),
+)
 
 MODEL_NAME = os.getenv("CODE_MODEL", "bigcode/starcoderbase-1b")
-tokenizer: AutoTokenizer | None = None
-model: AutoModelForCausalLM | None = None
 
 
-def _load_model() -> None:
-    global tokenizer, model
-    if tokenizer is None or model is None:
-        tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-        model = AutoModelForCausalLM.from_pretrained(MODEL_NAME)
+def generate_batch(prompts: List[str], max_new_tokens: int = 64) -> List[str]:
+    """Complete several prompts with one padded ``generate`` call."""
+    tokenizer = registry.tokenizer(MODEL_NAME)
+    model = registry.model(MODEL_NAME, "causal")
+    # Padding is done here rather than by the tokenizer, whose settings are
+    # shared with every other user of the registry.
+    pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+    encoded = tokenizer(prompts)["input_ids"]
+    width = max(len(ids) for ids in encoded)
+    # Decoder-only models continue from the last position, so pad on the left
+    input_ids = torch.tensor([[pad_id] * (width - len(ids)) + ids for ids in encoded])
+    attention_mask = torch.tensor([[0] * (width - len(ids)) + [1] * len(ids) for ids in encoded])
+    with inference_mode():
+        outputs = model.generate(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            max_new_tokens=max_new_tokens,
+            pad_token_id=pad_id,
+        )
+    return [tokenizer.decode(ids, skip_special_tokens=True) for ids in outputs]
+
+
+batcher = GenerationBatcher(
+    generate_batch,
+    max_batch=int(os.getenv("GENERATE_BATCH_SIZE", 8)),
+    window=float(os.getenv("GENERATE_WINDOW_MS", 10)) / 1000,
+    max_queue=int(os.getenv("GENERATE_QUEUE_SIZE", 64)),
+)
+GENERATE_TIMEOUT = float(os.getenv("GENERATE_TIMEOUT_SECONDS", 300))
+# Streaming requests bypass the batcher; this bounds how many run at once
+stream_slots = threading.BoundedSemaphore(int(os.getenv("GENERATE_MAX_STREAMS", 4)))
 
 
 def generate_code(prompt: str, max_new_tokens: int = 64) -> str:
-    """Generate code completion using StarCoder (or compatible) model."""
-    _load_model()
-    assert tokenizer is not None and model is not None
-    inputs = tokenizer(prompt, return_tensors="pt")
-    outputs = model.generate(**inputs, max_new_tokens=max_new_tokens)
-    return tokenizer.decode(outputs[0], skip_special_tokens=True)
+    """Generate code completion using StarCoder (or compatible) model.
+
+    Concurrent calls are batched together. Raises :class:`Overloaded` when
+    too many requests are waiting, and ``concurrent.futures.TimeoutError``
+    after ``GENERATE_TIMEOUT`` seconds without a completion.
+    """
+    return batcher.submit(prompt, max_new_tokens).result(timeout=GENERATE_TIMEOUT)
+
+
+def stream_code(
+    prompt: str, max_new_tokens: int = 64, slot: threading.Semaphore | None = None
+) -> Iterator[str]:
+    """Yield the completion of *prompt* piece by piece as it is generated.
+
+    Closing the iterator early stops generation at the next token. An
+    acquired *slot* is released once the model has stopped, not when the
+    reader does. Raises ``RuntimeError`` if generation fails.
+    """
+    started = False
+    try:
+        from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+
+        class Cancelled(StoppingCriteria):
+            def __call__(self, input_ids, scores, **kwargs) -> bool:
+                return cancelled.is_set()
+
+        tokenizer = registry.tokenizer(MODEL_NAME)
+        model = registry.model(MODEL_NAME, "causal")
+        streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True, timeout=300)
+        inputs = tokenizer(prompt, return_tensors="pt")
+        cancelled = threading.Event()
+        failures: List[Exception] = []
+
+        def run() -> None:
+            try:
+                with inference_mode():
+                    model.generate(
+                        **inputs,
+                        max_new_tokens=max_new_tokens,
+                        streamer=streamer,
+                        stopping_criteria=StoppingCriteriaList([Cancelled()]),
+                    )
+            except Exception as exc:  # end the stream instead of leaving the reader waiting
+                print(f"Streaming generation failed: {exc}")
+                failures.append(exc)
+                streamer.end()
+            finally:
+                if slot is not None:
+                    slot.release()
+
+        threading.Thread(target=run, daemon=True).start()
+        started = True
+        try:
+            yield from streamer
+        finally:
+            cancelled.set()
+    finally:
+        if slot is not None and not started:
+            slot.release()
+    if failures:
+        raise RuntimeError(f"generation failed: {failures[0]}")
 
 
 @app.route("/learn", methods=["POST"])
@@ -47,30 +141,131 @@ def learn_code():
     return jsonify({"status": "stored", "file": filename}), 200
 
 
+@app.route("/learn_batch", methods=["POST"])
+def learn_batch():
+    """Store many snippets at once: ``{"files": [{"file": ..., "content": ...}, ...]}``."""
+    payload = request.get_json(force=True)
+    files = payload.get("files") if isinstance(payload, dict) else None
+    if not isinstance(files, list) or not all(isinstance(f, dict) and f.get("file") for f in files):
+        return jsonify({"error": "files must be a list of objects with a file key"}), 400
+    items = [(f["file"], f.get("content", "")) for f in files]
+    code_memory.update(items)
+    count = vector_index.add_many(items)
+    return jsonify({"status": "stored", "count": count}), 200
+
+
 @app.route("/memory", methods=["GET"])
 def get_memory():
-    """Return known code snippets."""
-    return jsonify(code_memory)
+    """List known files a page at a time, or stream every file with ``?stream=1``.
+
+    Pages hold ``limit`` records (default 100, at most 1000) of file names,
+    sizes and hashes; pass the returned ``next`` as ``after`` for the next page.
+    Streaming returns one JSON object with ``file`` and ``content`` per line.
+    """
+    if request.args.get("stream"):
+        def lines():
+            for name, content in code_memory.iter_items():
+                yield json.dumps({"file": name, "content": content}) + "\n"
+
+        return Response(lines(), mimetype="application/x-ndjson")
+    try:
+        limit = min(max(int(request.args.get("limit", 100)), 1), 1000)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    records = code_memory.records(request.args.get("after", ""), limit)
+    next_after = records[-1]["file"] if len(records) == limit else None
+    return jsonify({"files": records, "next": next_after, "total": len(code_memory)})
+
+
+@app.route("/memory/<path:filename>", methods=["GET"])
+def get_memory_file(filename: str):
+    """Return the stored content of one file."""
+    content = code_memory.get(filename)
+    if content is None:
+        return jsonify({"error": "unknown file"}), 404
+    return jsonify({"file": filename, "content": content})
 
 
 @app.route("/query", methods=["POST"])
 def query_code() -> Any:
-    """Search indexed code snippets for a text query."""
+    """Search indexed code for a text query, returning ranked files and line ranges."""
     payload = request.get_json(force=True)
     query = payload.get("query", "")
-    files = vector_index.query(query)
-    return jsonify({"files": files})
+    matches = vector_index.query_chunks(query)
+    return jsonify({"files": [m["file"] for m in matches], "matches": matches})
+
+
+@app.route("/query_batch", methods=["POST"])
+def query_batch() -> Any:
+    """Run several searches at once: ``{"queries": [...], "top_k": 3}`` (``top_k`` at most 50)."""
+    payload = request.get_json(force=True)
+    queries = payload.get("queries") if isinstance(payload, dict) else None
+    if not isinstance(queries, list) or not all(isinstance(q, str) for q in queries):
+        return jsonify({"error": "queries must be a list of strings"}), 400
+    try:
+        top_k = min(max(int(payload.get("top_k", 3)), 1), 50)
+    except (TypeError, ValueError):
+        return jsonify({"error": "top_k must be an integer"}), 400
+    results = vector_index.query_many(queries, top_k)
+    return jsonify(
+        {"results": [{"files": [m["file"] for m in matches], "matches": matches} for matches in results]}
+    )
 
 
 @app.route("/generate", methods=["POST"])
 def generate() -> Any:
-    """Generate code with the selected model."""
+    """Generate code with the selected model.
+
+    With ``"stream": true`` the completion is sent as server-sent events:
+    one ``{"token": ...}`` event per generated piece, then
+    ``{"done": true, "completion": ...}``, or ``{"error": ...}`` if
+    generation failed.
+    """
     payload = request.get_json(force=True)
     prompt = payload.get("prompt", "")
-    result = generate_code(prompt)
+    if payload.get("stream"):
+        if not stream_slots.acquire(blocking=False):
+            return jsonify({"error": "overloaded", "reason": "too many streams"}), 503
+        started = []
+
+        def events() -> Iterator[str]:
+            # From here on the slot belongs to stream_code, which frees it when generation ends
+            started.append(True)
+            completion = prompt
+            try:
+                for piece in stream_code(prompt, slot=stream_slots):
+                    completion += piece
+                    yield f"data: {json.dumps({'token': piece})}\n\n"
+            except RuntimeError as exc:
+                yield f"data: {json.dumps({'error': str(exc)})}\n\n"
+                return
+            yield f"data: {json.dumps({'done': True, 'completion': completion})}\n\n"
+
+        def release_unstarted() -> None:
+            # The client went away before the stream began
+            if not started:
+                stream_slots.release()
+
+        response = Response(stream_with_context(events()), mimetype="text/event-stream")
+        response.call_on_close(release_unstarted)
+        return response
+    try:
+        result = generate_code(prompt)
+    except Overloaded as exc:
+        return jsonify({"error": "overloaded", "reason": str(exc)}), 503
+    except FutureTimeout:
+        return jsonify({"error": "timeout", "reason": f"no completion after {GENERATE_TIMEOUT:g}s"}), 504
     return jsonify({"completion": result})
 
 
+@app.route("/models", methods=["GET"])
+def loaded_models() -> Any:
+    """Report load time and memory of the models loaded by this process."""
+    return jsonify(registry.stats())
+
+
 if __name__ == "__main__":
+    if os.getenv("MODEL_WARMUP", "1") != "0":
+        registry.warm_up(MODEL_NAME, "causal")
     port = int(os.getenv("PORT", 5001))
     app.run(host="0.0.0.0", port=port)
@@ -1,42 +1,338 @@
 from __future__ import annotations
 
+import atexit
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
 from pathlib import Path
-from typing import List
+from typing import Any, Dict, Iterable, List, Set, Tuple
 
-from llama_index import Document, ServiceContext, StorageContext, VectorStoreIndex
+from llama_index import Document, QueryBundle, ServiceContext, StorageContext, VectorStoreIndex
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 from llama_index.vector_stores.faiss import FaissVectorStore
 
+from ai_agent.context import split_chunks
+
+
+def chunk_id(filename: str, text: str) -> str:
+    """Node id of a chunk: stable for as long as the chunk's text is unchanged."""
+    return hashlib.sha256(f"{filename}\0{text}".encode("utf-8")).hexdigest()
+
 
 class CodeVectorIndex:
-    """Manage FAISS-based vector index of code snippets."""
+    """Manage FAISS-based vector index of code snippets.
+
+    Files are split into function/class chunks. ``manifest.json`` lists each
+    file's chunks by line range, pointing at the node that holds their text,
+    keyed by :func:`chunk_id`; identical chunks of one file share a node.
+    Learning a file again embeds only chunks whose text changed and retires
+    the nodes no chunk uses any more. Retired nodes are deleted from the index
+    when the vector store supports it; otherwise they are kept as tombstones,
+    filtered out of results, and the index is rebuilt from the live nodes once
+    tombstones outnumber ``compact_ratio`` of them. :meth:`query_chunks` folds
+    chunk hits back into ranked files with the matching line ranges.
 
-    def __init__(self, persist_dir: str = "index_data", model_name: str = "Salesforce/codet5p-110m") -> None:
+    New chunks are buffered and embedded ``batch_size`` at a time, at the
+    latest ``flush_interval`` seconds after the first one arrived. The index
+    is written to disk once ``persist_every`` chunks are unsaved or
+    ``persist_interval`` seconds have passed, and again at shutdown, instead
+    of after every file.
+
+    Queries go straight to a retriever (no response synthesis) with the
+    query embedding taken from an LRU cache of ``query_cache_size`` entries.
+    """
+
+    def __init__(
+        self,
+        persist_dir: str = "index_data",
+        model_name: str = "Salesforce/codet5p-110m",
+        batch_size: int = 64,
+        flush_interval: float = 5.0,
+        persist_every: int = 1000,
+        persist_interval: float = 60.0,
+        query_cache_size: int = 256,
+        compact_ratio: float = 0.25,
+    ) -> None:
         self.persist_dir = Path(persist_dir)
         self.persist_dir.mkdir(parents=True, exist_ok=True)
-        self.embed_model = HuggingFaceEmbedding(model_name=model_name)
+        self.embed_model = HuggingFaceEmbedding(model_name=model_name, embed_batch_size=batch_size)
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.persist_every = persist_every
+        self.persist_interval = persist_interval
+        self.compact_ratio = compact_ratio
+        self._pending: List[Document] = []
+        self._pending_since = 0.0
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+        self._lock = threading.RLock()
+        self._compacting = threading.Lock()
+        self._wake = threading.Event()
+        self._flusher: threading.Thread | None = None
+        self.query_cache_size = query_cache_size
+        self._query_cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self.query_cache_hits = 0
+        self.query_cache_misses = 0
+        self._retrievers: Dict[int, Any] = {}
+        # file -> [{"start": first line, "end": last line, "id": chunk id}, ...]
+        self.manifest: Dict[str, List[Dict[str, Any]]] = {}
+        self.tombstones: Set[str] = set()
+        self._manifest_path = self.persist_dir / "manifest.json"
+        if self._manifest_path.is_file():
+            data = json.loads(self._manifest_path.read_text())
+            for filename, chunks in data.get("files", {}).items():
+                if isinstance(chunks, dict):
+                    # Older manifests mapped each chunk id to a single range
+                    chunks = [dict(span, id=node_id) for node_id, span in chunks.items()]
+                self.manifest[filename] = chunks
+            self.tombstones = set(data.get("tombstones", []))
 
         index_file = self.persist_dir / "faiss.index"
         if index_file.exists():
-            self.vector_store = FaissVectorStore.from_persist_dir(persist_dir)
-            storage_context = StorageContext.from_defaults(vector_store=self.vector_store)
+            vector_store = FaissVectorStore.from_persist_dir(persist_dir)
+            storage_context = StorageContext.from_defaults(vector_store=vector_store)
             self.index = VectorStoreIndex.load_from_persist_dir(
                 persist_dir, service_context=ServiceContext.from_defaults(embed_model=self.embed_model), storage_context=storage_context
             )
         else:
-            self.vector_store = FaissVectorStore(dim=self.embed_model.embedding_size)
-            storage_context = StorageContext.from_defaults(vector_store=self.vector_store)
-            self.index = VectorStoreIndex(
-                [], service_context=ServiceContext.from_defaults(embed_model=self.embed_model), storage_context=storage_context
-            )
+            self.index = self._new_index()
             self.index.storage_context.persist(persist_dir)
+        atexit.register(self.close)
+
+    def _new_index(self) -> VectorStoreIndex:
+        vector_store = FaissVectorStore(dim=self.embed_model.embedding_size)
+        storage_context = StorageContext.from_defaults(vector_store=vector_store)
+        return VectorStoreIndex(
+            [], service_context=ServiceContext.from_defaults(embed_model=self.embed_model), storage_context=storage_context
+        )
 
     def add_code(self, filename: str, content: str) -> None:
-        doc = Document(text=content, metadata={"file": filename})
-        self.index.insert(doc)
-        self.index.storage_context.persist(self.persist_dir)
+        self.add_many([(filename, content)])
+
+    def add_many(self, items: Iterable[Tuple[str, str]]) -> int:
+        """Upsert ``(filename, content)`` pairs; return how many chunks need embedding."""
+        added = 0
+        with self._lock:
+            for filename, content in items:
+                added += self._upsert(filename, content)
+            if len(self._pending) >= self.batch_size:
+                self.flush(partial=False)
+        self._start_flusher()
+        return added
+
+    def _upsert(self, filename: str, content: str) -> int:
+        chunks: List[Dict[str, Any]] = []
+        ids: Set[str] = set()
+        new_docs = []
+        old = {c["id"] for c in self.manifest.get(filename, [])}
+        for chunk in split_chunks(filename, content):
+            node_id = chunk_id(filename, chunk.text)
+            chunks.append({"start": chunk.start + 1, "end": chunk.end, "id": node_id})
+            if node_id in ids or node_id in old:
+                ids.add(node_id)
+                continue
+            ids.add(node_id)
+            if node_id in self.tombstones:
+                # Its vector is still in the index; revive it rather than add a second one
+                self.tombstones.discard(node_id)
+                continue
+            doc = Document(text=chunk.text, metadata={"file": filename, "name": chunk.name})
+            doc.id_ = node_id
+            new_docs.append(doc)
+        stale = old - ids
+        if stale:
+            self._retire(stale)
+        changed = chunks != self.manifest.get(filename, [])
+        if chunks:
+            self.manifest[filename] = chunks
+        else:
+            self.manifest.pop(filename, None)
+        if new_docs and not self._pending:
+            self._pending_since = time.monotonic()
+        self._pending.extend(new_docs)
+        if changed and not new_docs:
+            # Nothing to embed, but retired chunks or moved ranges must still be saved
+            self._unsaved += 1
+        return len(new_docs)
+
+    def _retire(self, ids: Set[str]) -> None:
+        """Remove the nodes *ids*, which no chunk refers to any more."""
+        queued = {d.id_ for d in self._pending} & ids
+        if queued:
+            # Never embedded, so there is nothing to delete
+            self._pending = [d for d in self._pending if d.id_ not in queued]
+        indexed = sorted(ids - queued)
+        if not indexed:
+            return
+        try:
+            self.index.delete_nodes(indexed, delete_from_docstore=True)
+        except NotImplementedError:
+            self.tombstones.update(indexed)
+
+    def _compaction_due(self) -> bool:
+        if len(self.tombstones) < self.batch_size:
+            return False
+        live = sum(len({c["id"] for c in chunks}) for chunks in self.manifest.values())
+        return len(self.tombstones) >= self.compact_ratio * live
+
+    def _live_ids(self) -> Set[str]:
+        """Ids of the nodes in the index that some chunk still refers to."""
+        queued = {d.id_ for d in self._pending}
+        return {c["id"] for chunks in self.manifest.values() for c in chunks} - queued
+
+    @staticmethod
+    def _stored_nodes(index: VectorStoreIndex, node_ids: Iterable[str]) -> List[Any]:
+        """Docstore nodes of *node_ids* with the vectors already in *index*.
+
+        The docstore keeps nodes without their embeddings, so each vector is
+        read back from FAISS; nodes that carry one are not embedded again.
+        """
+        rows = {node_id: row for row, node_id in index.index_struct.nodes_dict.items()}
+        faiss_index = index.vector_store.client
+        nodes = []
+        for node_id in node_ids:
+            node = index.docstore.get_node(node_id, raise_error=False)
+            if node is None or node_id not in rows:
+                continue
+            node.embedding = faiss_index.reconstruct(int(rows[node_id])).tolist()
+            nodes.append(node)
+        return nodes
+
+    def compact(self) -> None:
+        """Rebuild the index from the live nodes, dropping the vectors of retired ones.
+
+        Stored vectors are copied, so nothing is embedded again. The new index
+        is filled without holding the lock; nodes added meanwhile are copied
+        over just before it replaces the old one.
+        """
+        if not self._compacting.acquire(blocking=False):
+            return
+        try:
+            with self._lock:
+                live = self._live_ids()
+                dropped = len(self.tombstones)
+                nodes = self._stored_nodes(self.index, sorted(live))
+            rebuilt = self._new_index()
+            for start in range(0, len(nodes), self.batch_size):
+                rebuilt.insert_nodes(nodes[start : start + self.batch_size])
+            with self._lock:
+                added = sorted(self._live_ids() - live)
+                if added:
+                    rebuilt.insert_nodes(self._stored_nodes(self.index, added))
+                # Chunks retired during the rebuild are still in the new index
+                self.tombstones &= live
+                self.index = rebuilt
+                self._retrievers = {}
+                self._unsaved += 1
+                self.flush(persist=True, partial=False)
+            print(f"Compacted code index: {dropped} retired chunks dropped, {len(nodes) + len(added)} kept")
+        finally:
+            self._compacting.release()
+
+    def flush(self, persist: bool = False, partial: bool = True) -> None:
+        """Embed and insert buffered snippets, then persist if the policy (or *persist*) says so.
+
+        With ``partial=False`` a last incomplete batch stays buffered.
+        """
+        with self._lock:
+            while self._pending and (partial or len(self._pending) >= self.batch_size):
+                batch = self._pending[: self.batch_size]
+                self.index.insert_nodes(batch)
+                del self._pending[: len(batch)]
+                self._unsaved += len(batch)
+                self._pending_since = time.monotonic()
+            due = (
+                self._unsaved >= self.persist_every
+                or time.monotonic() - self._saved_at >= self.persist_interval
+            )
+            if self._unsaved and (persist or due):
+                self.index.storage_context.persist(self.persist_dir)
+                self._save_manifest()
+                self._unsaved = 0
+                self._saved_at = time.monotonic()
+
+    def _save_manifest(self) -> None:
+        tmp = self._manifest_path.with_name(self._manifest_path.name + ".tmp")
+        tmp.write_text(json.dumps({"files": self.manifest, "tombstones": sorted(self.tombstones)}))
+        os.replace(tmp, self._manifest_path)
+
+    def _start_flusher(self) -> None:
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+                self._flusher.start()
+
+    def _flush_loop(self) -> None:
+        while not self._wake.wait(min(self.flush_interval, self.persist_interval, 1.0)):
+            with self._lock:
+                if self._pending and time.monotonic() - self._pending_since >= self.flush_interval:
+                    self.flush()
+                elif self._unsaved:
+                    self.flush(partial=False)
+                if self._compaction_due():
+                    self.compact()
+
+    def close(self) -> None:
+        """Embed anything still buffered and write the index to disk."""
+        self._wake.set()
+        self.flush(persist=True)
 
     def query(self, text: str, top_k: int = 3) -> List[str]:
-        query_engine = self.index.as_query_engine(similarity_top_k=top_k)
-        response = query_engine.query(text)
-        return [node.metadata.get("file", "") for node in response.source_nodes]
+        return [match["file"] for match in self.query_chunks(text, top_k)]
+
+    def query_chunks(self, text: str, top_k: int = 3) -> List[Dict[str, Any]]:
+        """Return up to *top_k* files ranked by their best matching chunk.
+
+        Each result holds ``file``, ``score`` and ``lines``, the ``[start, end]``
+        line ranges of the file's matching chunks, best first.
+        """
+        return self.query_many([text], top_k)[0]
+
+    def query_many(self, texts: List[str], top_k: int = 3) -> List[List[Dict[str, Any]]]:
+        """Run :meth:`query_chunks` for every text in *texts*."""
+        # Chunks still waiting for a batch are searchable too
+        self.flush()
+        return [self._rank(self._retrieve(text, top_k), top_k) for text in texts]
+
+    def _query_embedding(self, text: str) -> List[float]:
+        with self._lock:
+            if text in self._query_cache:
+                self._query_cache.move_to_end(text)
+                self.query_cache_hits += 1
+                return self._query_cache[text]
+            self.query_cache_misses += 1
+        embedding = self.embed_model.get_query_embedding(text)
+        with self._lock:
+            self._query_cache[text] = embedding
+            while len(self._query_cache) > self.query_cache_size:
+                self._query_cache.popitem(last=False)
+        return embedding
+
+    def _retrieve(self, text: str, top_k: int) -> List[Any]:
+        # Several hits may belong to one file or be retired, so ask for more
+        fetch = top_k * 5
+        with self._lock:
+            retriever = self._retrievers.get(fetch)
+            if retriever is None:
+                retriever = self._retrievers[fetch] = self.index.as_retriever(similarity_top_k=fetch)
+        return retriever.retrieve(QueryBundle(query_str=text, embedding=self._query_embedding(text)))
+
+    def _rank(self, hits: List[Any], top_k: int) -> List[Dict[str, Any]]:
+        files: Dict[str, Dict[str, Any]] = {}
+        for hit in hits:
+            node_id = hit.node.node_id
+            filename = hit.node.metadata.get("file", "")
+            spans = [
+                [c["start"], c["end"]] for c in self.manifest.get(filename, []) if c["id"] == node_id
+            ]
+            if node_id in self.tombstones or not spans:
+                continue
+            score = hit.score or 0.0
+            match = files.setdefault(filename, {"file": filename, "score": score, "lines": []})
+            match["score"] = max(match["score"], score)
+            match["lines"].extend(spans)
+        ranked = sorted(files.values(), key=lambda m: -m["score"])
+        return ranked[:top_k]
@@ -46,6 +46,7 @@ if 'transformers' not in sys.modules:
 if 'llama_index' not in sys.modules:
     li = types.ModuleType('llama_index')
     li.Document = lambda text, metadata=None: types.SimpleNamespace(text=text, metadata=metadata or {})
+    li.QueryBundle = lambda query_str, embedding=None: types.SimpleNamespace(query_str=query_str, embedding=embedding)
     li.ServiceContext = types.SimpleNamespace(from_defaults=lambda **kw: None)
     li.StorageContext = types.SimpleNamespace(from_defaults=lambda **kw: None)
     class VectorStoreIndex:
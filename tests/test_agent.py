@@ -0,0 +1,208 @@
+import tests.bootstrap
+import threading
+import time
+from unittest.mock import MagicMock
+
+from ai_agent.agent import BugTriageAgent
+from ai_agent.checkpoint import TriageCheckpoint
+from ai_agent import code_index
+from ai_agent.code_index import LocalCodeIndex
+
+
+def make_agent(bugs, **kw):
+    jira = MagicMock()
+    jira.iter_open_bugs.return_value = iter(bugs)
+    return BugTriageAgent(jira, MagicMock(), MagicMock(), **kw)
+
+
+def test_triage_isolates_failures():
+    agent = make_agent([{"key": "B-1"}, {"key": "B-2"}, {"key": "B-3"}])
+
+    def process(bug):
+        if bug["key"] == "B-2":
+            raise RuntimeError("boom")
+        return f"url/{bug['key']}"
+
+    agent.process_bug = process
+    results = agent.triage("PROJ")
+    by_key = {r["key"]: r for r in results}
+    assert by_key["B-1"] == {"key": "B-1", "status": "ok", "review_url": "url/B-1", "seconds": by_key["B-1"]["seconds"]}
+    assert by_key["B-2"]["status"] == "error" and "boom" in by_key["B-2"]["error"]
+    assert by_key["B-3"]["status"] == "ok"
+
+
+def test_triage_concurrent_respects_in_flight_limit():
+    bugs = [{"key": f"B-{i}"} for i in range(8)]
+    agent = make_agent(bugs, max_workers=3)
+    lock = threading.Lock()
+    state = {"running": 0, "peak": 0}
+
+    def process(bug):
+        with lock:
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+        time.sleep(0.02)
+        with lock:
+            state["running"] -= 1
+        return bug["key"]
+
+    agent.process_bug = process
+    results = agent.triage("PROJ")
+    assert sorted(r["key"] for r in results) == sorted(b["key"] for b in bugs)
+    assert all(r["status"] == "ok" for r in results)
+    assert 1 < state["peak"] <= 3
+
+
+def test_rank_keywords_prefers_identifiers():
+    text = "Crash when saving: the save_file helper in FileWriter fails, save_file raises when writing"
+    words = BugTriageAgent.rank_keywords(text, limit=4)
+    assert words[:2] == ["save_file", "filewriter"]
+    assert "when" not in words and "fails" not in words
+    assert len(words) == 4
+
+
+def test_local_code_index_incremental(tmp_path):
+    repo = tmp_path / "repo"
+    (repo / "pkg").mkdir(parents=True)
+    (repo / "pkg" / "writer.py").write_text("class FileWriter:\n    def save_file(self): pass\n")
+    (repo / "pkg" / "reader.py").write_text("def load_file(path):\n    return open(path).read()\n")
+    (repo / "README.md").write_text("Docs about the writer and the reader")
+    index = LocalCodeIndex(repo, index_path=tmp_path / "index.json")
+    assert index.refresh() == 3
+    assert index.search(["save_file"])[0] == "pkg/writer.py"
+    assert set(index.search(["filewriter", "load_file"])) == {"pkg/reader.py", "pkg/writer.py"}
+    assert index.refresh() == 0
+
+    (repo / "pkg" / "reader.py").write_text("def parse_config(path):\n    pass\n")
+    (repo / "README.md").unlink()
+    assert index.refresh() == 2
+    assert "pkg/reader.py" not in index.search(["load_file"])
+    assert index.search(["parse_config"]) == ["pkg/reader.py"]
+
+    reloaded = LocalCodeIndex(repo, index_path=tmp_path / "index.json")
+    assert reloaded.refresh() == 0
+    assert reloaded.search(["parse_config"]) == ["pkg/reader.py"]
+
+
+def test_local_code_index_syncs_once_concurrently(tmp_path):
+    index = LocalCodeIndex(tmp_path, refresh_interval=60)
+    index.repo = "org/repo"
+    started, release = threading.Event(), threading.Event()
+    syncs = []
+
+    def sync_checkout(repo, token, branch):
+        syncs.append(repo)
+        started.set()
+        release.wait(5)
+
+    index.sync_checkout = sync_checkout
+    first = threading.Thread(target=index.update)
+    first.start()
+    assert started.wait(5)
+    index.update()  # returns at once instead of fetching again
+    release.set()
+    first.join(5)
+    index.update()
+    assert syncs == ["org/repo"]
+
+
+def test_local_code_index_keeps_token_off_command_line(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        code_index.subprocess, "run", lambda cmd, env=None, **kw: calls.append((cmd, env))
+    )
+    monkeypatch.delenv("GIT_CONFIG_COUNT", raising=False)
+    index = LocalCodeIndex(tmp_path / "checkout")
+    index.sync_checkout("org/repo", "secret-token")
+    cmd, env = calls[0]
+    assert cmd[:2] == ["git", "clone"] and not any("Authorization" in arg for arg in cmd)
+    assert env["GIT_CONFIG_COUNT"] == "1" and env["GIT_CONFIG_KEY_0"] == "http.extraHeader"
+    assert env["GIT_CONFIG_VALUE_0"].startswith("Authorization: Basic ")
+
+
+def test_find_related_files_uses_local_index():
+    index = MagicMock()
+    index.search.return_value = ["pkg/writer.py"]
+    agent = make_agent([], code_index=index)
+    assert agent.find_related_files("save_file crashes", "") == ["pkg/writer.py"]
+    index.update.assert_called_once()
+    agent.github.search_code.assert_not_called()
+
+
+def test_triage_checkpoint_skips_unchanged(tmp_path):
+    path = tmp_path / "checkpoint.json"
+    bugs = [
+        {"key": "B-1", "fields": {"updated": "t1"}},
+        {"key": "B-2", "fields": {"updated": "t1"}},
+    ]
+    agent = make_agent(bugs, checkpoint=TriageCheckpoint(path))
+    agent.github.create_pull_request.return_value = {"html_url": "pr"}
+    agent.analyzer.analyze_bug.return_value = {}
+    agent.find_related_files = lambda title, description: []
+    processed = []
+    original = agent.process_bug
+
+    def process(bug):
+        processed.append(bug["key"])
+        if bug["key"] == "B-2":
+            raise RuntimeError("boom")
+        return original(bug)
+
+    agent.process_bug = process
+    agent.triage("PROJ")
+    assert agent.jira.iter_open_bugs.call_args.kwargs["updated_since"] is None
+
+    checkpoint = TriageCheckpoint(path)
+    assert checkpoint.issues["B-1"] == {"updated": "t1", "branch": "bugfix-b-1", "review_url": "pr"}
+    assert checkpoint.failed == ["B-2"] and checkpoint.last_run is not None
+
+    processed.clear()
+    agent.checkpoint = checkpoint
+    agent.jira.iter_open_bugs.return_value = iter(bugs + [{"key": "B-3", "fields": {"updated": "t2"}}])
+    agent.triage("PROJ")
+    kwargs = agent.jira.iter_open_bugs.call_args.kwargs
+    assert kwargs["updated_since"].startswith("-") and kwargs["include_keys"] == ["B-2"]
+    assert processed == ["B-2", "B-3"]
+
+
+def test_review_is_recorded_before_later_failures(tmp_path):
+    checkpoint = TriageCheckpoint(tmp_path / "checkpoint.json")
+    bug = {"key": "B-1", "fields": {"updated": "t1"}}
+    agent = make_agent([bug], checkpoint=checkpoint)
+    agent.github.create_pull_request.return_value = {"html_url": "pr"}
+    agent.analyzer.analyze_bug.return_value = {"a.py": "fix"}
+    agent.analyzer.remember.side_effect = OSError("disk full")
+    agent.find_related_files = lambda title, description: []
+    assert agent.triage("PROJ")[0]["status"] == "error"
+    assert checkpoint.review_url("B-1") == "pr" and checkpoint.failed == []
+
+    # A later update of the bug reuses the open pull request
+    agent.analyzer.remember.side_effect = None
+    assert agent.process_bug({"key": "B-1", "fields": {"updated": "t2"}}) == "pr"
+    agent.github.create_pull_request.assert_called_once()
+    assert agent.github.commit_files.call_count == 2
+
+
+def test_checkpoint_forgets_failures_jira_no_longer_returns(tmp_path):
+    path = tmp_path / "checkpoint.json"
+    checkpoint = TriageCheckpoint(path)
+    checkpoint.record_failure("B-1")
+    checkpoint.record_failure("B-2")
+    checkpoint.finish_run(time.time())
+    # B-1 was closed, so the retry query no longer returns it
+    agent = make_agent([{"key": "B-2", "fields": {"updated": "t1"}}], checkpoint=checkpoint)
+    agent.process_bug = MagicMock(side_effect=RuntimeError("boom"))
+    agent.triage("PROJ")
+    assert agent.jira.iter_open_bugs.call_args.kwargs["include_keys"] == ["B-1", "B-2"]
+    assert TriageCheckpoint(path).failed == ["B-2"]
+
+
+def test_checkpoint_merges_writes_from_other_processes(tmp_path):
+    path = tmp_path / "checkpoint.json"
+    cli, webhook = TriageCheckpoint(path), TriageCheckpoint(path)
+    webhook.record("B-1", "t1", "bugfix-b-1", "pr-1")
+    cli.record("B-2", "t1", "bugfix-b-2", "pr-2")
+    cli.finish_run(1.0)
+    assert cli.review_url("B-1") == "pr-1"
+    merged = TriageCheckpoint(path)
+    assert set(merged.issues) == {"B-1", "B-2"} and merged.last_run == 1.0
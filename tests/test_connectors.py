@@ -1,17 +1,24 @@
 import tests.bootstrap
 import base64
+import json
+import threading
+import time
+import types
 from unittest.mock import MagicMock
 import requests
 import pytest
 
 from ai_agent.connectors.github import GitHubConnector
 from ai_agent.connectors.jira import JiraConnector
+from ai_agent.connectors import http, jira_ws
+from ai_agent.connectors.jira_ws import JiraWebSocketClient
 
 class FakeResponse:
-    def __init__(self, status_code=200, json_data=None, text=""):
+    def __init__(self, status_code=200, json_data=None, text="", headers=None):
         self.status_code = status_code
         self._json = json_data or {}
         self.text = text
+        self.headers = headers or {}
     def json(self):
         return self._json
     def raise_for_status(self):
@@ -19,19 +26,19 @@ class FakeResponse:
             raise requests.HTTPError("error", response=self)
 
 def test_jira_get_open_bugs_success(monkeypatch):
-    def fake_get(url, params=None, auth=None):
+    def fake_get(url, params=None):
         assert params["jql"].startswith("project=PROJ")
         return FakeResponse(200, json_data={"issues": [{"id": 1}]})
-    monkeypatch.setattr(requests, "get", fake_get)
     jira = JiraConnector("http://jira", "u", "t")
+    monkeypatch.setattr(jira.session, "get", fake_get)
     issues = jira.get_open_bugs("proj")
     assert issues == [{"id": 1}]
 
 def test_jira_get_open_bugs_failure(monkeypatch):
-    def fake_get(url, params=None, auth=None):
+    def fake_get(url, params=None):
         return FakeResponse(500, text="bad")
-    monkeypatch.setattr(requests, "get", fake_get)
     jira = JiraConnector("http://jira", "u", "t")
+    monkeypatch.setattr(jira.session, "get", fake_get)
     with pytest.raises(requests.HTTPError):
         jira.get_open_bugs("proj")
 
@@ -44,17 +51,17 @@ def test_ensure_branch_creates(monkeypatch):
     def fake_post(url, json=None, headers=None):
         called["payload"] = json
         return FakeResponse(201)
-    monkeypatch.setattr(requests, "get", fake_get)
-    monkeypatch.setattr(requests, "post", fake_post)
     gh = GitHubConnector("repo", "tok")
+    monkeypatch.setattr(gh.session, "get", fake_get)
+    monkeypatch.setattr(gh.session, "post", fake_post)
     gh.ensure_branch("new")
     assert called["payload"]["sha"] == "base"
 
 def test_ensure_branch_exists(monkeypatch):
     def fake_get(url, headers=None):
         return FakeResponse(200)
-    monkeypatch.setattr(requests, "get", fake_get)
     gh = GitHubConnector("repo", "tok")
+    monkeypatch.setattr(gh.session, "get", fake_get)
     gh.ensure_branch("main")
 
 def test_commit_files_create(monkeypatch):
@@ -64,9 +71,9 @@ def test_commit_files_create(monkeypatch):
     def fake_put(url, json=None, headers=None):
         saved.update(json)
         return FakeResponse(200)
-    monkeypatch.setattr(requests, "get", fake_get)
-    monkeypatch.setattr(requests, "put", fake_put)
     gh = GitHubConnector("repo", "tok")
+    monkeypatch.setattr(gh.session, "get", fake_get)
+    monkeypatch.setattr(gh.session, "put", fake_put)
     gh.commit_files("br", {"a.txt": "hello"}, "msg")
     assert base64.b64decode(saved["content"]).decode() == "hello"
     assert saved["branch"] == "br"
@@ -78,17 +85,17 @@ def test_commit_files_update(monkeypatch):
     def fake_put(url, json=None, headers=None):
         saved.update(json)
         return FakeResponse(200)
-    monkeypatch.setattr(requests, "get", fake_get)
-    monkeypatch.setattr(requests, "put", fake_put)
     gh = GitHubConnector("repo", "tok")
+    monkeypatch.setattr(gh.session, "get", fake_get)
+    monkeypatch.setattr(gh.session, "put", fake_put)
     gh.commit_files("br", {"a.txt": "hello"}, "msg")
     assert saved["sha"] == "123"
 
 def test_create_pull_request(monkeypatch):
     def fake_post(url, json=None, headers=None):
         return FakeResponse(201, json_data={"html_url": "url"})
-    monkeypatch.setattr(requests, "post", fake_post)
     gh = GitHubConnector("repo", "tok")
+    monkeypatch.setattr(gh.session, "post", fake_post)
     res = gh.create_pull_request("t", "h", "b", "d")
     assert res["html_url"] == "url"
 
@@ -99,7 +106,226 @@ def test_search_code(monkeypatch):
         if "second" in params["q"]:
             return FakeResponse(200, json_data={"items": [{"path": "a"}, {"path": "c"}]})
         return FakeResponse(500)
-    monkeypatch.setattr(requests, "get", fake_get)
     gh = GitHubConnector("repo", "tok")
+    monkeypatch.setattr(gh.session, "get", fake_get)
     files = gh.search_code(["first", "second"])
     assert files == ["a", "b", "c"]
+
+def test_search_code_ranks_by_hits_and_caches(monkeypatch):
+    calls = []
+    results = {"one": ["x", "y"], "two": ["y", "z"], "three": ["z", "y"]}
+    def fake_get(url, params=None, headers=None):
+        word = params["q"].split()[0]
+        calls.append(word)
+        return FakeResponse(200, json_data={"items": [{"path": p} for p in results[word]]})
+    gh = GitHubConnector("repo", "tok")
+    monkeypatch.setattr(gh.session, "get", fake_get)
+    assert gh.search_code(["one", "two", "three"]) == ["y", "z", "x"]
+    assert gh.search_code(["two", "one"]) == ["y", "z", "x"]
+    assert sorted(calls) == ["one", "three", "two"]
+
+def test_search_cache_is_bounded(monkeypatch):
+    from ai_agent.connectors import github
+
+    now = [0.0]
+    monkeypatch.setattr(github.time, "monotonic", lambda: now[0])
+    gh = GitHubConnector("repo", "tok", search_ttl=10, search_cache_size=2)
+    monkeypatch.setattr(
+        gh.session, "get", lambda url, params=None: FakeResponse(200, json_data={"items": []})
+    )
+    for word in ["one", "two", "one", "three"]:
+        gh.search_code([word])
+    # "two" was least recently used
+    assert [k.split("\0")[0] for k in gh._search_cache] == ["one", "three"]
+    now[0] = 20.0
+    gh.search_code(["four"])
+    # Expired entries are dropped when a new one is stored
+    assert [k.split("\0")[0] for k in gh._search_cache] == ["four"]
+
+def test_commit_files_tree_mode(monkeypatch):
+    calls = []
+    def fake_get(url, params=None, headers=None):
+        calls.append(("GET", url))
+        if url.endswith("/git/ref/heads/br"):
+            return FakeResponse(200, json_data={"object": {"sha": "parent"}})
+        if url.endswith("/git/trees/basetree"):
+            assert params == {"recursive": "1"}
+            return FakeResponse(200, json_data={"tree": [
+                {"path": "run.sh", "mode": "100755", "type": "blob"},
+                {"path": "a.txt", "mode": "100644", "type": "blob"},
+                {"path": "b", "mode": "040000", "type": "tree"},
+            ]})
+        return FakeResponse(200, json_data={"tree": {"sha": "basetree"}})
+    def fake_post(url, json=None, headers=None):
+        calls.append(("POST", url, json))
+        if url.endswith("/git/trees"):
+            return FakeResponse(201, json_data={"sha": "newtree"})
+        return FakeResponse(201, json_data={"sha": "newcommit"})
+    def fake_patch(url, json=None, headers=None):
+        calls.append(("PATCH", url, json))
+        return FakeResponse(200)
+    gh = GitHubConnector("repo", "tok", commit_mode="tree")
+    monkeypatch.setattr(gh.session, "get", fake_get)
+    monkeypatch.setattr(gh.session, "post", fake_post)
+    monkeypatch.setattr(gh.session, "patch", fake_patch)
+    gh.commit_files("br", {"a.txt": "hello", "b/c.py": "x", "run.sh": "#!/bin/sh"}, "msg")
+    assert len(calls) == 6
+    tree = calls[3][2]
+    assert tree["base_tree"] == "basetree"
+    # The script keeps its executable bit; the new file is a regular one
+    assert [(e["path"], e["mode"]) for e in tree["tree"]] == [
+        ("a.txt", "100644"), ("b/c.py", "100644"), ("run.sh", "100755")
+    ]
+    assert calls[4][2] == {"message": "msg", "tree": "newtree", "parents": ["parent"]}
+    assert calls[5] == ("PATCH", "https://api.github.com/repos/repo/git/refs/heads/br", {"sha": "newcommit"})
+
+def _scripted_session(monkeypatch, responses):
+    sent, slept = [], []
+    def fake_request(self, method, url, *args, **kwargs):
+        sent.append((method, kwargs.get("timeout")))
+        result = responses.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+    clock = [1000.0]
+    def fake_sleep(seconds):
+        slept.append(seconds)
+        clock[0] += seconds
+    fake_time = types.SimpleNamespace(
+        time=lambda: clock[0], monotonic=lambda: clock[0], sleep=fake_sleep
+    )
+    monkeypatch.setattr(requests.Session, "request", fake_request)
+    monkeypatch.setattr(http, "time", fake_time)
+    return http.ApiSession(timeout=5, max_retries=2, backoff=0.1), sent, slept
+
+def test_api_session_retries_with_retry_after(monkeypatch):
+    session, sent, slept = _scripted_session(monkeypatch, [
+        requests.ConnectionError("reset"),
+        FakeResponse(429, headers={"Retry-After": "2"}),
+        FakeResponse(200),
+    ])
+    resp = session.get("https://api.github.com/repos/r/pulls")
+    assert resp.status_code == 200
+    assert sent == [("GET", 5), ("GET", 5), ("GET", 5)]
+    assert 0 <= slept[0] <= 0.1 and slept[1] == 2.0
+    assert len(slept) == 2
+
+def test_api_session_does_not_repeat_failed_post(monkeypatch):
+    session, sent, _ = _scripted_session(monkeypatch, [FakeResponse(502), FakeResponse(201)])
+    assert session.post("https://api.github.com/repos/r/pulls").status_code == 502
+    assert len(sent) == 1
+
+def test_api_session_paces_low_quota(monkeypatch):
+    reset = "1100"
+    session, _, _ = _scripted_session(monkeypatch, [
+        FakeResponse(200, headers={"X-RateLimit-Remaining": "5", "X-RateLimit-Limit": "30", "X-RateLimit-Reset": reset}),
+    ])
+    session.get("https://api.github.com/search/code")
+    assert session.bucket("search").rate < 1.0
+    assert session.bucket("core").rate == session.rate
+
+def test_jira_iter_open_bugs_pages(monkeypatch):
+    pages = {0: [{"key": "A-1"}, {"key": "A-2"}], 2: [{"key": "A-3"}]}
+    requested = []
+    def fake_get(url, params=None):
+        requested.append(params["startAt"])
+        assert params["maxResults"] == 2 and "summary" in params["fields"]
+        return FakeResponse(200, json_data={"startAt": params["startAt"], "total": 3, "issues": pages[params["startAt"]]})
+    jira = JiraConnector("http://jira", "u", "t")
+    monkeypatch.setattr(jira.session, "get", fake_get)
+    for prefetch in (True, False):
+        requested.clear()
+        bugs = jira.iter_open_bugs("proj", page_size=2, prefetch=prefetch)
+        assert [b["key"] for b in bugs] == ["A-1", "A-2", "A-3"]
+        assert requested == [0, 2]
+
+
+def test_ws_client_queues_dedupes_and_drops():
+    client = JiraWebSocketClient("ws://x", workers=1, max_pending=1, enqueue_timeout=0.01)
+    release = threading.Event()
+    started = threading.Event()
+    handled = []
+
+    def on_bug(issue):
+        started.set()
+        release.wait(5)
+        handled.append(issue["key"])
+
+    client.start_workers(on_bug)
+    client._on_message(None, json.dumps({"issue": {"key": "B-1"}}))
+    assert started.wait(5)
+    client._on_message(None, json.dumps({"issue": {"key": "B-1"}}))
+    client._on_message(None, json.dumps({"issue": {"key": "B-2"}}))
+    client._on_message(None, json.dumps({"issue": {"key": "B-3"}}))
+    client._on_message(None, "not json")
+    stats = client.stats()
+    assert stats["processing"] == 1 and stats["queued"] == 1
+    assert stats["duplicates"] == 1 and stats["dropped"] == 1
+    release.set()
+    client.stop(timeout=5)
+    assert handled == ["B-1", "B-2"]
+    stats = client.stats()
+    assert stats["received"] == 4 and stats["processed"] == 2 and stats["queued"] == 0
+    # B-3 was dropped, so a later delivery is accepted
+    assert client._claim("B-3") and not client._claim("B-1")
+
+
+def test_ws_client_reconnects_and_resumes(monkeypatch):
+    client = JiraWebSocketClient("ws://x", reconnect_delay=0.001)
+    resumed = []
+    apps = []
+
+    def fetch(lost_at):
+        resumed.append(lost_at)
+        return []
+
+    class FakeApp:
+        def __init__(self, url, on_message, on_open, on_error):
+            self.on_open = on_open
+            apps.append(self)
+
+        def run_forever(self, **kwargs):
+            self.on_open(self)
+            if len(apps) == 3:
+                client._stopping.set()
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(jira_ws, "WebSocketApp", FakeApp)
+    client.listen(lambda issue: None, on_resume=fetch)
+    client.stop(timeout=5)
+    assert len(apps) == 3
+    assert client.stats()["reconnects"] == 2
+    deadline = time.time() + 5
+    while len(resumed) < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    assert len(resumed) == 2
+
+
+def test_ws_client_resume_is_single_flight_and_deduped():
+    client = JiraWebSocketClient("ws://x", workers=1)
+    handled = []
+    client.start_workers(lambda issue: handled.append(issue["key"]))
+    client._on_message(None, json.dumps({"issue": {"key": "B-1"}}))
+    release = threading.Event()
+    calls = []
+
+    def fetch(lost_at):
+        calls.append(lost_at)
+        if len(calls) == 1:
+            release.wait(5)
+        return iter([{"key": "B-1"}, {"key": "B-2"}])
+
+    client.resume(fetch, 10.0)
+    client.resume(fetch, 30.0)
+    client.resume(fetch, 20.0)
+    release.set()
+    deadline = time.time() + 5
+    while client.stats()["resumed"] < 4 and time.time() < deadline:
+        time.sleep(0.01)
+    client.stop(timeout=5)
+    # Overlapping resumes were folded into one follow-up from the earliest loss
+    assert calls == [10.0, 20.0]
+    assert sorted(handled) == ["B-1", "B-2"]
+    assert client.stats()["duplicates"] == 3
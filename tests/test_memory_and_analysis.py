@@ -1,24 +1,264 @@
 import tests.bootstrap
+import json
+import sys
+import types
 from pathlib import Path
+import numpy as np
+import pytest
+from ai_agent.ann_index import AnnIndex
+from ai_agent.embedding_cache import EmbeddingCache
 from ai_agent.memory import SimpleMemory
+from ai_agent import analysis, ann_index, models
 from ai_agent.analysis import CodeAnalyzer
+from ai_agent.context import build_context, split_chunks
+from ai_agent.result_cache import ResultCache
 
 class DummyMemory(SimpleMemory):
-    def __init__(self):
-        self.entries = []
-        self.path = Path('noop')
     def _embed(self, text: str):
         return [float(len(text))]
-    def save(self):
-        pass
 
-def test_memory_search():
-    mem = DummyMemory()
+def test_memory_search(tmp_path):
+    mem = DummyMemory(path=tmp_path / 'memory.json')
     mem.add('bug one', {'f': 'fix1'})
     mem.add('another', {'f': 'fix2'})
     res = mem.search('bug one')
     assert res and res[0]['solution'] == {'f': 'fix1'}
 
+def test_memory_search_matches_full_sort(tmp_path):
+    mem = DummyMemory(path=tmp_path / 'memory.json')
+    vectors = {'a': [1.0, 0.0], 'b': [0.6, 0.8], 'c': [2.0, 0.0], 'd': [0.0, 1.0], 'q': [1.0, 0.1]}
+    mem._embed = lambda text: vectors[text]
+    for text in 'abcd':
+        mem.add(text, {'f': text})
+    res = mem.search('q', top_k=3)
+    # 'a' and 'c' point the same way; ties keep insertion order
+    assert [e['text'] for e in res] == ['a', 'c', 'b']
+    assert mem.vectors.dtype == np.float32
+    assert np.allclose(np.linalg.norm(mem.vectors, axis=1), 1.0)
+
+def test_memory_append_only_persistence(tmp_path):
+    path = tmp_path / 'memory.json'
+    mem = DummyMemory(path=path)
+    mem.add('bug one', {'f': 'fix1'})
+    mem.add('another', {'f': 'fix2'})
+    assert not path.exists()
+    assert len(mem.log_path.read_text().splitlines()) == 2
+    assert np.load(mem.vectors_path).shape == (2, 1)
+    reloaded = DummyMemory(path=path)
+    assert isinstance(reloaded.vectors, np.memmap)
+    assert [e['text'] for e in reloaded.entries] == ['bug one', 'another']
+
+def test_memory_reembeds_missing_vectors(tmp_path):
+    path = tmp_path / 'memory.json'
+    mem = DummyMemory(path=path)
+    mem.add('bug one', {'f': 'fix1'})
+    mem.add('another', {'f': 'fix2'})
+    mem.vectors_path.unlink()
+    reloaded = DummyMemory(path=path)
+    assert [e['text'] for e in reloaded.entries] == ['bug one', 'another']
+    assert len(reloaded.log_path.read_text().splitlines()) == 2
+    assert np.load(reloaded.vectors_path).shape == (2, 1)
+    assert reloaded.search('bug one')[0]['solution'] == {'f': 'fix1'}
+
+def test_memory_repairs_interrupted_add(tmp_path):
+    mem = DummyMemory(path=tmp_path / 'memory.json')
+    mem.add('bug one', {'f': 'fix1'})
+    with mem.vectors_path.open('ab') as fh:
+        fh.write(np.float32(1.0).tobytes())  # vector written, metadata lost
+    reloaded = DummyMemory(path=tmp_path / 'memory.json')
+    assert len(reloaded.entries) == 1
+    reloaded.add('another', {'f': 'fix2'})
+    assert np.load(reloaded.vectors_path).shape == (2, 1)
+
+def test_memory_migrates_legacy_json(tmp_path):
+    path = tmp_path / 'memory.json'
+    path.write_text(json.dumps([
+        {'text': 'old bug', 'solution': {'f': 'old'}, 'embedding': [3.0, 4.0]},
+    ]))
+    mem = DummyMemory(path=path)
+    assert mem.entries == [{'text': 'old bug', 'solution': {'f': 'old'}}]
+    assert np.allclose(mem.vectors, [[0.6, 0.8]])
+    assert not path.exists() and path.with_name('memory.json.bak').exists()
+
+def test_memory_index_defaults_to_exact(tmp_path, monkeypatch):
+    monkeypatch.delenv('MEMORY_INDEX', raising=False)
+    assert AnnIndex.from_env(tmp_path / 'memory.faiss') is None
+    with pytest.raises(ValueError):
+        AnnIndex.from_env(tmp_path / 'memory.faiss', 'lsh')
+
+@pytest.fixture
+def real_faiss(monkeypatch):
+    """The installed faiss package in place of the bootstrap stub."""
+    stub = sys.modules.pop('faiss', None)
+    try:
+        faiss = pytest.importorskip('faiss')
+    finally:
+        if stub is not None:
+            sys.modules['faiss'] = stub
+    monkeypatch.setattr(ann_index, 'faiss', faiss)
+    return faiss
+
+def unit_vectors(count, dim=16, seed=0):
+    vectors = np.random.default_rng(seed).standard_normal((count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def test_ann_hnsw_recall_matches_exact_search(tmp_path, real_faiss):
+    vectors = unit_vectors(500)
+    index = AnnIndex('hnsw', tmp_path / 'memory.faiss', hnsw_m=16, ef_search=64)
+    index.sync(vectors)
+    assert index.ready and index.ntotal == 500
+    found = 0
+    for query in unit_vectors(20, seed=1):
+        exact = set(np.argsort(-(vectors @ query))[:10])
+        found += len(exact & set(index.search(query, 10)))
+    assert found / 200 >= 0.9
+
+def test_ann_sync_catches_up_with_new_vectors(tmp_path, real_faiss):
+    path = tmp_path / 'memory.faiss'
+    vectors = unit_vectors(150)
+    index = AnnIndex('hnsw', path, save_every=1000)
+    index.sync(vectors[:100])
+    index.save()
+    index.add(vectors[100:], vectors)  # added but not saved
+    reopened = AnnIndex('hnsw', path)
+    reopened.sync(vectors)
+    assert reopened.ntotal == 150
+    assert reopened.search(vectors[140], 1)[0] == 140
+    # An index of another dimension is rebuilt from the vectors
+    other = unit_vectors(150, dim=8)
+    reopened.sync(other)
+    assert reopened.ntotal == 150 and reopened.index.d == 8
+
+def test_ann_ivf_falls_back_to_exact_until_trained(tmp_path, real_faiss):
+    index = AnnIndex('ivf', tmp_path / 'memory.faiss', nlist=4, nprobe=4)
+    vectors = unit_vectors(index.train_size + 20)
+    index.sync(vectors[:100])
+    assert not index.ready and index.ntotal == 0
+    mem = DummyMemory(path=tmp_path / 'memory.json', index='ivf')
+    mem.add('bug one', {'f': 'fix1'})
+    assert not mem.ann.ready
+    assert mem.search('bug one')[0]['solution'] == {'f': 'fix1'}
+    index.add(vectors[100:], vectors)
+    assert index.ready and index.ntotal == len(vectors)
+    assert index.search(vectors[3], 1)[0] == 3
+
+
+def test_memory_embeds_each_text_once(tmp_path):
+    mem = DummyMemory(path=tmp_path / 'memory.json')
+    calls = []
+    mem._embed = lambda text: calls.append(text) or [float(len(text))]
+    mem.add('another', {'f': 'fix2'})
+    mem.search('bug one')
+    mem.add('bug one', {'f': 'fix1'})
+    mem.add('bug one', {'f': 'fix1'})
+    assert calls == ['another', 'bug one']
+    assert mem.cache_info()['hits'] == 2 and mem.cache_info()['misses'] == 2
+
+def test_embedding_cache_evicts_and_persists(tmp_path):
+    path = tmp_path / 'cache.npz'
+    cache = EmbeddingCache('m', maxsize=2, path=path)
+    for text in ('a', 'b'):
+        cache.put(text, np.array([1.0], dtype=np.float32))
+    cache.get('a')
+    cache.put('c', np.array([2.0], dtype=np.float32))
+    assert cache.get('b') is None and cache.get('a') is not None
+    cache.save()
+    assert EmbeddingCache('m', maxsize=2, path=path).get('c')[0] == 2.0
+    assert EmbeddingCache('other', maxsize=2, path=path).get('c') is None
+
+def test_memory_add_many_batches_and_appends(tmp_path):
+    mem = DummyMemory(path=tmp_path / 'memory.json')
+    batches = []
+    def embed_batch(texts):
+        batches.append(list(texts))
+        return np.array([[float(len(t)), 1.0] for t in texts])
+    mem._embed_batch = embed_batch
+    mem.embedding_cache.put('eeeee', np.array([1.0, 0.0], dtype=np.float32))
+    items = [('ccc', {}), ('a', {}), ('eeeee', {}), ('bb', {}), ('a', {}), ('dddd', {})]
+    assert mem.add_many(items, batch_size=2) == 6
+    assert batches == [['a', 'bb'], ['ccc', 'dddd']]
+    assert len(mem.log_path.read_text().splitlines()) == 6
+    reloaded = DummyMemory(path=tmp_path / 'memory.json')
+    assert [e['text'] for e in reloaded.entries] == ['ccc', 'a', 'eeeee', 'bb', 'a', 'dddd']
+    assert reloaded.vectors.shape == (6, 2)
+    # Computed embeddings are cached like single ones
+    assert np.allclose(mem.embedding_cache.get('bb'), mem.vectors[3])
+
+class ArrayTensor:
+    """The few tensor operations masked mean pooling needs, over NumPy."""
+
+    def __init__(self, data):
+        self.data = np.asarray(data, dtype=np.float32)
+        self.dtype = self.data.dtype
+
+    def unsqueeze(self, dim):
+        return ArrayTensor(np.expand_dims(self.data, dim))
+
+    def to(self, dtype):
+        return self
+
+    def sum(self, dim):
+        return ArrayTensor(self.data.sum(axis=dim))
+
+    def clamp(self, min):
+        return ArrayTensor(np.maximum(self.data, min))
+
+    def __mul__(self, other):
+        return ArrayTensor(self.data * other.data)
+
+    def __truediv__(self, other):
+        return ArrayTensor(self.data / other.data)
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.data
+
+def test_memory_embed_batch_pads_without_touching_tokenizer(tmp_path, monkeypatch):
+    from ai_agent import memory
+
+    monkeypatch.setattr(memory, 'torch', types.SimpleNamespace(tensor=ArrayTensor))
+    class Tokenizer:
+        pad_token = pad_token_id = None
+        eos_token_id = 9
+
+        def __call__(self, texts, truncation):
+            return {'input_ids': [[len(t)] * len(t) for t in texts]}
+
+    mem = SimpleMemory(path=tmp_path / 'memory.json')
+    mem._tokenizer = Tokenizer()
+    seen = []
+
+    def model(input_ids, attention_mask):
+        seen.append(input_ids.data.tolist())
+        return types.SimpleNamespace(last_hidden_state=ArrayTensor(input_ids.data[..., None]))
+
+    mem._model = model
+    vectors = mem._embed_batch(['abc', 'a'])
+    assert seen == [[[3, 3, 3], [1, 9, 9]]]
+    # The padding does not count towards the shorter text's mean
+    assert vectors.tolist() == [[3.0], [1.0]]
+    assert mem.tokenizer.pad_token is None
+
+def test_import_memory_cli(tmp_path, monkeypatch):
+    from ai_agent import __main__ as cli
+    tickets = tmp_path / 'tickets.jsonl'
+    tickets.write_text(
+        json.dumps({'title': 't', 'description': 'd', 'fix': {'f': 'x'}}) + '\n'
+        + json.dumps({'text': 'raw', 'solution': {'g': 'y'}}) + '\n'
+    )
+    monkeypatch.setenv('MEMORY_FILE', str(tmp_path / 'memory.json'))
+    monkeypatch.setattr(
+        SimpleMemory, '_embed_batch', lambda self, texts: np.ones((len(texts), 2))
+    )
+    cli.main(['import-memory', str(tickets)])
+    mem = SimpleMemory(path=tmp_path / 'memory.json')
+    assert mem.entries == [
+        {'text': 'Bug Title: t\nDescription: d', 'solution': {'f': 'x'}},
+        {'text': 'raw', 'solution': {'g': 'y'}},
+    ]
+
 class DummyTokenizer:
     def encode(self, text, return_tensors=None, **kw):
         return [0]
@@ -32,8 +272,8 @@ class DummyModel:
 class MemoryStub:
     def __init__(self):
         self.called = False
-    def search(self, text, top_k=1):
-        return [{'solution': {'file': 'stored patch'}}]
+    def search_scored(self, text, top_k=1):
+        return [({'text': text, 'solution': {'file': 'stored patch'}}, 1.0)]
     def add(self, text, fix):
         self.called = True
 
@@ -56,3 +296,235 @@ def test_analyze_bug_uses_memory():
     fix = analyzer.analyze_bug('t', 'd', [])
     assert fix == {'file': 'stored patch'}
     assert not mem.called
+
+def test_analyze_bug_batches_multiple_files(tmp_path):
+    for name in ('a.py', 'b.py'):
+        (tmp_path / name).write_text(name)
+    analyzer = CodeAnalyzer.__new__(CodeAnalyzer)
+    analyzer.tokenizer = DummyTokenizer()
+    analyzer.memory = None
+    analyzer.source_root = tmp_path
+    calls = []
+
+    def shared(prefix, suffixes):
+        calls.append((prefix, suffixes))
+        return [s + 'fix ' + s.split()[1] for s in suffixes]
+
+    analyzer._generate_shared_prefix = shared
+    fix = analyzer.analyze_bug('t', 'd', ['a.py', 'b.py'])
+    assert fix == {'a.py': 'fix a.py', 'b.py': 'fix b.py'}
+    prefix, suffixes = calls[0]
+    assert prefix == 'Bug Title: t\nDescription: d'
+    assert suffixes[1] == '\nFile: b.py\nCode:\nb.py\n# Suggested patch:\n'
+    assert [stats['file'] for stats in analyzer.last_prompt_stats] == ['a.py', 'b.py']
+
+class CharTokenizer:
+    """One token per character; id 3 is end-of-text and doubles as padding."""
+    pad_token_id = None
+    eos_token_id = 3
+
+    def __call__(self, text, return_tensors=None, add_special_tokens=True):
+        ids = [ord(c) for c in text]
+        return types.SimpleNamespace(input_ids=np.array([ids]) if return_tensors else ids)
+
+    def encode(self, text, return_tensors=None, add_special_tokens=True):
+        return self(text, return_tensors).input_ids
+
+    def decode(self, ids, skip_special_tokens=True):
+        return ''.join(chr(i) for i in ids if i != self.eos_token_id)
+
+
+class CachingModel:
+    """Appends one token derived from the unmasked input, checking any prefix cache."""
+
+    def __init__(self, cache=True):
+        self.cache = cache
+        self.batches = []
+
+    def __call__(self, input_ids, use_cache=False):
+        return types.SimpleNamespace(past_key_values=self.Cache(input_ids[0].tolist()) if self.cache else None)
+
+    class Cache:
+        def __init__(self, ids):
+            self.ids, self.batch = ids, 1
+
+        def batch_repeat_interleave(self, n):
+            self.batch *= n
+
+    def generate(self, input_ids, attention_mask=None, past_key_values=None, **kwargs):
+        if attention_mask is None:
+            attention_mask = np.ones_like(input_ids)
+        if past_key_values is not None:
+            assert past_key_values.batch == len(input_ids)
+            assert all(list(row[: len(past_key_values.ids)]) == past_key_values.ids for row in input_ids)
+            self.batches.append(len(input_ids))
+        out = []
+        for row, mask in zip(input_ids, attention_mask):
+            seen = sum(int(t) for t, m in zip(row, mask) if m)
+            out.append(list(row) + [65 + seen % 26])
+        return out
+
+
+def test_generate_shared_prefix_matches_unbatched(monkeypatch):
+    monkeypatch.setattr(analysis, 'torch', types.SimpleNamespace(tensor=np.array))
+    analyzer = CodeAnalyzer.__new__(CodeAnalyzer)
+    analyzer.tokenizer = CharTokenizer()
+    analyzer.model = CachingModel()
+    analyzer.gen_batch_size = 2
+    suffixes = ['\nFile: a.py\n', '\nFile: long_name.py\n', '\nFile: b.py\n']
+    texts = analyzer._generate_shared_prefix('Bug Title: t', suffixes)
+    assert texts == [analyzer._generate('Bug Title: t' + s) for s in suffixes]
+    assert analyzer.model.batches == [2, 1]
+
+    analyzer.model = CachingModel(cache=False)
+    with pytest.raises(analysis.SharedPrefixUnsupported):
+        analyzer._generate_shared_prefix('Bug Title: t', suffixes)
+
+
+def test_generation_batch_size_follows_free_memory(monkeypatch):
+    analyzer = CodeAnalyzer.__new__(CodeAnalyzer)
+    analyzer.model = types.SimpleNamespace(
+        config=types.SimpleNamespace(num_hidden_layers=2, hidden_size=4)
+    )
+    per_seq = 2 * 2 * 4 * (80 + 120) * 4
+    monkeypatch.setattr(analysis, 'available_memory', lambda: per_seq * 6)
+    assert analyzer.batch_size(80) == 3
+    monkeypatch.setattr(analysis, 'available_memory', lambda: 0)
+    assert analyzer.batch_size(80) == 1
+    analyzer.gen_batch_size = 5
+    assert analyzer.batch_size(80) == 5
+
+def test_build_context_keeps_relevant_chunks_within_budget():
+    code = (
+        'import os\n\n'
+        'def load_config(path):\n    return open(path).read()\n\n'
+        'class Parser:\n    def parse_header(self, data):\n        return data[:4]\n\n'
+        'def unrelated():\n    return 42\n'
+    )
+    chunks = split_chunks('m.py', code)
+    assert [c.name for c in chunks] == ['<module>', 'load_config', 'Parser', 'unrelated']
+
+    words = lambda text: len(text.split())
+    same, stats = build_context('m.py', code, 'parse header', 100, words)
+    assert same == code and stats['chunks_used'] == stats['chunks']
+
+    trimmed, stats = build_context('m.py', code, 'Parser.parse_header fails', 8, words)
+    assert 'def parse_header' in trimmed and 'unrelated' not in trimmed
+    assert trimmed.startswith('...\n') and trimmed.endswith('...\n')
+    assert stats['chunks_used'] == 1 and stats['code_tokens'] <= 8
+
+def test_oversized_bug_text_leaves_room_for_code(tmp_path):
+    (tmp_path / 'm.py').write_text('def parse_header(data):\n    return data[:4]\n')
+    analyzer = CodeAnalyzer.__new__(CodeAnalyzer)
+    analyzer.tokenizer = CharTokenizer()
+    analyzer.memory = None
+    analyzer.source_root = tmp_path
+    analyzer.prompt_budget = 200
+    prefixes = []
+
+    def generate(prompt):
+        prefixes.append(prompt.split('\nFile: ')[0])
+        return prompt
+
+    analyzer._generate = generate
+    description = 'Crash in parse_header. ' + 'filler words ' * 500 + 'Traceback: IndexError'
+    analyzer.analyze_bug('Parser fails', description, ['m.py'])
+    (stats,) = analyzer.last_prompt_stats
+    assert stats['prompt_tokens'] <= 200 and stats['chunks_used'] == stats['chunks']
+    prefix = prefixes[0]
+    assert len(prefix) <= 100 and '\n...\n' in prefix
+    assert prefix.startswith('Bug Title: Parser fails') and prefix.endswith('IndexError')
+    # A report within its share is left alone
+    assert analyzer.fit_bug_text('Bug Title: t') == 'Bug Title: t'
+
+
+def test_model_registry_loads_lazily_once(monkeypatch):
+    loads = []
+
+    class FakeModel:
+        @classmethod
+        def from_pretrained(cls, name):
+            loads.append(name)
+            return cls()
+
+        def __call__(self, **inputs):
+            return inputs
+
+    monkeypatch.setitem(models.MODEL_KINDS, 'causal', FakeModel)
+    registry = models.ModelRegistry()
+    monkeypatch.setattr(analysis, 'registry', registry)
+    first = CodeAnalyzer(model_name='m')
+    second = CodeAnalyzer(model_name='m')
+    assert loads == []
+    assert first.model is second.model
+    assert loads == ['m']
+    registry.warm_up('m')
+    assert loads == ['m']
+    [stats] = registry.stats()
+    assert stats['name'] == 'm' and stats['kind'] == 'causal' and stats['load_seconds'] >= 0
+    with pytest.raises(ValueError):
+        registry.model('m', 'seq2seq')
+
+def test_model_registry_int8_backend_quantizes(monkeypatch):
+    monkeypatch.setattr(models, 'quantize', lambda model: ('int8', model))
+    registry = models.ModelRegistry('int8')
+    model = registry.model('m', 'base')
+    assert model[0] == 'int8'
+    assert registry.stats()[0]['backend'] == 'int8'
+    with pytest.raises(ValueError):
+        models.ModelRegistry('tensorrt')
+
+def test_analyze_bug_reuses_cached_results(tmp_path):
+    for name in ('a.py', 'b.py'):
+        (tmp_path / name).write_text(name)
+    analyzer = CodeAnalyzer.__new__(CodeAnalyzer)
+    analyzer.tokenizer = DummyTokenizer()
+    analyzer.memory = None
+    analyzer.source_root = tmp_path
+    analyzer.result_cache = ResultCache(tmp_path / 'cache.db', max_entries=2)
+    generated = []
+
+    def shared(prefix, suffixes):
+        generated.extend(s.split()[1] for s in suffixes)
+        return ['# Suggested patch:\nfix ' + s.split()[1] for s in suffixes]
+
+    analyzer._generate_shared_prefix = shared
+    analyzer._generate = lambda prompt: shared('', [prompt[len('Bug Title: t\nDescription: d'):]])[0]
+    first = analyzer.analyze_bug('t', 'd', ['a.py', 'b.py'])
+    assert analyzer.analyze_bug('t', 'd', ['a.py', 'b.py']) == first
+    assert generated == ['a.py', 'b.py']
+
+    (tmp_path / 'b.py').write_text('changed')
+    assert analyzer.analyze_bug('t', 'd', ['a.py', 'b.py']) == first
+    assert generated == ['a.py', 'b.py', 'b.py']
+    # Only two entries are kept: the stale b.py result was evicted
+    assert len(analyzer.result_cache) == 2
+    assert analyzer.result_cache.hits == 3
+
+def test_memory_reuse_requires_confident_match(tmp_path):
+    mem = SimpleMemory(path=tmp_path / 'memory.json')
+    vectors = {
+        'login crash on save_user': [1.0, 0.0],
+        'export drops last row': [0.6, 0.8],
+        'save_user crashes on login': [0.99, 0.14],
+    }
+    mem._embed = lambda text: vectors[text]
+    mem.add('login crash on save_user', {'user.py': 'fix'})
+    mem.add('export drops last row', {'csv.py': 'fix'})
+    [(entry, score)] = mem.search_scored('save_user crashes on login', top_k=1)
+    assert entry['text'] == 'login crash on save_user' and score == pytest.approx(0.99, abs=1e-3)
+
+    analyzer = CodeAnalyzer.__new__(CodeAnalyzer)
+    analyzer.memory = mem
+    assert analyzer.reusable_solution('save_user crashes on login') == {'user.py': 'fix'}
+    analyzer.reuse_threshold = 0.95
+    assert analyzer.reusable_solution('save_user crashes on login') is None
+
+def test_lexical_rerank_ignores_report_labels():
+    from ai_agent.analysis import bug_content, format_bug_text
+    from ai_agent.memory import lexical_similarity
+
+    login = format_bug_text('Crash on login', 'save_user fails')
+    export = format_bug_text('Export drops row', 'csv writer')
+    assert lexical_similarity(bug_content(login), bug_content(export)) == 0.0
+    assert bug_content(login).split() == ['Crash', 'on', 'login', 'save_user', 'fails']
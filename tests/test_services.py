@@ -1,9 +1,18 @@
 import tests.bootstrap
+import json
+import threading
+import time
+import types
 from unittest.mock import MagicMock
 
+import numpy as np
+import pytest
+
 from bug_analyzer_service import service as bas
 from code_learner_service import service as cls
+from code_learner_service.code_store import CodeStore
 from ai_agent import webhook_server as ws
+from ai_agent.job_queue import JobQueue, QueueFull
 
 
 def test_bug_analyze_endpoint(monkeypatch):
@@ -23,7 +32,8 @@ def test_bug_remember_endpoint(monkeypatch):
     bas.analyzer.remember.assert_called_with("t", "d", {})
 
 
-def test_code_learner_learn(monkeypatch):
+def test_code_learner_learn(monkeypatch, tmp_path):
+    monkeypatch.setattr(cls, "code_memory", CodeStore(tmp_path / "code.db"))
     cls.vector_index = MagicMock()
     client = cls.app.test_client()
     resp = client.post("/learn", json={"file": "x.py", "content": "code"})
@@ -32,20 +42,43 @@ def test_code_learner_learn(monkeypatch):
     cls.vector_index.add_code.assert_called_with("x.py", "code")
 
 
-def test_code_learner_memory_endpoint():
+def test_code_learner_memory_endpoint(monkeypatch, tmp_path):
+    monkeypatch.setattr(cls, "code_memory", CodeStore(tmp_path / "code.db"))
     client = cls.app.test_client()
     cls.code_memory["a"] = "b"
-    resp = client.get("/memory")
-    assert resp.get_json()["a"] == "b"
+    cls.code_memory.update([("c", "b"), ("d", "e")])
+    resp = client.get("/memory?limit=2")
+    page = resp.get_json()
+    assert [f["file"] for f in page["files"]] == ["a", "c"]
+    assert page["next"] == "c" and page["total"] == 3
+    page = client.get("/memory?limit=2&after=c").get_json()
+    assert [f["file"] for f in page["files"]] == ["d"] and page["next"] is None
+    assert client.get("/memory/a").get_json() == {"file": "a", "content": "b"}
+    assert client.get("/memory/missing.py").status_code == 404
+    assert client.get("/memory?limit=ten").status_code == 400
+    lines = client.get("/memory?stream=1").get_data(as_text=True).splitlines()
+    assert [json.loads(line)["file"] for line in lines] == ["a", "c", "d"]
+
+
+def test_code_store_dedupes_and_survives_reopen(tmp_path):
+    store = CodeStore(tmp_path / "code.db")
+    store.update([("a.py", "same"), ("b.py", "same")])
+    store["a.py"] = "changed"
+    del store["b.py"]
+    reopened = CodeStore(tmp_path / "code.db")
+    assert reopened["a.py"] == "changed" and "b.py" not in reopened
+    # The blob shared by a.py and b.py went away with its last reference
+    assert reopened._conn().execute("SELECT COUNT(*) FROM blobs").fetchone()[0] == 1
 
 
 def test_code_learner_query(monkeypatch):
     cls.vector_index = MagicMock()
-    cls.vector_index.query.return_value = ["a.py"]
+    matches = [{"file": "a.py", "score": 0.9, "lines": [[3, 10]]}]
+    cls.vector_index.query_chunks.return_value = matches
     client = cls.app.test_client()
     resp = client.post("/query", json={"query": "text"})
-    assert resp.get_json() == {"files": ["a.py"]}
-    cls.vector_index.query.assert_called_with("text")
+    assert resp.get_json() == {"files": ["a.py"], "matches": matches}
+    cls.vector_index.query_chunks.assert_called_with("text")
 
 
 def test_code_generation(monkeypatch):
@@ -62,3 +95,249 @@ def test_webhook_process(monkeypatch):
     resp = client.post("/webhook", json={"issue": issue, "issue_event_type_name": "created"})
     assert resp.get_json()["status"] == "processed"
     ws.agent.process_bug.assert_called_with(issue)
+
+
+def test_webhook_enqueues_and_reports_job(tmp_path, monkeypatch):
+    done = threading.Event()
+    handled = []
+
+    def handler(issue):
+        handled.append(issue["key"])
+        done.set()
+        return "pr-url"
+
+    queue = JobQueue(tmp_path / "jobs.db", handler, workers=1)
+    monkeypatch.setattr(ws, "jobs", queue)
+    client = ws.app.test_client()
+    issue = {"key": "BUG-2", "fields": {"issuetype": {"name": "Bug"}}}
+    resp = client.post("/webhook", json={"issue": issue, "issue_event_type_name": "created"})
+    assert resp.status_code == 202
+    job_id = resp.get_json()["job_id"]
+    again = client.post("/webhook", json={"issue": issue, "issue_event_type_name": "created"})
+    assert again.get_json() == {"status": "duplicate", "job_id": job_id}
+    assert client.get(f"/jobs/{job_id}").get_json()["status"] == "queued"
+    queue.start()
+    assert done.wait(5)
+    queue.stop(timeout=5)
+    job = client.get(f"/jobs/{job_id}").get_json()
+    assert job["status"] == "done" and job["result"] == "pr-url"
+    assert handled == ["BUG-2"]
+    assert client.get("/jobs/missing").status_code == 404
+
+
+def test_job_queue_bounded_and_durable(tmp_path):
+    path = tmp_path / "jobs.db"
+    queue = JobQueue(path, lambda issue: None, max_pending=1)
+    job_id, created = queue.enqueue({"key": "BUG-1"})
+    assert created
+    with pytest.raises(QueueFull):
+        queue.enqueue({"key": "BUG-2"})
+    queue._claim()  # simulate a crash while the job was running
+    restarted = JobQueue(path, lambda issue: None)
+    assert restarted.get(job_id)["status"] == "queued"
+
+
+def test_code_learner_learn_batch(monkeypatch, tmp_path):
+    monkeypatch.setattr(cls, "code_memory", CodeStore(tmp_path / "code.db"))
+    cls.vector_index = MagicMock()
+    cls.vector_index.add_many.return_value = 2
+    client = cls.app.test_client()
+    files = [{"file": "a.py", "content": "a"}, {"file": "b.py", "content": "b"}]
+    resp = client.post("/learn_batch", json={"files": files})
+    assert resp.get_json() == {"status": "stored", "count": 2}
+    cls.vector_index.add_many.assert_called_with([("a.py", "a"), ("b.py", "b")])
+    assert cls.code_memory["b.py"] == "b"
+    resp = client.post("/learn_batch", json={"files": [{"content": "x"}]})
+    assert resp.status_code == 400
+
+
+def test_code_vector_index_batches_and_defers_persist(tmp_path):
+    from code_learner_service.vector_index import CodeVectorIndex
+
+    index = CodeVectorIndex(str(tmp_path), batch_size=2, flush_interval=60, persist_every=4)
+    index.index = MagicMock()
+    index.add_many([("a.py", "a"), ("b.py", "b"), ("c.py", "c")])
+    assert [len(c.args[0]) for c in index.index.insert_nodes.call_args_list] == [2]
+    index.index.storage_context.persist.assert_not_called()
+    index.add_code("d.py", "d")
+    index.add_code("e.py", "e")
+    assert index.index.insert_nodes.call_count == 2
+    index.index.storage_context.persist.assert_called_once()
+    index.close()
+    assert index.index.insert_nodes.call_count == 3
+    assert index.index.storage_context.persist.call_count == 2
+
+
+def test_code_vector_index_upserts_chunks(tmp_path):
+    from code_learner_service.vector_index import CodeVectorIndex, chunk_id
+
+    index = CodeVectorIndex(str(tmp_path), batch_size=100, persist_every=1)
+    index.index = MagicMock()
+    v1 = "def load():\n    return 1\n\n\ndef save():\n    return 2\n"
+    assert index.add_many([("m.py", v1)]) == 2
+    assert index.add_many([("m.py", v1)]) == 0
+    v2 = "def load():\n    return 1\n\n\ndef save():\n    return 3\n"
+    assert index.add_many([("m.py", v2)]) == 1
+    old_save = chunk_id("m.py", "def save():\n    return 2\n")
+    assert old_save not in [c["id"] for c in index.manifest["m.py"]]
+    index.close()
+    inserted = [d.id_ for call in index.index.insert_nodes.call_args_list for d in call.args[0]]
+    # The retired chunk was dropped before it was ever embedded, so nothing is deleted
+    assert old_save not in inserted and len(inserted) == 2
+    assert not index.tombstones and not index.index.delete_nodes.called
+    new_save = chunk_id("m.py", "def save():\n    return 3\n")
+    index.add_many([("m.py", v1)])
+    index.index.delete_nodes.assert_called_once_with([new_save], delete_from_docstore=True)
+    index.add_many([("m.py", v2)])
+    index.close()
+
+    load_id = chunk_id("m.py", "def load():\n    return 1\n")
+    hit = lambda node_id, score: types.SimpleNamespace(
+        node=types.SimpleNamespace(node_id=node_id, metadata={"file": "m.py"}), score=score
+    )
+    index.embed_model = MagicMock()
+    index.index.as_retriever.return_value.retrieve.return_value = [hit(old_save, 0.95), hit(load_id, 0.8)]
+    assert index.query_chunks("load") == [{"file": "m.py", "score": 0.8, "lines": [[1, 2]]}]
+    index.query_many(["load", "save"])
+    # One retriever, and "load" was embedded only once
+    index.index.as_retriever.assert_called_once_with(similarity_top_k=15)
+    assert index.embed_model.get_query_embedding.call_count == 2
+    assert index.query_cache_hits == 1
+
+    reloaded = CodeVectorIndex(str(tmp_path))
+    assert reloaded.manifest == index.manifest
+
+
+def test_code_vector_index_tombstones_and_compacts(tmp_path):
+    from code_learner_service.vector_index import CodeVectorIndex, chunk_id
+
+    index = CodeVectorIndex(str(tmp_path), batch_size=1, persist_every=1, compact_ratio=0.5)
+    index.index = MagicMock()
+    index.index.delete_nodes.side_effect = NotImplementedError
+    twice = "def f():\n    return 1\n\n\ndef f():\n    return 1\n"
+    index.add_many([("m.py", twice), ("n.py", "def g():\n    return 2\n")])
+    f_id = chunk_id("m.py", "def f():\n    return 1\n")
+    # Identical chunks share one node but keep both line ranges
+    assert [c["id"] for c in index.manifest["m.py"]] == [f_id, f_id]
+    index.add_many([("m.py", "def h():\n    return 3\n")])
+    assert index.tombstones == {f_id}
+    index.add_many([("m.py", twice)])
+    # The retired node still has its vector, so it is revived, not inserted again
+    assert index.tombstones == {chunk_id("m.py", "def h():\n    return 3\n")}
+    inserted = [d.id_ for call in index.index.insert_nodes.call_args_list for d in call.args[0]]
+    assert inserted.count(f_id) == 1
+    hit = types.SimpleNamespace(node=types.SimpleNamespace(node_id=f_id, metadata={"file": "m.py"}), score=0.9)
+    assert index._rank([hit], 3) == [{"file": "m.py", "score": 0.9, "lines": [[1, 2], [5, 6]]}]
+
+    index.add_many([("m.py", "def h():\n    return 3\n")])
+    assert index._compaction_due()
+    old, rebuilt = index.index, MagicMock()
+    inserted = [d.id_ for call in old.insert_nodes.call_args_list for d in call.args[0]]
+    old.index_struct.nodes_dict = {str(row): node_id for row, node_id in enumerate(inserted)}
+    old.docstore.get_node.side_effect = lambda node_id, raise_error: types.SimpleNamespace(
+        id_=node_id, embedding=None
+    )
+    old.vector_store.client.reconstruct.side_effect = lambda row: np.array([float(row)])
+    index._new_index = lambda: rebuilt
+    index.compact()
+    assert index.index is rebuilt and not index.tombstones
+    live = {n.id_: n.embedding for call in rebuilt.insert_nodes.call_args_list for n in call.args[0]}
+    assert sorted(live) == sorted(c["id"] for chunks in index.manifest.values() for c in chunks)
+    # Stored vectors are reused instead of embedding the chunks again
+    assert all(live[node_id] == [float(inserted.index(node_id))] for node_id in live)
+    rebuilt.storage_context.persist.assert_called_once()
+
+
+def test_code_learner_query_batch():
+    cls.vector_index = MagicMock()
+    cls.vector_index.query_many.return_value = [[{"file": "a.py", "score": 1.0, "lines": [[1, 2]]}], []]
+    client = cls.app.test_client()
+    resp = client.post("/query_batch", json={"queries": ["x", "y"], "top_k": 2})
+    assert [r["files"] for r in resp.get_json()["results"]] == [["a.py"], []]
+    cls.vector_index.query_many.assert_called_with(["x", "y"], 2)
+    assert client.post("/query_batch", json={"queries": "x"}).status_code == 400
+    assert client.post("/query_batch", json={"queries": ["x"], "top_k": "all"}).status_code == 400
+    client.post("/query_batch", json={"queries": ["x"], "top_k": 10**9})
+    cls.vector_index.query_many.assert_called_with(["x"], 50)
+
+
+def test_generation_batcher_groups_concurrent_requests():
+    from code_learner_service.batcher import GenerationBatcher, Overloaded
+
+    release = threading.Event()
+    calls = []
+
+    def generate_batch(prompts, max_new_tokens):
+        release.wait(5)
+        calls.append(list(prompts))
+        return [p.upper() for p in prompts]
+
+    batcher = GenerationBatcher(generate_batch, max_batch=3, window=0.05, max_queue=4)
+    first = batcher.submit("a")
+    # Wait until the worker has taken "a" and is generating
+    deadline = time.time() + 5
+    while batcher._queue and time.time() < deadline:
+        time.sleep(0.01)
+    futures = [batcher.submit(p) for p in "bcde"]
+    with pytest.raises(Overloaded):
+        batcher.submit("f")
+    release.set()
+    assert first.result(5) == "A"
+    assert [f.result(5) for f in futures] == ["B", "C", "D", "E"]
+    assert calls == [["a"], ["b", "c", "d"], ["e"]]
+
+
+def test_generation_batcher_fails_short_batches():
+    from code_learner_service.batcher import GenerationBatcher
+
+    batcher = GenerationBatcher(lambda prompts, n: ["only one"], max_batch=2, window=0.05)
+    futures = [batcher.submit(p) for p in "ab"]
+    for future in futures:
+        with pytest.raises(RuntimeError, match="1 completions for 2 prompts"):
+            future.result(5)
+
+
+def test_generate_batch_pads_left_without_touching_tokenizer(monkeypatch):
+    tokenizer = MagicMock(pad_token_id=None, eos_token_id=0, padding_side="right")
+    tokenizer.side_effect = lambda prompts: {"input_ids": [[5] * len(p) for p in prompts]}
+    tokenizer.decode.side_effect = lambda ids, skip_special_tokens: str(ids)
+    model = MagicMock()
+    model.generate.side_effect = lambda **kw: kw["input_ids"]
+    monkeypatch.setattr(cls, "registry", MagicMock(tokenizer=lambda name: tokenizer, model=lambda name, kind: model))
+    monkeypatch.setattr(cls, "torch", types.SimpleNamespace(tensor=lambda rows: rows))
+    assert cls.generate_batch(["ab", "a"]) == ["[5, 5]", "[0, 5]"]
+    kwargs = model.generate.call_args.kwargs
+    assert kwargs["attention_mask"] == [[1, 1], [0, 1]] and kwargs["pad_token_id"] == 0
+    assert tokenizer.padding_side == "right" and tokenizer.pad_token_id is None
+
+
+def test_code_generation_overload_and_stream(monkeypatch):
+    from code_learner_service.batcher import Overloaded
+
+    def overloaded(prompt):
+        raise Overloaded("full")
+
+    monkeypatch.setattr(cls, "generate_code", overloaded)
+    client = cls.app.test_client()
+    assert client.post("/generate", json={"prompt": "p"}).status_code == 503
+
+    monkeypatch.setattr(cls, "stream_slots", threading.BoundedSemaphore(1))
+
+    def stream_code(prompt, slot=None):
+        # Generation finishes (and frees the slot) before the reader is done
+        slot.release()
+        yield from ["x", "y"]
+        if prompt == "bad":
+            raise RuntimeError("generation failed: boom")
+
+    monkeypatch.setattr(cls, "stream_code", stream_code)
+    resp = client.post("/generate", json={"prompt": "p", "stream": True})
+    assert resp.mimetype == "text/event-stream"
+    events = [json.loads(line[6:]) for line in resp.get_data(as_text=True).split("\n\n") if line]
+    assert events == [{"token": "x"}, {"token": "y"}, {"done": True, "completion": "pxy"}]
+    resp = client.post("/generate", json={"prompt": "bad", "stream": True})
+    events = [json.loads(line[6:]) for line in resp.get_data(as_text=True).split("\n\n") if line]
+    assert events == [{"token": "x"}, {"token": "y"}, {"error": "generation failed: boom"}]
+    # Each slot was released exactly once
+    assert cls.stream_slots.acquire(blocking=False)
+    assert not cls.stream_slots.acquire(blocking=False)